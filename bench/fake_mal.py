@@ -0,0 +1,249 @@
+# imports
+
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from os import path
+from random import Random
+from re import compile
+from sys import path as sys_path
+from threading import Lock, Thread
+from time import sleep
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from util.jsonformat import json_indent_len
+
+# static var
+
+fixture_dir = path.join(path.dirname(path.abspath(__file__)), 'fixtures') + '/' # saved MAL pages served by the server
+anime_fixture = 'anime_52991.html'                                   # page served for every anime
+character_fixture = 'characters_52991.html'                          # page served for every /characters page
+anime_path_regex = compile(r'^/anime/(\d+)/[^/]+(/characters)?$')    # pulls the id (and /characters) out of an anime path
+season_path_regex = compile(r'^/anime/season/(\d{4})/(\w+)$')        # pulls the year and season out of a season path
+season_names = ['winter', 'spring', 'summer', 'fall']                # seasons in the order they air within a year
+page_head = '''<!DOCTYPE html>
+<html lang="en">
+<head>
+<meta charset="utf-8">
+<title>{title} - MyAnimeList.net</title>
+</head>
+<body class="page-common">
+<div id="myanimelist">
+  <div id="contentWrapper">
+    <div id="content">
+'''                                                                  # start of every generated page
+page_tail = '''    </div>
+  </div>
+</div>
+</body>
+</html>
+'''                                                                  # end of every generated page
+
+# classes
+
+class FakeMAL :
+    """
+    FakeMAL -- Stand-in for MyAnimeList.net serving an archive of made up
+    seasons along with the saved anime and /characters pages for every anime
+    they list. Responses can be slowed down (latency and jitter) and turned
+    into 429 / 503 responses at a given rate with a Retry-After header so the
+    retry policy and thread counts can be tuned without touching MAL.
+    """
+    def __init__(self,
+                 seasons : int = 8,
+                 anime_per_season : int = 20,
+                 overlap : int = 4,
+                 latency : float = 0.05,
+                 jitter : float = 0.02,
+                 rate_429 : float = 0.0,
+                 rate_503 : float = 0.0,
+                 retry_after : int | None = None,
+                 seed : int = 0) -> None :
+        self.seasons = seasons
+        self.anime_per_season = anime_per_season
+        self.overlap = min(overlap, anime_per_season - 1)
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.rate_503 = rate_503
+        self.retry_after = retry_after
+        self.random = Random(seed)
+        self.lock = Lock()
+        self.base_url = ''
+        self.server = None
+        with open(fixture_dir + anime_fixture, 'rb') as file :
+            self.anime_page = file.read()
+        with open(fixture_dir + character_fixture, 'rb') as file :
+            self.character_page = file.read()
+        self.reset_stats()
+
+    def reset_stats(self) -> None :
+        with self.lock :
+            self.stats = {'requests' : 0, 'statuses' : {}, 'kinds' : {}, 'repeated' : 0}
+            self.seen_paths = set()
+
+    def get_stats(self) -> dict :
+        with self.lock :
+            return dict(self.stats, statuses=dict(self.stats['statuses']), kinds=dict(self.stats['kinds']))
+
+    def season_list(self) -> list[tuple[int, str]] :
+        # count back one season at a time from fall 2023
+        return [(2023 + (3 - i) // 4, season_names[(3 - i) % 4]) for i in range(self.seasons)]
+
+    def season_anime_ids(self, year : int, season_name : str) -> list[int] :
+        # neighbouring seasons share the overlap (like continuing and multi-cour shows)
+        index = self.season_list().index((year, season_name))
+        start = 1 + index * (self.anime_per_season - self.overlap)
+        return list(range(start, start + self.anime_per_season))
+
+    def archive_page(self) -> bytes :
+        links = ''.join(f'          <a href="{self.base_url}/anime/season/{year}/{season_name}">{season_name.capitalize()} {year}</a>\n'
+                        for year, season_name in self.season_list())
+        return (page_head.format(title='Anime Seasons Archive') +
+                '      <table class="anime-seasonal-byseason mt8 mb16">\n        <tr><td>\n' +
+                links +
+                '        </td></tr>\n      </table>\n' +
+                page_tail).encode()
+
+    def season_page(self, year : int, season_name : str) -> bytes :
+        entries = ''.join(f'''          <div class="js-anime-category-producer seasonal-anime js-seasonal-anime js-anime-type-all js-anime-type-1">
+            <div class="title"><div class="title-text"><h2 class="h2_anime_title"><a href="{self.base_url}/anime/{anime_id}/Fake_Anime_{anime_id}" class="link-title">Fake Anime {anime_id}</a></h2></div></div>
+          </div>
+''' for anime_id in self.season_anime_ids(year, season_name))
+        return (page_head.format(title=f'{season_name.capitalize()} {year} Anime') +
+                '      <div class="js-categories-seasonal">\n' +
+                '        <div class="seasonal-anime-list js-seasonal-anime-list js-seasonal-anime-list-key-1">\n' +
+                '          <div class="anime-header">TV (New)</div>\n' +
+                entries +
+                '        </div>\n      </div>\n' +
+                page_tail).encode()
+
+    def route(self, request_path : str) -> tuple[str, bytes | None] :
+        if request_path == '/anime/season/archive' :
+            return ('archive', self.archive_page())
+        match = season_path_regex.match(request_path)
+        if match is not None and (int(match.group(1)), match.group(2)) in self.season_list() :
+            return ('season', self.season_page(int(match.group(1)), match.group(2)))
+        match = anime_path_regex.match(request_path)
+        if match is not None :
+            if match.group(2) is not None :
+                return ('characters', self.character_page)
+            return ('anime', self.anime_page)
+        return ('unknown', None)
+
+    def pick_fault(self) -> tuple[int, float] :
+        with self.lock :
+            roll = self.random.random()
+            delay = max(0.0, self.latency + self.random.uniform(-self.jitter, self.jitter))
+        if roll < self.rate_429 :
+            return (429, delay)
+        if roll < self.rate_429 + self.rate_503 :
+            return (503, delay)
+        return (200, delay)
+
+    def count(self, request_path : str, kind : str, status : int) -> None :
+        with self.lock :
+            self.stats['requests'] += 1
+            self.stats['statuses'][str(status)] = self.stats['statuses'].get(str(status), 0) + 1
+            self.stats['kinds'][kind] = self.stats['kinds'].get(kind, 0) + 1
+            if request_path in self.seen_paths :
+                self.stats['repeated'] += 1
+            self.seen_paths.add(request_path)
+
+    def start(self, host : str = '127.0.0.1', port : int = 0) -> str :
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler) :
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self) -> None :
+                request_path = self.path.split('?')[0]
+                kind, body = fake.route(request_path)
+                status, delay = fake.pick_fault()
+                if body is None :
+                    status = 404
+                sleep(delay)
+                fake.count(request_path, kind, status)
+
+                self.send_response(status)
+                if status in [429, 503] and fake.retry_after is not None :
+                    self.send_header('Retry-After', str(fake.retry_after))
+                body = body if status == 200 else b''
+                self.send_header('Content-Type', 'text/html; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args) -> None :
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.base_url = f'http://{host}:{self.server.server_address[1]}'
+        Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    def stop(self) -> None :
+        if self.server is not None :
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+# functions
+
+def add_server_arguments(p : argparse.ArgumentParser) -> None :
+    """
+    add_server_arguments -- This function adds the flags shaping the stand-in
+    server to a parser so the server and the load harness share them.
+
+    Arguments:
+        p -- The parser the flags are added to
+    """
+    p.add_argument('--seasons', help='seasons listed on the archive page', type=int, default=8)
+    p.add_argument('--anime-per-season', help='anime listed on each season page', type=int, default=20)
+    p.add_argument('--overlap', help='anime each season shares with the next one', type=int, default=4)
+    p.add_argument('--latency', help='seconds every response is held back', type=float, default=0.05)
+    p.add_argument('--jitter', help='seconds the latency is randomly moved by either way', type=float, default=0.02)
+    p.add_argument('--rate-429', help='fraction of requests answered with 429 Too Many Requests', type=float, default=0.0)
+    p.add_argument('--rate-503', help='fraction of requests answered with 503 Service Unavailable', type=float, default=0.0)
+    p.add_argument('--retry-after', help='seconds sent in the Retry-After header of 429 / 503 responses (default none)', type=int, default=None)
+    p.add_argument('--seed', help='seed of the latency and fault rolls', type=int, default=0)
+
+def make_server(args : argparse.Namespace) -> FakeMAL :
+    """
+    make_server -- This function makes the stand-in server from the flags added
+    by add_server_arguments.
+
+    Arguments:
+        args -- The parsed flags
+
+    Returns:
+        The FakeMAL object (not started yet).
+    """
+    return FakeMAL(seasons=args.seasons,
+                   anime_per_season=args.anime_per_season,
+                   overlap=args.overlap,
+                   latency=args.latency,
+                   jitter=args.jitter,
+                   rate_429=args.rate_429,
+                   rate_503=args.rate_503,
+                   retry_after=args.retry_after,
+                   seed=args.seed)
+
+# app
+if __name__ == '__main__' :
+    p = argparse.ArgumentParser()
+    p.add_argument('--port', help='port to listen on', type=int, default=8080)
+    add_server_arguments(p)
+    args = p.parse_args()
+
+    fake = make_server(args)
+    base_url = fake.start(port=args.port)
+    print(f'serving a fake MAL at {base_url} (run scrubber.py --base-url {base_url}), ctrl-c prints the stats and stops')
+    try :
+        while True :
+            sleep(3600)
+    except KeyboardInterrupt :
+        fake.stop()
+        print(dumps(fake.get_stats(), indent=json_indent_len))
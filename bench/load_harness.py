@@ -0,0 +1,166 @@
+# imports
+
+import argparse
+import subprocess
+import sys
+from json import dumps, load
+from os import path
+from tempfile import TemporaryDirectory
+from time import monotonic
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from fake_mal import FakeMAL, add_server_arguments, make_server
+from util.jsonformat import json_indent_len
+
+# static var
+
+scrubber_path = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'scrubber.py') # script the harness runs
+harness_modes = ['disk', 'segments', 'mongo', 'mongomock']           # storage every run can be pointed at
+mongomock_bootstrap = '''
+import runpy, sys
+from os import path
+import mongomock, pymongo
+import mongomock.collection
+
+# newer pymongo hands a sort to every bulk update which mongomock doesn't take
+def drop_sort(method) :
+    return lambda self, *args, sort=None, **kwargs : method(self, *args, **kwargs)
+mongomock.collection.BulkOperationBuilder.add_update = drop_sort(mongomock.collection.BulkOperationBuilder.add_update)
+mongomock.collection.BulkOperationBuilder.add_replace = drop_sort(mongomock.collection.BulkOperationBuilder.add_replace)
+
+pymongo.MongoClient = mongomock.MongoClient
+sys.argv = sys.argv[1:]
+sys.path.insert(0, path.dirname(path.abspath(sys.argv[0])))
+runpy.run_path(sys.argv[0], run_name='__main__')
+'''                                                                  # starts scrubber.py with mongomock standing in for pymongo
+
+# functions
+
+def build_command(mode : str, base_url : str, stats_path : str, args : argparse.Namespace) -> list[str] :
+    """
+    build_command -- This function makes the command line of one scrubber.py
+    run against the stand-in server.
+
+    Arguments:
+        mode -- Storage the run writes to (found in harness_modes)
+        base_url -- Url of the stand-in server
+        stats_path -- File scrubber.py writes its summary to
+        args -- The parsed flags of the harness
+
+    Returns:
+        The command as a list of arguments.
+    """
+    command = [sys.executable, scrubber_path,
+               '--base-url', base_url,
+               '--stats-file', stats_path,
+               '--retry-time', str(args.retry_time),
+               '--rate', str(args.rate),
+               '--burst', str(args.burst),
+               '--engine', args.engine]
+    if args.retry_backoff is not None :
+        command += ['--retry-backoff', str(args.retry_backoff)]
+    if args.workers is not None :
+        command += ['--workers', str(args.workers)]
+    if mode == 'segments' :
+        command += ['--store', 'segments']
+    if mode in ['mongo', 'mongomock'] :
+        command += ['-m', '--reset', '--mongo-host', args.mongo_host]
+    if mode == 'mongomock' :
+        command = [sys.executable, '-c', mongomock_bootstrap] + command[1:]
+    return command + args.scrubber_arg
+
+def run_mode(fake : FakeMAL, mode : str, args : argparse.Namespace) -> dict :
+    """
+    run_mode -- This function runs scrubber.py once against the stand-in server
+    inside of a scratch directory (so disk runs always start from nothing) and
+    gathers what both sides saw.
+
+    Arguments:
+        fake -- The running stand-in server
+        mode -- Storage the run writes to (found in harness_modes)
+        args -- The parsed flags of the harness
+
+    Returns:
+        Dictionary holding the summary written by scrubber.py, the stats of the
+        server and the wall time of the whole process.
+    """
+    fake.reset_stats()
+    with TemporaryDirectory() as work_dir :
+        stats_path = path.join(work_dir, 'stats.json')
+        start = monotonic()
+        process = subprocess.run(build_command(mode, fake.base_url, stats_path, args),
+                                 cwd=work_dir,
+                                 stdout=None if args.verbose else subprocess.DEVNULL)
+        wall = monotonic() - start
+
+        scrubber_stats = {}
+        if path.exists(stats_path) :
+            with open(stats_path, 'r') as file :
+                scrubber_stats = load(file)
+    return {
+        'mode' : mode,
+        'exit_code' : process.returncode,
+        'wall_seconds' : round(wall, 3),
+        'scrubber' : scrubber_stats,
+        'server' : fake.get_stats(),
+    }
+
+def print_report(result : dict) -> None :
+    """
+    print_report -- This function prints the numbers of one run.
+
+    Arguments:
+        result -- What run_mode gave back
+    """
+    scrubber_stats, server_stats = result['scrubber'], result['server']
+    wall = result['wall_seconds']
+    throttled = server_stats['statuses'].get('429', 0) + server_stats['statuses'].get('503', 0)
+    print(f'mode {result["mode"]} (exit code {result["exit_code"]})')
+    print(f'    wall time        {wall:10.2f} s')
+    print(f'    requests         {server_stats["requests"]:10} ({server_stats["requests"] / wall:.1f}/s, {throttled} answered with 429/503)')
+    print(f'    pages            {dumps(server_stats["kinds"])}')
+    print(f'    repeated urls    {server_stats["repeated"]:10} (requests the server had already seen)')
+    if len(scrubber_stats) > 0 :
+        print(f'    queued retries   {scrubber_stats["queued_retries"]:10} ({scrubber_stats["dead_letters"]} dead letters)')
+        print(f'    rate limit sleep {scrubber_stats["rate_limit_wait_seconds"]:10.2f} s (summed over every thread)')
+        print(f'    backoff sleep    {scrubber_stats["backoff_seconds"]:10.2f} s')
+        print(f'    anime scheduled  {scrubber_stats["anime_scheduled"]:10}')
+
+# app
+if __name__ == '__main__' :
+    p = argparse.ArgumentParser(description='run scrubber.py against a local stand-in for MAL and report how it went')
+    p.add_argument('--mode', help='storage to run against, can be given more than once (mongo needs --mongo-host pointed at a scratch instance since it is wiped)', choices=harness_modes, action='append')
+    p.add_argument('--mongo-host', help='connection string of the scratch mongodb instance used by mongo mode', default=None)
+    p.add_argument('--engine', help='engine scrubber.py crawls with', choices=['thread', 'async'], default='thread')
+    p.add_argument('--workers', help='threads used by the thread engine', type=int, default=None)
+    p.add_argument('--rate', help='max requests per second scrubber.py sends', type=float, default=50.0)
+    p.add_argument('--burst', help='max requests sent back to back before the rate applies', type=float, default=10.0)
+    p.add_argument('--retry-time', help='seconds a failed call waits in the retry queue', type=float, default=5.0)
+    p.add_argument('--retry-backoff', help='backoff factor of the retry policy (default left as tuned for MAL)', type=float, default=0.2)
+    p.add_argument('--scrubber-arg', help='extra flag handed to scrubber.py, can be given more than once (like --scrubber-arg=--parse-processes=2)', action='append', default=[])
+    p.add_argument('--json', help='file the results of every run are written to', default=None)
+    p.add_argument('-v', '--verbose', help='show the output of scrubber.py', action='store_true')
+    add_server_arguments(p)
+    args = p.parse_args()
+
+    modes = args.mode or ['disk']
+    if 'mongo' in modes and args.mongo_host is None :
+        p.error('mongo mode wipes the database so it needs --mongo-host pointed at a scratch instance')
+    args.mongo_host = args.mongo_host or 'mongodb://localhost:27017/'
+
+    fake = make_server(args)
+    fake.start()
+    results = []
+    try :
+        for mode in modes :
+            result = run_mode(fake, mode, args)
+            print_report(result)
+            results.append(result)
+    finally :
+        fake.stop()
+
+    if args.json is not None :
+        with open(args.json, 'w') as file :
+            file.write(dumps(results, indent=json_indent_len))
+    exit(max(result['exit_code'] for result in results))
@@ -0,0 +1,244 @@
+# imports
+
+import argparse
+import gc
+import tracemalloc
+from json import dumps, load
+from os import path
+from sys import path as sys_path
+from tempfile import TemporaryDirectory
+from time import perf_counter
+from typing import Any, Callable
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from parser_bench import extract_fixture, fixture_dir, fixture_url, list_fixtures
+from util.anime import get_anime_information_section, get_anime_information_section_css, get_anime_synopsis_section, get_anime_synopsis_section_css, parse_anime_character_staff_section
+from util.datenow import get_datetime_now
+from util.diskstore import write_json
+from util.jsonformat import json_indent_len
+from util.mongodb import with_mongo_datetimes
+from util.parser import make_soup, parser_backends, set_parser_backend, uses_css_backend
+from util.season import parse_season_anime_links
+from util.segmentstore import SegmentStore
+
+try :
+    import bson
+except ImportError :
+    bson = None
+
+# static var
+
+baseline_path = path.join(path.dirname(path.abspath(__file__)), 'baseline.json') # saved timings every run is checked against
+storage_label = 'storage'                                            # backend column of the write path stages
+reference_loop = 20_000                                              # iterations of the loop every stage is measured against
+timing_floor_us = 50.0                                               # stages faster than this are too noisy to check the time of
+
+# functions
+
+def time_reference(rounds : int) -> float :
+    """
+    time_reference -- This function times a fixed pure python loop. Stages are
+    compared against the baseline in units of this loop so a machine that is
+    slower (or busier) than the one the baseline was saved on doesn't read as
+    a regression.
+
+    Arguments:
+        rounds -- Number of timed runs of the loop
+
+    Returns:
+        The fastest microseconds per run of the loop.
+    """
+    timings = []
+    for _ in range(rounds) :
+        start = perf_counter()
+        sum(i * i for i in range(reference_loop))
+        timings.append(perf_counter() - start)
+    return min(timings) * 1_000_000
+
+def time_stage(setup : Callable[[], Any], func : Callable[[Any], Any], rounds : int) -> tuple[float, int] :
+    """
+    time_stage -- This function times one stage on its own. The setup (like
+    building the tree an extractor reads) is done before the clock starts so
+    only the stage is counted, the garbage collector is held off while the
+    clock runs (like timeit) and the bytes allocated by one call are traced
+    apart from the timed rounds so tracing doesn't slow them down.
+
+    Arguments:
+        setup -- Function making the argument handed to the stage each round
+        func -- The stage
+        rounds -- Number of timed calls
+
+    Returns:
+        A tuple containing the fastest microseconds per call and the peak bytes
+        allocated by a call.
+    """
+    # time every round by itself and keep the fastest (the others only add the noise of the machine)
+    timings = []
+    for _ in range(rounds) :
+        arg = setup()
+        gc.collect()
+        gc.disable()
+        start = perf_counter()
+        func(arg)
+        timings.append(perf_counter() - start)
+        gc.enable()
+
+    # trace what a single call allocates
+    arg = setup()
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    func(arg)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return (min(timings) * 1_000_000, peak - before)
+
+def parse_stages(file_name : str, content : bytes) -> dict[str, tuple[Callable, Callable]] :
+    """
+    parse_stages -- This function makes the stages run over a fixture for the
+    backend in use: the whole page along with every extractor it is made of.
+
+    Arguments:
+        file_name -- Name of the fixture file (anime_, characters_ or season_)
+        content -- The content of the fixture
+
+    Returns:
+        Dictionary of stage names to a tuple holding the setup and the stage.
+    """
+    stages = {'page' : (lambda : content, lambda page : extract_fixture(file_name, page))}
+    if file_name.startswith('anime_') :
+        information_func = get_anime_information_section_css if uses_css_backend() else get_anime_information_section
+        synopsis_func = get_anime_synopsis_section_css if uses_css_backend() else get_anime_synopsis_section
+        stages['make_soup'] = (lambda : content, make_soup)
+        stages['information'] = (lambda : make_soup(content), lambda soup : information_func({'url' : fixture_url}, soup))
+        stages['synopsis'] = (lambda : make_soup(content), lambda soup : synopsis_func({'url' : fixture_url}, soup))
+    elif file_name.startswith('characters_') :
+        stages['character_staff'] = (lambda : content, lambda page : parse_anime_character_staff_section(fixture_url, page))
+    elif file_name.startswith('season_') :
+        stages['season_links'] = (lambda : content, parse_season_anime_links)
+    return stages
+
+def storage_stages(document : dict, data_path : str) -> dict[str, tuple[Callable, Callable]] :
+    """
+    storage_stages -- This function makes the stages writing a parsed document
+    through each write path: a json file, a segment record and the bson
+    encoding done by the mongodb driver (no server is needed for it).
+
+    Arguments:
+        document -- The document about to be written
+        data_path -- Scratch directory the disk stages write to
+
+    Returns:
+        Dictionary of stage names to a tuple holding the setup and the stage.
+    """
+    segment_store = SegmentStore(data_path)
+    stages = {
+        'json_write' : (lambda : document, lambda doc : write_json(data_path + 'bench.json', doc, 0)),
+        'segment_append' : (lambda : document, lambda doc : segment_store.append(0, doc)),
+    }
+    if bson is not None :
+        stages['mongo_encode'] = (lambda : document, lambda doc : bson.encode(with_mongo_datetimes(doc)))
+    return stages
+
+def run_micro_bench(backends : list[str], rounds : int) -> dict[str, dict] :
+    """
+    run_micro_bench -- This function runs every stage over every fixture and
+    prints microseconds per call, calls per second and bytes allocated.
+
+    Arguments:
+        backends -- Names of the backends to run
+        rounds -- Number of timed calls of each stage
+
+    Returns:
+        Dictionary of backend/fixture/stage keys to their us, cost relative to
+        the reference loop and bytes.
+    """
+    results = {}
+    print(f'{"backend":12} {"fixture":32} {"stage":16} {"us/call":>10} {"calls/s":>9} {"relative":>9} {"KiB/call":>9}')
+
+    def record(backend : str, file_name : str, stage : str, us : float, allocated : int) -> None :
+        # the reference loop is timed next to every stage so both see the same machine load
+        relative = us / time_reference(rounds)
+        results[f'{backend}/{file_name}/{stage}'] = {'us' : round(us, 1), 'relative' : round(relative, 4), 'bytes' : allocated}
+        print(f'{backend:12} {file_name:32} {stage:16} {us:10.1f} {1_000_000 / us:9.1f} {relative:9.3f} {allocated / 1024:9.1f}')
+
+    # parse stages for every backend
+    for backend in backends :
+        try :
+            set_parser_backend(backend)
+        except ImportError as e :
+            print(f'{backend:12} skipped ({e})')
+            continue
+        for file_name in list_fixtures() :
+            with open(fixture_dir + file_name, 'rb') as file :
+                content = file.read()
+            for stage, (setup, func) in parse_stages(file_name, content).items() :
+                record(backend, file_name, stage, *time_stage(setup, func, rounds))
+
+    # write path stages over what the default backend parsed out of every fixture
+    set_parser_backend('html.parser')
+    with TemporaryDirectory() as data_dir :
+        for file_name in list_fixtures() :
+            with open(fixture_dir + file_name, 'rb') as file :
+                document = {'_id' : 0, 'url' : fixture_url, 'datetime_filled' : get_datetime_now()}
+                document.update(extract_fixture(file_name, file.read()))
+            for stage, (setup, func) in storage_stages(document, data_dir + '/').items() :
+                record(storage_label, file_name, stage, *time_stage(setup, func, rounds))
+    return results
+
+def check_baseline(results : dict[str, dict], tolerance : float) -> int :
+    """
+    check_baseline -- This function compares a run against the saved baseline
+    and prints every stage that got slower (relative to the reference loop) or
+    allocates more than the tolerance allows. Stages missing from either side
+    are skipped.
+
+    Arguments:
+        results -- What run_micro_bench gave back
+        tolerance -- Ratio over the baseline a stage may reach (2.0 is twice)
+
+    Returns:
+        Number of regressions.
+    """
+    with open(baseline_path, 'r') as file :
+        baseline = load(file)
+
+    regressions = 0
+    for key, result in results.items() :
+        if key not in baseline :
+            continue
+        saved = baseline[key]
+        if result['relative'] > saved['relative'] * tolerance and result['us'] > timing_floor_us :
+            print(f'REGRESSION {key} costs {result["relative"]:.3f} reference loops (baseline {saved["relative"]:.3f})')
+            regressions += 1
+        if result['bytes'] > saved['bytes'] * tolerance :
+            print(f'REGRESSION {key} allocates {result["bytes"]} bytes (baseline {saved["bytes"]} bytes)')
+            regressions += 1
+    return regressions
+
+# app
+if __name__ == '__main__' :
+    p = argparse.ArgumentParser()
+    p.add_argument('-b', '--backend', help='backend to run (default every backend)', choices=parser_backends, action='append')
+    p.add_argument('-r', '--rounds', help='timed calls of each stage', type=int, default=30)
+    p.add_argument('--tolerance', help='ratio over the baseline a stage may reach before it fails', type=float, default=2.0)
+    p.add_argument('--save-baseline', help='save this run as the baseline instead of checking against it', action='store_true')
+    args = p.parse_args()
+
+    results = run_micro_bench(args.backend or parser_backends, args.rounds)
+    if args.save_baseline :
+        with open(baseline_path, 'w') as file :
+            file.write(dumps(results, indent=json_indent_len, sort_keys=True))
+        print(f'wrote {baseline_path}')
+        exit(0)
+
+    if not path.exists(baseline_path) :
+        print('no baseline saved yet (run with --save-baseline)')
+        exit(0)
+    regressions = check_baseline(results, args.tolerance)
+    if regressions > 0 :
+        print(f'{regressions} stages regressed past {args.tolerance}x the baseline')
+        exit(1)
+    print('every stage is within the baseline')
+    exit(0)
@@ -0,0 +1,127 @@
+# imports
+
+import argparse
+from json import dumps
+from os import listdir, path
+from sys import path as sys_path
+from time import perf_counter
+
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from util.anime import parse_anime_page, parse_anime_character_staff_section
+from util.jsonformat import json_indent_len
+from util.parser import parser_backends, set_parser_backend
+from util.season import parse_season_anime_links
+
+# static var
+
+fixture_dir = path.join(path.dirname(path.abspath(__file__)), 'fixtures') + '/' # saved MAL pages used by the bench
+golden_dir = fixture_dir + 'golden/'                                 # expected output of every saved page
+fixture_url = 'https://myanimelist.net/anime/0/fixture'              # url handed to the extractors for prints
+
+# functions
+
+def extract_fixture(file_name : str, content : bytes) -> dict :
+    """
+    extract_fixture -- This function runs the extractor matching the kind of
+    page the fixture holds. The kind is the prefix of the file name.
+
+    Arguments:
+        file_name -- Name of the fixture file (anime_, characters_ or season_)
+        content -- The content of the fixture
+
+    Returns:
+        Dictionary holding everything the extractors pulled out of the page.
+    """
+    if file_name.startswith('anime_') :
+        anime_entry = {'url' : fixture_url}
+        parse_anime_page(anime_entry, content)
+        anime_entry.pop('url')
+        return anime_entry
+    if file_name.startswith('characters_') :
+        char_dict, staff_dict = parse_anime_character_staff_section(fixture_url, content)
+        return {'characters' : char_dict, 'staff' : staff_dict}
+    if file_name.startswith('season_') :
+        return {'seasonal_anime' : [list(link) for link in parse_season_anime_links(content)]}
+    raise ValueError(f'unknown fixture kind {file_name}')
+
+def list_fixtures() -> list[str] :
+    """
+    list_fixtures -- This function lists every saved page that has an extractor.
+
+    Returns:
+        Sorted list of fixture file names.
+    """
+    return sorted([
+        file for file in listdir(fixture_dir)
+        if file.endswith('.html') and file.split('_')[0] in ['anime', 'characters', 'season']
+    ])
+
+def golden_file_name(file_name : str) -> str :
+    """
+    golden_file_name -- This function makes the name of the expected output of
+    a fixture.
+
+    Arguments:
+        file_name -- Name of the fixture file
+
+    Returns:
+        Path of the golden file.
+    """
+    return golden_dir + file_name.replace('.html', '.json')
+
+def update_golden() -> None :
+    """
+    update_golden -- This function rewrites every golden file using the
+    html.parser backend that all other backends are compared against.
+    """
+    set_parser_backend('html.parser')
+    for file_name in list_fixtures() :
+        with open(fixture_dir + file_name, 'rb') as file :
+            result = extract_fixture(file_name, file.read())
+        with open(golden_file_name(file_name), 'w') as file :
+            file.write(dumps(result, indent=json_indent_len, ensure_ascii=False))
+        print(f'wrote {golden_file_name(file_name)}')
+
+def run_bench(backends : list[str], rounds : int) -> None :
+    """
+    run_bench -- This function times the parse of every fixture with every
+    backend. The output of each backend is checked against the golden files by
+    tests/test_parser_golden.py.
+
+    Arguments:
+        backends -- Names of the backends to time
+        rounds -- Number of times each fixture is parsed for the timing
+    """
+    print(f'{"backend":12} {"fixture":32} {"ms/page":>9} {"pages/s":>9}')
+    for backend in backends :
+        try :
+            set_parser_backend(backend)
+        except ImportError as e :
+            print(f'{backend:12} skipped ({e})')
+            continue
+
+        for file_name in list_fixtures() :
+            with open(fixture_dir + file_name, 'rb') as file :
+                content = file.read()
+
+            # time the extractor
+            start = perf_counter()
+            for _ in range(rounds) :
+                extract_fixture(file_name, content)
+            elapsed = (perf_counter() - start) / rounds
+            print(f'{backend:12} {file_name:32} {elapsed * 1000:9.3f} {1 / elapsed:9.1f}')
+
+# app
+if __name__ == '__main__' :
+    p = argparse.ArgumentParser()
+    p.add_argument('-b', '--backend', help='backend to time (default every backend)', choices=parser_backends, action='append')
+    p.add_argument('-r', '--rounds', help='times each fixture is parsed for the timing', type=int, default=50)
+    p.add_argument('--update-golden', help='rewrite the golden files with the html.parser backend', action='store_true')
+    args = p.parse_args()
+
+    if args.update_golden :
+        update_golden()
+        exit(0)
+
+    run_bench(args.backend or parser_backends, args.rounds)
@@ -6,68 +6,263 @@ import argparse
 p = argparse.ArgumentParser()
 p.add_argument('-t', '--threadinfo', help='enable thread info in terminal upon calls', action='store_true')
 p.add_argument('-m', '--mongodb', help='enable mongodb connection (no disk writing)', action='store_true')
+p.add_argument('--pool-maxsize', help='max keep-alive connections kept by each thread session', type=int, default=10)
+p.add_argument('--rate', help='max requests per second sent to MAL across all threads', type=float, default=2.0)
+p.add_argument('--burst', help='max requests sent back to back before the rate applies', type=float, default=4.0)
+p.add_argument('--workers', help='threads in the pool used by the thread engine (default picked by python)', type=int, default=None)
+p.add_argument('--window', help='max calls in flight in the thread engine; more work is only read once a call finishes', type=int, default=64)
+p.add_argument('--engine', help='crawl with a pool of threads or a single asyncio event loop', choices=['thread', 'async'], default='thread')
+p.add_argument('--concurrency', help='max requests in flight when using the async engine', type=int, default=32)
+p.add_argument('--parser', help='backend used to parse every page', choices=['html.parser', 'lxml', 'selectolax'], default='html.parser')
+p.add_argument('--parse-processes', help='processes parsing pages apart from the I/O workers (default 0, parse in the I/O workers)', type=int, default=0)
+p.add_argument('--parse-queue', help='max pages waiting on a parser process or the writer', type=int, default=64)
+p.add_argument('--mongo-pool-size', help='max connections kept by the shared mongodb client', type=int, default=100)
+p.add_argument('--compact-json', help='write disk documents without indents (smaller and faster to write)', action='store_true')
+p.add_argument('--store', help='keep disk documents in one json file each or appended to rotating jsonl segments', choices=['files', 'segments'], default='files')
+p.add_argument('--segment-compression', help='compression applied to every record of a segment', choices=['none', 'gzip', 'zstd'], default='none')
+p.add_argument('--reset', help='wipe every stored season and anime before crawling', action='store_true')
+p.add_argument('--incremental', help='only fetch entries never filled or filled longer ago than --max-age', action='store_true')
+p.add_argument('--max-age', help='age an entry is fetched again at in incremental mode (like 12h, 7d or 2w)', default='7d')
+p.add_argument('--http-cache', help='directory of the http cache used to send conditional requests (default off)', default=None)
+p.add_argument('--cache-ttl', help='age a cached page is served at without asking MAL (like 12h or 7d, forever for offline replays)', default='0')
+p.add_argument('--archive-pages', help='directory the raw season and anime pages are archived to (default off)', default=None)
+p.add_argument('--replay', help='parse every page of a raw page archive again instead of crawling MAL', default=None)
+p.add_argument('--replay-processes', help='worker processes parsing pages in replay mode (default one per cpu)', type=int, default=None)
+p.add_argument('--recent-seasons', help='only crawl the current and previous season (and their anime)', action='store_true')
+p.add_argument('--base-url', help='site the archive page is fetched from (like a local stand-in for MAL)', default='https://myanimelist.net')
+p.add_argument('--retry-time', help='seconds a failed call waits in the retry queue before it is ran again', type=float, default=3 * 60)
+p.add_argument('--retry-backoff', help='backoff factor of the retry policy (default left as tuned for MAL)', type=float, default=None)
+p.add_argument('--mongo-host', help='connection string of the mongodb instance', default='mongodb://localhost:27017/')
+p.add_argument('--stats-file', help='file a json summary of the run (wall time, requests, retries and time slept) is written to', default=None)
+p.add_argument('--metrics-port', help='port the metrics are served on in the prometheus text format at /metrics (default off)', type=int, default=None)
+p.add_argument('--metrics-file', help='file a json snapshot of the metrics is written to every --metrics-interval seconds (default off)', default=None)
+p.add_argument('--metrics-interval', help='seconds between json snapshots of the metrics', type=float, default=10.0)
+p.add_argument('--profile', help='sample the cpu and memory of every stage and write PROFILE.folded (flamegraph) and PROFILE.txt (best with --http-cache and --cache-ttl forever or --replay, pages are parsed in this process)', default=None)
+p.add_argument('--job-queue', help='put the seasons into the mongodb job queue (enqueue) or claim and run jobs from it (work) so any number of workers on any number of machines share the crawl', choices=['enqueue', 'work'], default=None)
+p.add_argument('--job-batch', help='jobs a worker claims at once', type=int, default=16)
+p.add_argument('--lease-time', help='seconds a claimed job is held without a heartbeat before another worker can reclaim it', type=float, default=5 * 60)
+p.add_argument('--worker-id', help='name a worker holds its leases under (default host name and process id)', default=None)
+p.add_argument('--profile-frames', help='frames tracemalloc keeps for each allocation while profiling (0 turns it off for cpu times without its overhead)', type=int, default=25)
 args = p.parse_args()
+if args.job_queue is not None and not args.mongodb :
+    p.error('--job-queue needs -m since disk storage is only safe inside of one process')
 
 # app
 if __name__ == '__main__' :
     # local imports
+    from asyncio import run
     from concurrent.futures import ThreadPoolExecutor
-    from json import load
-    from os import listdir
-    from util.anime import get_anime_entry
-    from util.init import *
-    from util.mongodb import generate_cursor, mongodb_database_name, mongodb_season_collection
-    from util.season import get_season_entry, make_archive_list_to_csv, archive_file, season_dir
-
-    # make the csv of season names and urls from the archive
-    make_archive_list_to_csv(True, args.threadinfo)
-    
-    # get data on every season and upload them to mongodb
-    with open(season_dir + archive_file, 'r') as file :
-        with ThreadPoolExecutor() as executor :
-            [
-                executor.submit(get_season_entry,
-                                line.strip().split(', ')[0],
-                                line.strip().split(', ')[1],
-                                args.threadinfo,
-                                args.mongodb)
-                for line in file.readlines()
-            ]
-
-    # go through each file in season_data and fill in anime data entries if any are present
+    from datetime import datetime
+    from json import dumps
+    from time import monotonic
+    from util.anime import get_anime_entry, find_stale_anime_ids, start_character_executor, stop_character_executor
+    from util.asyncengine import run_async_engine
+    from util.datenow import parse_max_age, set_stale_before
+    from util.dedup import claim_anime_id, count_claims
+    from util.diskstore import set_compact_json
+    from util.httpcache import close_http_cache, get_http_cache_stats, set_http_cache
+    from util.init import init_storage, reset_storage
+    from util.jobqueue import count_jobs, enqueue_jobs, ensure_job_indexes, make_anime_job, make_season_job, run_job_worker, start_job_round
+    from util.jsonformat import json_indent_len
+    from util.logqueue import start_log_queue, stop_log_queue
+    from util.metrics import get_stage_summary, start_metrics_server, start_metrics_snapshots, stop_metrics
+    from util.parser import set_parser_backend
+    from util.ratelimit import get_rate_limit_stats, set_rate_limit
+    from util.retryqueue import count_retries, dead_letter_file, dump_dead_letters
+    from util.scheduler import run_bounded
+    from util.mount import close_sessions, set_retry_policy, set_session_pool_size
+    from util.pipeline import start_pipeline, stop_pipeline
+    from util.pagearchive import close_page_archive, set_page_archive
+    from util.profiler import start_profiler, stop_profiler, write_profile
+    from util.replay import run_replay
+    from util.mongodb import close_mongo_client, ensure_mongo_indexes, set_mongo_host, set_mongo_pool_size
+    from util.segmentstore import close_segment_stores, set_segment_store
+    from util.season import get_season_entry, get_recent_season_ids, make_archive_list_to_csv, read_archive_list, season_dir, set_base_url
+    run_start = monotonic()
+
+    # write the thread info and warnings of every thread from a single listener thread
+    start_log_queue(args.threadinfo)
+
+    # expose the counters and stage latencies while the run goes
+    if args.metrics_port is not None :
+        start_metrics_server(args.metrics_port)
+    if args.metrics_file is not None :
+        start_metrics_snapshots(args.metrics_file, args.metrics_interval)
+
+    # sample every thread (parser processes can't be seen so pages are parsed in this process)
+    if args.profile is not None :
+        args.parse_processes = 0
+        args.replay_processes = 0
+        start_profiler(args.profile_frames)
+
+    # size the pool of the mongodb client shared by every thread
+    set_mongo_host(args.mongo_host)
+    set_mongo_pool_size(args.mongo_pool_size)
+
+    # pick how documents are written to disk
+    set_compact_json(args.compact_json)
+    set_segment_store(args.store == 'segments' and not args.mongodb, args.segment_compression)
+
+    # make the data directories and only wipe old data when asked to (entries are keyed on MAL ids)
+    init_storage()
+    if args.reset :
+        reset_storage(args.mongodb)
+
+    # index datetime_filled so stale documents can be found without a full scan
     if args.mongodb :
-        season_cursor = generate_cursor(mongodb_database_name,
-                                        mongodb_season_collection,
-                                        args.threadinfo)
-        for season_entry in season_cursor :
-            anime_entries = season_entry['seasonal_anime']
-            with ThreadPoolExecutor() as executor :
-                [
-                    executor.submit(get_anime_entry,
-                                    anime['_id'],
-                                    args.threadinfo,
-                                    args.mongodb)
-                    for anime in anime_entries]
+        ensure_mongo_indexes(args.threadinfo)
+    if args.job_queue is not None :
+        ensure_job_indexes(args.threadinfo)
+
+    # anything filled before the cutoff is fetched again in incremental mode
+    if args.incremental :
+        set_stale_before(datetime.now() - parse_max_age(args.max_age))
+
+    # size the connection pool used by every session and pick where and how it retries
+    set_session_pool_size(args.pool_maxsize, args.pool_maxsize)
+    set_retry_policy(args.retry_time, backoff_factor=args.retry_backoff)
+    set_base_url(args.base_url)
+
+    # pick the backend every page is parsed with
+    set_parser_backend(args.parser)
+
+    # share one token bucket between every thread hitting MAL
+    set_rate_limit(args.rate, args.burst)
+
+    # fetch the /characters page of every anime next to its main page with a thread per worker
+    # (the async engine requests both pages at once on its own)
+    if args.replay is None and args.engine == 'thread' :
+        start_character_executor(args.workers)
+
+    # keep every page fetched so unchanged pages are answered with a 304 (or not requested at all within the ttl)
+    if args.http_cache is not None :
+        cache_ttl = float('inf') if args.cache_ttl == 'forever' else parse_max_age(args.cache_ttl).total_seconds()
+        set_http_cache(args.http_cache, cache_ttl)
+
+    # parse pages in a pool of processes instead of the I/O threads
+    if args.parse_processes > 0 :
+        start_pipeline(args.parse_processes, max_pending=args.parse_queue)
+
+    # write every page fetched into the raw page archive
+    if args.archive_pages is not None :
+        set_page_archive(args.archive_pages)
+
+    # make the csv of season names and urls from the archive (refreshed in incremental mode to pick up new seasons)
+    if args.replay is None and args.job_queue != 'work' :
+        make_archive_list_to_csv(not args.incremental, args.threadinfo)
+
+    # cut the seasons down to the recent ones if asked to
+    season_ids = get_recent_season_ids() if args.recent_seasons else None
+
+    if args.replay is not None :
+        # parse every archived page again without touching the network
+        replayed = run_replay(args.replay,
+                              args.mongodb,
+                              args.threadinfo,
+                              processes=args.replay_processes)
+        print(f'replayed {replayed} entries from {args.replay}')
+    elif args.job_queue == 'enqueue' :
+        # start a new round of jobs with every season (and the stale anime in incremental mode)
+        start_job_round(args.threadinfo)
+        queued = enqueue_jobs(make_season_job(season_name, season_url) for season_name, season_url in read_archive_list(season_ids))
+        if args.incremental and not args.recent_seasons :
+            queued += enqueue_jobs(make_anime_job(anime_id) for anime_id in find_stale_anime_ids(args.mongodb, args.threadinfo))
+        print(f'{queued} jobs queued ({dumps(count_jobs())})')
+    elif args.job_queue == 'work' :
+        # claim batches of jobs until the queue has nothing left to run
+        done, released = run_job_worker(args.mongodb,
+                                        args.threadinfo,
+                                        worker_id=args.worker_id,
+                                        workers=args.workers,
+                                        batch=args.job_batch,
+                                        lease_time=args.lease_time)
+        print(f'{done} jobs done and {released} released ({dumps(count_jobs())})')
+    elif args.engine == 'async' :
+        # crawl every season and anime through one event loop
+        run(run_async_engine(read_archive_list(season_ids),
+                             args.threadinfo,
+                             args.mongodb,
+                             concurrency=args.concurrency))
     else :
-        for file in listdir(season_dir) :
-            # skip the archive file since it is not in json format
-            if file == archive_file :
-                continue
-
-            # grab the season entry
-            season_entry = {}
-            with open(season_dir + file, 'r') as fp :
-                season_entry = load(fp)
-
-            # generate a pool of threads to fill in anime data
-            anime_entries = season_entry['seasonal_anime']
-            with ThreadPoolExecutor() as executor :
-                [
-                    executor.submit(get_anime_entry,
-                                    anime['_id'],
-                                    anime['name'],
-                                    anime['url'],
-                                    args.threadinfo,
-                                    args.mongodb)
-                    for anime in anime_entries]
+        # one pool serves every season and anime with a bounded number of calls in flight
+        with ThreadPoolExecutor(args.workers) as executor :
+            # get data on every season streamed out of the csv and start on its anime as soon as it is parsed
+            # (incremental runs leave the anime to the stale scan below instead of loading every listed one)
+            if args.incremental and not args.recent_seasons :
+                follow_up = None
+            else :
+                follow_up = lambda season_entry : ((anime['_id'], args.mongodb, args.threadinfo)
+                                                   for anime in season_entry.get('seasonal_anime', [])
+                                                   if claim_anime_id(anime['_id'], 'fetch'))
+            submitted, failed = run_bounded(executor,
+                                            get_season_entry,
+                                            ((season_name, season_url, args.threadinfo, args.mongodb)
+                                             for season_name, season_url in read_archive_list(season_ids)),
+                                            args.threadinfo,
+                                            window=args.window,
+                                            follow_func=get_anime_entry,
+                                            follow_up=follow_up)
+            print(f'{submitted} season and anime calls made ({failed} raised an exception)')
+
+            # fill in the anime that went stale
+            if follow_up is None :
+                submitted, failed = run_bounded(executor,
+                                                get_anime_entry,
+                                                ((anime_id, args.mongodb, args.threadinfo)
+                                                 for anime_id in find_stale_anime_ids(args.mongodb, args.threadinfo)
+                                                 if claim_anime_id(anime_id, 'fetch')),
+                                                args.threadinfo,
+                                                window=args.window)
+                print(f'{submitted} stale anime calls made ({failed} raised an exception)')
+
+    # show how many titles were fetched once even though several seasons list them
+    if args.replay is None and args.job_queue is None :
+        print(f'{count_claims("fetch")} unique anime scheduled')
+
+    # stop the /characters pool and let the parse stage store everything it still holds
+    stop_character_executor()
+    stop_pipeline()
+
+    # close every session that was kept alive and the shared mongodb client
+    close_sessions()
+    close_mongo_client()
+    close_page_archive()
+    close_segment_stores()
+
+    # close the http cache and show how much it saved
+    if args.http_cache is not None :
+        close_http_cache()
+        cache_stats = get_http_cache_stats()
+        print(f'http cache served {cache_stats["fresh"]} fresh and {cache_stats["revalidated"]} revalidated pages and stored {cache_stats["stored"]}')
+
+    # keep track of every url that ran out of retries
+    dead_letter_count = dump_dead_letters(season_dir)
+    if dead_letter_count > 0 :
+        print(f'{dead_letter_count} urls ran out of retries (see {season_dir}{dead_letter_file})')
+
+    # write out a summary of the run for the load harness
+    if args.stats_file is not None :
+        run_stats = get_rate_limit_stats()
+        run_stats.update({
+            'wall_seconds' : round(monotonic() - run_start, 3),
+            'queued_retries' : count_retries(),
+            'dead_letters' : dead_letter_count,
+            'anime_scheduled' : count_claims('fetch'),
+        })
+        with open(args.stats_file, 'w') as file :
+            file.write(dumps(run_stats, indent=json_indent_len))
+
+    # write the profile of the run
+    if args.profile is not None :
+        stop_profiler()
+        print(write_profile(args.profile), end='')
+
+    # write the last metrics snapshot and show where the time went
+    stop_metrics()
+    if args.metrics_port is not None or args.metrics_file is not None :
+        for stage, calls, seconds in get_stage_summary() :
+            print(f'{stage:12} {calls:8} calls {seconds:10.2f} s ({1000 * seconds / max(calls, 1):.1f} ms per call)')
+
+    # write out every queued log record
+    stop_log_queue()
     exit(0)
\ No newline at end of file
@@ -0,0 +1,7 @@
+# imports
+
+from os import path
+from sys import path as sys_path
+
+# let the tests import util the same way scrubber.py does
+sys_path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
@@ -0,0 +1,29 @@
+# imports
+
+import pytest
+from json import load
+from bench.parser_bench import extract_fixture, fixture_dir, golden_file_name, list_fixtures
+from util.parser import parser_backends, set_parser_backend
+
+# functions
+
+@pytest.fixture(params=parser_backends)
+def backend(request) -> str :
+    """
+    backend -- This fixture runs a test once for every parser backend (skipping
+    the ones that aren't installed) and puts html.parser back afterwards.
+    """
+    try :
+        set_parser_backend(request.param)
+    except ImportError as e :
+        pytest.skip(f'{request.param} is not installed ({e})')
+    yield request.param
+    set_parser_backend('html.parser')
+
+@pytest.mark.parametrize('file_name', list_fixtures())
+def test_backend_matches_golden(backend, file_name) :
+    with open(fixture_dir + file_name, 'rb') as file :
+        content = file.read()
+    with open(golden_file_name(file_name), 'r') as file :
+        golden = load(file)
+    assert extract_fixture(file_name, content) == golden
@@ -0,0 +1,69 @@
+# imports
+
+import pytest
+from os import path, remove
+from util import segmentstore
+from util.segmentstore import SegmentStore, segment_index_file, set_segment_store
+
+# functions
+
+@pytest.fixture(params=['none', 'gzip', 'zstd'])
+def compression(request) -> str :
+    """
+    compression -- This fixture runs a test once for every compression and puts
+    the compression back to none afterwards.
+    """
+    if request.param == 'zstd' and segmentstore.zstandard is None :
+        pytest.skip('zstandard is not installed')
+    set_segment_store(True, request.param)
+    yield request.param
+    set_segment_store(False)
+
+def tear_segment(data_path : str) -> None :
+    """
+    tear_segment -- This function leaves half of a record at the end of the
+    first segment the way a crash in the middle of a write would.
+    """
+    store = SegmentStore(data_path)
+    torn = segmentstore.compress_record(b'{"_id":3,"name":"torn"}\n')
+    with open(store.segment_path(0), 'ab') as file :
+        file.write(torn[:len(torn) // 2])
+
+def test_torn_tail_is_cut_before_appending(tmp_path, compression) :
+    data_path = str(tmp_path) + '/'
+    store = SegmentStore(data_path)
+    store.append(1, {'_id' : 1, 'name' : 'one'})
+    store.append(2, {'_id' : 2, 'name' : 'two'})
+    store.close()
+    tear_segment(data_path)
+
+    # reopening skips the torn record and appending cuts it off
+    store = SegmentStore(data_path)
+    assert sorted(store.index) == [1, 2]
+    store.append(4, {'_id' : 4, 'name' : 'four'})
+    store.close()
+
+    # a rebuild from the segments alone sees every whole record
+    remove(data_path + segment_index_file)
+    store = SegmentStore(data_path)
+    assert sorted(store.index) == [1, 2, 4]
+    assert store.read(4) == {'_id' : 4, 'name' : 'four'}
+    assert [record['_id'] for record in store.iter_records()] == [1, 2, 4]
+    store.close()
+
+def test_saved_index_is_used_after_rotation(tmp_path, compression, monkeypatch) :
+    monkeypatch.setattr(segmentstore, 'segment_max_bytes', 64)
+    data_path = str(tmp_path) + '/'
+    store = SegmentStore(data_path)
+    for key in range(10) :
+        store.append(key, {'_id' : key, 'name' : 'x' * 40})
+    assert path.exists(data_path + segment_index_file)
+
+    # without a close only the segments written after the last rotation are read
+    scanned = []
+    read_segment = SegmentStore.read_segment
+    monkeypatch.setattr(SegmentStore, 'read_segment', lambda self, number : scanned.append(number) or read_segment(self, number))
+    reopened = SegmentStore(data_path)
+    assert scanned == [store.segment_number]
+    assert sorted(reopened.index) == list(range(10))
+    store.close()
@@ -1,18 +1,31 @@
 # imports
 
-from bs4 import BeautifulSoup
-from json import dumps, load
-from os import path
-from threading import Lock, get_ident
-from util.datenow import get_datetime_now
-from util.jsonformat import json_indent_len
-from util.mongodb import update_doc_in_mongo, insert_doc_into_mongo, grab_doc_from_mongo, mongodb_anime_collection, mongodb_database_name
+from bs4 import BeautifulSoup, SoupStrainer
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Iterator
+from util.datenow import get_datetime_now, get_stale_before, is_stale
+from util.diskstore import list_json_files, read_json, shard_dir, write_json
+from util.logqueue import logger
+from util.metrics import track_stage
+from util.mongodb import queue_replace_in_mongo, queue_insert_into_mongo, grab_doc_from_mongo, generate_cursor, get_stale_query, mongodb_anime_collection, mongodb_database_name
 from util.mount import *
+from util.parser import make_soup, uses_css_backend
+from util.pipeline import pipeline_enabled, submit_parse
+from util.retryqueue import schedule_retry
+from util.segmentstore import get_segment_store, uses_segment_store
+
+# global var
+
+character_executor = None                                            # pool fetching /characters pages next to the main page (NoneType Object fetches them in the caller)
 
 # static var
 
 anime_dir = "anime_data/"                                            # anime data directory path relative to util folder
-anime_dir_lock = Lock()                                              # lock preventing two files from RW action to an anime file at the same time
+anime_stub_keys = ['_id', 'name', 'url', 'season', 'year', 'datetime_entered'] # keys kept when a stale entry is filled again
+character_page_strainer = SoupStrainer('div', class_=[               # parts of a /characters page that are read
+    'anime-character-container js-anime-character-container',
+    'rightside js-scrollfix-bottom-rel',
+])                                                                   #
 info_not_found_str_regex = 'None found,add some'                     # regex for locating field values to not be split (looks weird)
 
 # functions
@@ -43,26 +56,28 @@ def get_anime_entry(anime_id : int,
 
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running get_anime_entry')
+        logger.debug('is running get_anime_entry')
 
     # grab document from disk or mongodb :
-    anime_entry : dict = {}
-    if to_mongodb :
-        anime_entry = grab_doc_from_mongo({'_id' : anime_id},
-                                            mongodb_database_name,
-                                            mongodb_anime_collection,
-                                            thread_info_enabled)
-    else :
-        with anime_dir_lock :
-            with open(anime_data_path + anime_id_to_file_name(anime_id), 'r') as file :
-                anime_entry = load(file)
-    
-    # make sure the entry is not of NoneTime
-    if anime_entry == None :
-        anime_entry = {}
+    anime_entry = load_anime_entry(anime_id,
+                                   to_mongodb,
+                                   thread_info_enabled,
+                                   anime_data_path=anime_data_path)
+
+    # make sure that the entry wasn't already filled (or was filled too long ago)
+    if is_stale(anime_entry) :
+        # drop the fields of an earlier fill so removed fields don't linger
+        anime_entry = reset_anime_entry(anime_entry)
+
+        # request the character/staff page while the main page is being fetched
+        # (left unparsed when the parse stage takes care of the parsing)
+        fetch_character_staff = fetch_anime_character_staff_page if pipeline_enabled() else get_anime_character_staff_section
+        character_future = None
+        if character_executor is not None :
+            character_future = character_executor.submit(fetch_character_staff,
+                                                          anime_entry['url'],
+                                                          thread_info_enabled)
 
-    # make sure that the entry wasn't already filled
-    if anime_entry.get('datetime_filled', None) == None :
         # establish connection
         content, retried, ret = init_session(anime_entry['url'],
                                             get_anime_entry,
@@ -77,54 +92,300 @@ def get_anime_entry(anime_id : int,
                                             })
 
         # if the entire function needed a reset return the value finished with even if None
+        # (the character/staff page is fetched again along with the retry so drop this one)
         if retried :
+            if character_future is not None :
+                character_future.cancel()
             return ret
-        
-        # grab data fields
-        section_list_func = [
-            get_anime_information_section,
-            get_anime_synopsis_section,
-        ]
-        for func in section_list_func :
-            func(anime_entry, BeautifulSoup(content, 'html.parser'))
 
-        # traverse the character/staff fields as well
-        char_dict, staff_dict = get_anime_character_staff_section(anime_entry['url'], thread_info_enabled)
+        # traverse the character/staff fields as well (queue the whole entry again if it failed)
+        # (this is the raw /characters page when the parse stage is started)
+        if character_future is not None :
+            character_staff = character_future.result()
+        else :
+            character_staff = fetch_character_staff(anime_entry['url'], thread_info_enabled)
+        if character_staff == None :
+            schedule_retry(anime_entry['url'],
+                           get_anime_entry,
+                           get_retry_time(),
+                           thread_info_enabled,
+                           args = [
+                               anime_id,
+                               to_mongodb,
+                               thread_info_enabled
+                           ],
+                           kwargs = {
+                               'anime_data_path' : anime_data_path
+                           })
+            return None
+
+        # hand both pages to the parse stage which fills and stores the entry once parsed
+        if pipeline_enabled() :
+            submit_parse(parse_anime_pages,
+                         [anime_entry['url'], content, character_staff],
+                         lambda parsed : fill_anime_entry(anime_entry,
+                                                          parsed[0],
+                                                          parsed[1],
+                                                          to_mongodb,
+                                                          thread_info_enabled,
+                                                          anime_data_path=anime_data_path))
+            return anime_entry
+
+        # grab data fields and store the filled entry
+        anime_fields = {'url' : anime_entry['url']}
+        with track_stage('parse') :
+            parse_anime_page(anime_fields, content)
+        if not fill_anime_entry(anime_entry,
+                                anime_fields,
+                                character_staff,
+                                to_mongodb,
+                                thread_info_enabled,
+                                anime_data_path=anime_data_path) :
+            return None
+
+    # return the entry
+    return anime_entry
+
+def start_character_executor(workers : int | None) -> None :
+    """
+    start_character_executor -- This function starts the pool fetching the
+    /characters page of an anime while the calling worker fetches the main
+    page. Every worker has at most one /characters page in flight so the pool
+    is sized like the pool of workers (and so is the number of sessions its
+    threads open).
+
+    Arguments:
+        workers -- Threads in the pool of workers ( NoneType Object lets
+        python pick like it does for the workers )
+    """
+    global character_executor
+    character_executor = ThreadPoolExecutor(workers)
+
+def stop_character_executor() -> None :
+    """
+    stop_character_executor -- This function drops the /characters pages that
+    haven't started and stops the pool. This should be called once all of the
+    scrubbing is finished.
+    """
+    global character_executor
+    if character_executor is not None :
+        character_executor.shutdown(cancel_futures=True)
+        character_executor = None
+
+def parse_anime_pages(anime_url : str, content : bytes, character_content : bytes) -> tuple[dict, tuple[dict, dict]] :
+    """
+    parse_anime_pages -- This function parses the main page and the /characters
+    page of an anime without touching the network or any storage so it can run
+    inside of a parser process.
+
+    Arguments:
+        anime_url -- The url that is connected to the anime entry
+        content -- The content of the anime's main page
+        character_content -- The content of the anime's /characters page
+
+    Returns:
+        A tuple containing the fields of the main page along with the tuple of
+        character and staff dictionaries.
+    """
+    anime_fields = {'url' : anime_url}
+    parse_anime_page(anime_fields, content)
+    return (anime_fields, parse_anime_character_staff_section(anime_url, character_content))
+
+def fill_anime_entry(anime_entry : dict,
+                     anime_fields : dict,
+                     character_staff : tuple[dict, dict] | None,
+                     to_mongodb : bool,
+                     thread_info_enabled : bool,
+                     anime_data_path : str = anime_dir) -> bool :
+    """
+    fill_anime_entry -- This function fills an anime entry with the fields
+    parsed out of its pages, marks it as filled and stores it.
+
+    Arguments:
+        anime_entry -- The dictionary containing the anime entry
+        anime_fields -- The fields parsed out of the anime's main page
+        character_staff -- The character and staff dictionaries parsed out of
+        the /characters page or NoneType Object if there are none
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        anime_data_path -- This defines the destination the resultants are
+        stored at ( default: anime_dir )
+
+    Returns:
+        Status as a boolean;
+    """
+    # grab data fields
+    anime_entry.update(anime_fields)
+    if character_staff is not None :
+        char_dict, staff_dict = character_staff
         if char_dict != None :
             anime_entry['characters'] = char_dict
         if staff_dict != None :
             anime_entry['staff'] = staff_dict
 
-        # modify the filled datetime filled
-        anime_entry['datetime_filled'] = get_datetime_now()
-
-        # tries to update document it to mongodb
-        if to_mongodb :
-            try :
-                update_doc_in_mongo({'_id' : anime_id},
-                                    anime_entry,
-                                    mongodb_database_name,
-                                    mongodb_anime_collection,
-                                    thread_info_enabled)
-            except Exception as e :
-                print(f'Exception in get_anime_entry() during replacement : {e}\nanime_id : {anime_id}')
-                return None
+    # modify the filled datetime filled
+    anime_entry['datetime_filled'] = get_datetime_now()
 
-        # write to disk
-        with anime_dir_lock :
-            with open(anime_data_path + anime_id_to_file_name(anime_id), 'w+') as file :
-                file.write(dumps(anime_entry, indent=json_indent_len))
-    
-    # return the entry
+    # store the filled entry
+    return store_anime_entry(anime_entry,
+                             to_mongodb,
+                             thread_info_enabled,
+                             anime_data_path=anime_data_path)
+
+def reset_anime_entry(anime_entry : dict) -> dict :
+    """
+    reset_anime_entry -- This function strips an anime entry back down to the
+    fields the season page gave it so it can be filled again.
+
+    Arguments:
+        anime_entry -- The dictionary containing the anime entry
+
+    Returns:
+        A new dictionary holding only the keys found in anime_stub_keys.
+    """
+    return {key : anime_entry[key] for key in anime_stub_keys if key in anime_entry}
+
+def find_stale_anime_ids(to_mongodb : bool,
+                         thread_info_enabled : bool,
+                         anime_data_path : str = anime_dir) -> Iterator[int] :
+    """
+    find_stale_anime_ids -- This function finds every stored anime that was
+    never filled or was filled before the stale cutoff. Mongodb is asked
+    through the datetime_filled index while the disk store is scanned. Ids are
+    handed out as they are found so the scheduler can start on them early.
+
+    Arguments:
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        anime_data_path -- This defines the destination the resultants are
+        stored at ( default: anime_dir )
+
+    Yields:
+        The id of every stale anime.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running find_stale_anime_ids')
+
+    if to_mongodb :
+        # only the ids are grabbed up front so the cursor isn't left idle (and timed out) while the anime are fetched
+        anime_ids = [anime['_id'] for anime in generate_cursor(mongodb_database_name,
+                                                               mongodb_anime_collection,
+                                                               thread_info_enabled,
+                                                               query=get_stale_query(get_stale_before()),
+                                                               projection={'_id' : 1})]
+        yield from anime_ids
+        return
+
+    # scan the segments (only the latest copy of each anime is read)
+    if uses_segment_store() :
+        for anime_entry in get_segment_store(anime_data_path).iter_records() :
+            if is_stale(anime_entry) :
+                yield anime_entry['_id']
+        return
+
+    # scan the disk store
+    for file_path in list_json_files(anime_data_path) :
+        anime_entry = read_json(file_path)
+        if anime_entry is not None and is_stale(anime_entry) :
+            yield anime_entry['_id']
+
+def load_anime_entry(anime_id : int,
+                     to_mongodb : bool,
+                     thread_info_enabled : bool,
+                     anime_data_path : str = anime_dir) -> dict :
+    """
+    load_anime_entry -- This function grabs the stored document of an anime from
+    disk or mongodb.
+
+    Arguments:
+        anime_id -- Unique identifier used within the season entry
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        anime_data_path -- This defines the destination the resultants are
+        stored at ( default: anime_dir )
+
+    Returns:
+        The dictionary object of the anime series; empty if none was stored yet.
+    """
+    # grab document from disk or mongodb :
+    anime_entry : dict = {}
+    if to_mongodb :
+        anime_entry = grab_doc_from_mongo({'_id' : anime_id},
+                                            mongodb_database_name,
+                                            mongodb_anime_collection,
+                                            thread_info_enabled)
+    elif uses_segment_store() :
+        anime_entry = get_segment_store(anime_data_path).read(anime_id)
+    else :
+        anime_entry = read_json(anime_id_to_path(anime_id, anime_data_path))
+
+    # make sure the entry is not of NoneTime
+    if anime_entry == None :
+        anime_entry = {}
     return anime_entry
 
+def store_anime_entry(anime_entry : dict,
+                      to_mongodb : bool,
+                      thread_info_enabled : bool,
+                      anime_data_path : str = anime_dir) -> bool :
+    """
+    store_anime_entry -- This function writes a filled anime entry over the
+    stored document on disk or in mongodb.
+
+    Arguments:
+        anime_entry -- The filled dictionary containing the anime entry
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        anime_data_path -- This defines the destination the resultants are
+        stored at ( default: anime_dir )
+
+    Returns:
+        Status as a boolean;
+    """
+    # tries to update document it to mongodb (buffered into the next bulk write)
+    if to_mongodb :
+        try :
+            queue_replace_in_mongo({'_id' : anime_entry['_id']},
+                                   anime_entry,
+                                   mongodb_database_name,
+                                   mongodb_anime_collection,
+                                   thread_info_enabled)
+        except Exception as e :
+            logger.warning(f'Exception in store_anime_entry() during replacement : {e}\nanime_id : {anime_entry["_id"]}')
+            return False
+    elif uses_segment_store() :
+        # append to the current segment
+        get_segment_store(anime_data_path).append(anime_entry['_id'], anime_entry)
+    else :
+        # write to disk
+        write_json(anime_id_to_path(anime_entry['_id'], anime_data_path), anime_entry, anime_entry['_id'])
+    return True
+
 def init_anime_entry(anime_entry : dict,
                      thread_info_enabled : bool,
                      to_mongodb : bool,
                      anime_data_path : str = anime_dir) -> None :
     """
     init_anime_entry : This function will initialize documents depending on the
-    setting selected for mongodb.
+    setting selected for mongodb. Anime that already have a document (from an
+    earlier run or another season) are left as they are.
 
     Arguments:
         anime_entry -- Document to be inserted
@@ -139,18 +400,21 @@ def init_anime_entry(anime_entry : dict,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running init_anime_entry')
+        logger.debug('is running init_anime_entry')
     
-    # write to disk or to mongodb
+    # write to disk or to mongodb (buffered into the next bulk write)
     if to_mongodb :
-        insert_doc_into_mongo(anime_entry,
-                              mongodb_database_name,
-                              mongodb_anime_collection,
-                              thread_info_enabled)
+        queue_insert_into_mongo(anime_entry,
+                                mongodb_database_name,
+                                mongodb_anime_collection,
+                                thread_info_enabled)
+    elif uses_segment_store() :
+        get_segment_store(anime_data_path).append(anime_entry['_id'], anime_entry, only_if_missing=True)
     else :
-        with anime_dir_lock:
-            with open(anime_data_path + anime_id_to_file_name(anime_entry['_id']), 'w') as file :
-                file.write(dumps(anime_entry))
+        write_json(anime_id_to_path(anime_entry['_id'], anime_data_path),
+                   anime_entry,
+                   anime_entry['_id'],
+                   only_if_missing=True)
 
 def anime_id_to_file_name(anime_id : int) -> str : 
     """
@@ -165,6 +429,45 @@ def anime_id_to_file_name(anime_id : int) -> str :
     """
     return 'anime_' + str(anime_id) + ".json"
 
+def anime_id_to_path(anime_id : int, anime_data_path : str = anime_dir) -> str :
+    """
+    anime_id_to_path : This function makes the path of an anime's file inside
+    of the shard subdirectory it belongs to.
+
+    Arguments:
+        anime_id -- The id of the anime
+
+    Keyword Arguments:
+        anime_data_path -- This defines the destination the resultants are
+        stored at ( default: anime_dir )
+
+    Returns:
+        Path of the anime's file.
+    """
+    return shard_dir(anime_data_path, anime_id) + anime_id_to_file_name(anime_id)
+
+def parse_anime_page(anime_entry : dict, content : bytes) -> None :
+    """
+    parse_anime_page -- This function parses the content of an anime's main page
+    once and runs every section parser over the same tree.
+
+    Arguments:
+        anime_entry -- The dictionary containing the anime entry
+        content -- The content of the anime's main page
+    """
+    section_list_func = [
+        get_anime_information_section,
+        get_anime_synopsis_section,
+    ]
+    if uses_css_backend() :
+        section_list_func = [
+            get_anime_information_section_css,
+            get_anime_synopsis_section_css,
+        ]
+    soup = make_soup(content)
+    for func in section_list_func :
+        func(anime_entry, soup)
+
 def get_anime_information_section(anime_dict : dict, soup : BeautifulSoup) -> None :
     """
     get_anime_information_section -- This function grabs most data from the
@@ -174,38 +477,70 @@ def get_anime_information_section(anime_dict : dict, soup : BeautifulSoup) -> No
         anime_dict -- The dictionary containing the anime entry
         soup -- The response content from the session
     """
+    # only the info section is read so the cleanup is kept to it (leaves the rest of the page untouched)
+    info_soup = soup.find('div', class_='leftside')
+
     # gets rid of spans
-    for span in soup.find_all("span", style='display: none') :
+    for span in info_soup.find_all("span", style='display: none') :
         span.decompose()
-    soup.prettify()
 
     # gets rid of sups
-    for sup in soup.find_all("sup") :
+    for sup in info_soup.find_all("sup") :
         sup.decompose()
-    soup.prettify()
 
     # gets rid of ranked subtext
-    for div in soup.find_all("div", class_=['statistics-info info1', 'statistics-info info2']) :
+    for div in info_soup.find_all("div", class_=['statistics-info info1', 'statistics-info info2']) :
         div.decompose()
-    soup.prettify()
 
     # getting rid of character details
-    for td in soup.find_all("td", class_='pb24') :
+    for td in info_soup.find_all("td", class_='pb24') :
         td.decompose()
-    soup.prettify()
 
     # grab each field in info section
-    info_soup = soup.find('div', class_='leftside')
     info_soup = info_soup.find_all('div', class_='spaceit_pad')
     for row in info_soup :
-        line = row.get_text(strip=True)
-        idx = line.find(':')
-        if idx > 0  and line[-1] != ':':
-            attr, values = line[:idx], line[idx+1:]
-            if values.find(',') < len(values) and values.strip() != info_not_found_str_regex:
-                if values.find(',') > 0  and values[values.find(',') + 1].isalpha() :
-                    values = [v.strip() for v in values.split(',')]
-            anime_dict[attr.lower()] = values
+        add_anime_information_field(anime_dict, row.get_text(strip=True))
+
+def get_anime_information_section_css(anime_dict : dict, tree : Any) -> None :
+    """
+    get_anime_information_section_css -- This function is the css selector
+    version of get_anime_information_section used by the selectolax backend.
+
+    Arguments:
+        anime_dict -- The dictionary containing the anime entry
+        tree -- The lexbor tree of the anime's main page
+    """
+    # only the info section is read so the cleanup is kept to it
+    info_tree = tree.css_first('div.leftside')
+
+    # gets rid of spans, sups, ranked subtext and character details in the same order
+    for selector in ['span[style="display: none"]',
+                     'sup',
+                     'div[class="statistics-info info1"], div[class="statistics-info info2"]',
+                     'td.pb24'] :
+        for node in info_tree.css(selector) :
+            node.decompose()
+
+    # grab each field in info section
+    for row in info_tree.css('div.spaceit_pad') :
+        add_anime_information_field(anime_dict, row.text(deep=True, separator='', strip=True))
+
+def add_anime_information_field(anime_dict : dict, line : str) -> None :
+    """
+    add_anime_information_field -- This function splits a line of the
+    information section into its attribute and values and adds it to the entry.
+
+    Arguments:
+        anime_dict -- The dictionary containing the anime entry
+        line -- The text of the row with every piece stripped and joined
+    """
+    idx = line.find(':')
+    if idx > 0  and line[-1] != ':':
+        attr, values = line[:idx], line[idx+1:]
+        if values.find(',') < len(values) and values.strip() != info_not_found_str_regex:
+            if values.find(',') > 0  and values[values.find(',') + 1].isalpha() :
+                values = [v.strip() for v in values.split(',')]
+        anime_dict[attr.lower()] = values
 
 def get_anime_synopsis_section(anime_dict : dict, soup : BeautifulSoup) -> None :
     """
@@ -220,10 +555,44 @@ def get_anime_synopsis_section(anime_dict : dict, soup : BeautifulSoup) -> None
         synop = "".join([line.get_text(strip=True) for line in soup.find_all('p', itemprop='description')])
         anime_dict['synopsis'] = synop
     except AttributeError as e :
-        print(f'Exception {e.name} has occured with URL {anime_dict['url']} [entry possibly has fewer attributes or has none]')
-        print(f'{e}')
+        logger.warning(f'Exception {e.name} has occured with URL {anime_dict["url"]} [entry possibly has fewer attributes or has none]')
+        logger.warning(f'{e}')
+
+def get_anime_synopsis_section_css(anime_dict : dict, tree : Any) -> None :
+    """
+    get_anime_synopsis_section_css -- This function is the css selector version
+    of get_anime_synopsis_section used by the selectolax backend.
+
+    Arguments:
+        anime_dict -- The dictionary containing the anime entry
+        tree -- The lexbor tree of the anime's main page
+    """
+    synop = "".join([line.text(deep=True, separator='', strip=True) for line in tree.css('p[itemprop="description"]')])
+    anime_dict['synopsis'] = synop
+
+def fetch_anime_character_staff_page(anime_url : str, thread_info_enabled : bool) -> bytes | None :
+    """
+    fetch_anime_character_staff_page -- This function grabs the content of an
+    anime's /characters page without parsing it.
+
+    Arguments:
+        anime_url -- The url that is connected to the anime entry
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        The content of the page or NoneType Object if the page could not be
+        fetched.
+    """
+    # grab the content from the GET request (the caller reschedules on failure)
+    content, retried, ret = init_session(anime_url + '/characters',
+                                         None,
+                                         thread_info_enabled)
+    if retried :
+        return ret
+    return content
 
-def get_anime_character_staff_section(anime_url : str, thread_info_enabled : bool) -> tuple[dict, dict] :
+def get_anime_character_staff_section(anime_url : str, thread_info_enabled : bool) -> tuple[dict, dict] | None :
     """
     get_anime_character_staff_section -- This function will grab the character
     and staff information from each entry and record the results in seperate
@@ -234,19 +603,35 @@ def get_anime_character_staff_section(anime_url : str, thread_info_enabled : boo
         thread_info_enabled -- When threads are implimented this will allow a
         print statement for debugging
 
+    Returns:
+        A tuple containing both the character and staff dictionaries or
+        NoneType Object if the page could not be fetched.
+    """
+    # grab the content from the GET request (the caller reschedules on failure)
+    content = fetch_anime_character_staff_page(anime_url, thread_info_enabled)
+    if content is None :
+        return None
+
+    # parse the page
+    with track_stage('parse') :
+        return parse_anime_character_staff_section(anime_url, content)
+
+def parse_anime_character_staff_section(anime_url : str, content : bytes) -> tuple[dict, dict] :
+    """
+    parse_anime_character_staff_section -- This function parses the character
+    and staff information out of the content of an anime's /characters page.
+
+    Arguments:
+        anime_url -- The url that is connected to the anime entry
+        content -- The content of the anime's /characters page
+
     Returns:
         A tuple containing both the character and staff dictionaries.
     """
-    # grab the content from the GET request
-    content, retried, ret = init_session(anime_url + '/characters',
-                                         get_anime_character_staff_section,
-                                         thread_info_enabled,
-                                         [anime_url + '/characters'])
-    if retried :
-        return ret
-    
-    # grab context for each section
-    soup = BeautifulSoup(content, 'html.parser')
+    # grab context for each section (only the character and staff parts are built)
+    soup = make_soup(content, parse_only=character_page_strainer)
+    if uses_css_backend() :
+        return parse_anime_character_staff_section_css(anime_url, soup)
 
     # grab character information
     character_entries = {}
@@ -272,8 +657,8 @@ def get_anime_character_staff_section(anime_url : str, thread_info_enabled : boo
                 }
                 character_entries[character_name]['actors'].append(actor_entry)
     except AttributeError as e :
-        print(f'Exception {e.name} has occured with URL {anime_url} [character field empty]')
-        print(f'{e}')
+        logger.warning(f'Exception {e.name} has occured with URL {anime_url} [character field empty]')
+        logger.warning(f'{e}')
     finally :
         if len(character_entries.keys()) < 1 :
             character_entries = None
@@ -295,11 +680,79 @@ def get_anime_character_staff_section(anime_url : str, thread_info_enabled : boo
                 'link' : staff_link
             }
     except AttributeError as e :
-        print(f'Exception {e.name} has occured with URL {anime_url} [staff field empty]')
-        print(f'{e}')
+        logger.warning(f'Exception {e.name} has occured with URL {anime_url} [staff field empty]')
+        logger.warning(f'{e}')
+    finally :
+        if len(staff_entries.keys()) < 1 :
+            staff_entries = None
+
+    return (character_entries, staff_entries)
+    
+
+def parse_anime_character_staff_section_css(anime_url : str, tree : Any) -> tuple[dict, dict] :
+    """
+    parse_anime_character_staff_section_css -- This function is the css
+    selector version of parse_anime_character_staff_section used by the
+    selectolax backend.
+
+    Arguments:
+        anime_url -- The url that is connected to the anime entry
+        tree -- The lexbor tree of the anime's /characters page
+
+    Returns:
+        A tuple containing both the character and staff dictionaries.
+    """
+    # grab character information
+    character_entries = {}
+    try :
+        # grab the character tables
+        character_tree = tree.css_first('div[class="anime-character-container js-anime-character-container"]')
+        character_tree = character_tree.css('table.js-anime-character-table')
+
+        # go through the table elements and attempt to parse the character data
+        for table in character_tree :
+            character_name = table.css_first('h3.h3_character_name').text().strip()
+            character_favorites = table.css_first('div.js-anime-character-favorites').text().strip()
+            character_entries[character_name] = {
+                'favorites' : character_favorites,
+                'actors' : []
+            }
+            for tr in table.css('tr.js-anime-character-va-lang') :
+                td = tr.css_first('td[align="right"][style="padding: 0 4px;"][valign="top"]')
+                actor_entry = {
+                    'name' : td.css_first('a').text().strip(),
+                    'language' : td.css_first('div.js-anime-character-language').text().strip(),
+                    'link' : td.css_first('a').attributes.get('href').strip()
+                }
+                character_entries[character_name]['actors'].append(actor_entry)
+    except AttributeError as e :
+        logger.warning(f'Exception {e.name} has occured with URL {anime_url} [character field empty]')
+        logger.warning(f'{e}')
+    finally :
+        if len(character_entries.keys()) < 1 :
+            character_entries = None
+
+    # grab staff information
+    staff_entries = {}
+    try :
+        staff_tree = tree.css_first('div[class="rightside js-scrollfix-bottom-rel"]')
+        staff_tree = staff_tree.css('table:not([class])')
+        for table in staff_tree :
+            td = table.css_first('td:not([width])')
+            staff_name = td.css_first('a').text().strip()
+            staff_link = td.css_first('a').attributes.get('href').strip()
+            staff_roles = td.css_first('div.spaceit_pad').text().strip()
+            if staff_roles.find(',') > 0 :
+                staff_roles = staff_roles.split(', ')
+            staff_entries[staff_name] = {
+                'roles' : staff_roles,
+                'link' : staff_link
+            }
+    except AttributeError as e :
+        logger.warning(f'Exception {e.name} has occured with URL {anime_url} [staff field empty]')
+        logger.warning(f'{e}')
     finally :
         if len(staff_entries.keys()) < 1 :
             staff_entries = None
 
     return (character_entries, staff_entries)
-    
\ No newline at end of file
@@ -0,0 +1,410 @@
+# imports
+
+import asyncio
+from time import monotonic
+from typing import Any, Iterable
+from urllib3.util.retry import RequestHistory
+from util.anime import fill_anime_entry, load_anime_entry, reset_anime_entry, parse_anime_pages, anime_dir
+from util.datenow import is_stale
+from util.dedup import claim_anime_id
+from util.logqueue import logger
+from util.metrics import call_timed, inc_counter, observe, track_stage
+from util.httpcache import get_cached_entry, is_fresh, get_conditional_headers, read_cached_body, store_response
+from util.mount import get_retry_strategy, get_retry_time
+from util.pagearchive import archive_page
+from util.ratelimit import reserve_token, report_backoff, report_status
+from util.retryqueue import schedule_retry, pop_retry
+from util.pipeline import get_parse_executor
+from util.season import build_season_entry, load_season_entry, parse_season_anime_links, store_season_entry, season_dir
+
+try :
+    import aiohttp
+except ImportError :
+    aiohttp = None
+
+# static var
+
+async_concurrency = 32                                               # default number of requests in flight at once
+
+# functions
+
+async def fetch_page(session : 'aiohttp.ClientSession',
+                     semaphore : asyncio.Semaphore,
+                     url : str,
+                     thread_info_enabled : bool) -> bytes | None :
+    """
+    fetch_page -- This function sends a GET request to a url from the event
+    loop. It follows the same retry policy and shared rate limiter as
+    init_session (the backoff comes from the policy itself so the first retry
+    is sent right away like urllib3 does) but waits on the rate limiter and the
+    backoff without holding a request slot.
+
+    Arguments:
+        session -- The aiohttp session shared by the whole crawl
+        semaphore -- Semaphore bounding the number of requests in flight
+        url -- String referencing the url to visit
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        The content of the response or NoneType Object once every retry has
+        been used.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug(f'is running fetch_page ({url})')
+
+    # serve the page from the http cache if it is still fresh
+    cached_entry = get_cached_entry(url)
+    if is_fresh(cached_entry) :
+        content = read_cached_body(cached_entry)
+        archive_page(url, content)
+        return content
+
+    retry_strategy = get_retry_strategy()
+    history = ()
+    for attempt in range(retry_strategy.total + 1) :
+        retry_after = None
+        status = None
+
+        # wait for the shared rate limiter before taking a request slot (so a slot is never held idle)
+        wait = reserve_token()
+        if wait > 0 :
+            await asyncio.sleep(wait)
+
+        async with semaphore :
+            # send a conditional GET request and raise for statuses that won't be retried
+            try :
+                content = None
+                with track_stage('http_fetch') :
+                    async with session.get(url, headers=get_conditional_headers(cached_entry)) as response :
+                        report_status(response.status)
+                        status = response.status
+                        revalidated = response.status == 304 and cached_entry is not None
+                        if not revalidated and response.status not in retry_strategy.status_forcelist :
+                            response.raise_for_status()
+                            content = await response.read()
+                        retry_after = response.headers.get('Retry-After', None)
+                if revalidated :
+                    content = read_cached_body(cached_entry, revalidated=True)
+                    archive_page(url, content)
+                    return content
+                if content is not None :
+                    inc_counter('http_bytes_total', len(content))
+                    store_response(url, content, response.headers)
+                    archive_page(url, content)
+                    return content
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exception :
+                logger.warning(f'ran into a connection error ({exception}) with URL {url}')
+
+        # no point in backing off once every retry has been used
+        history += (RequestHistory('GET', url, None, status, None),)
+        if attempt >= retry_strategy.total :
+            break
+
+        # back off the same way the retry policy would (nothing after the first error)
+        if retry_after is not None and retry_after.isdigit() :
+            backoff = float(retry_after)
+        else :
+            backoff = retry_strategy.new(history=history).get_backoff_time()
+        inc_counter('http_retries_total')
+        report_backoff(backoff)
+        if backoff > 0 :
+            await asyncio.sleep(backoff)
+
+    logger.warning(f'ran out of retries with URL {url}')
+    return None
+
+async def crawl_season(session : 'aiohttp.ClientSession',
+                       semaphore : asyncio.Semaphore,
+                       anime_slots : asyncio.Semaphore,
+                       tasks : set,
+                       season_name : str,
+                       season_url : str,
+                       thread_info_enabled : bool,
+                       to_mongodb : bool) -> dict | None :
+    """
+    crawl_season -- This function is the event loop version of get_season_entry.
+    Every anime found on the season page is handed to crawl_anime as soon as
+    one of the anime slots frees up.
+
+    Arguments:
+        session -- The aiohttp session shared by the whole crawl
+        semaphore -- Semaphore bounding the number of requests in flight
+        anime_slots -- Semaphore bounding the number of anime in flight
+        tasks -- Set of running tasks that new anime tasks are added to
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Returns:
+        The dictionary object of the season or NoneType Object if it was put
+        into the retry queue.
+    """
+    # grab document from disk or mongodb
+    season_entry = await asyncio.to_thread(load_season_entry,
+                                           season_name,
+                                           season_url,
+                                           thread_info_enabled,
+                                           to_mongodb,
+                                           season_data_path=season_dir)
+
+    # grab data if it doesn't exist (or was filled too long ago)
+    if is_stale(season_entry) :
+        content = await fetch_page(session, semaphore, season_url, thread_info_enabled)
+        if content is None :
+            schedule_retry(season_url,
+                           crawl_season,
+                           get_retry_time(),
+                           thread_info_enabled,
+                           args = [
+                               session,
+                               semaphore,
+                               anime_slots,
+                               tasks,
+                               season_name,
+                               season_url,
+                               thread_info_enabled,
+                               to_mongodb
+                           ])
+            return None
+
+        # parse the page in the parse stage then build and store it off of the event loop
+        anime_links = await run_parse(parse_season_anime_links, content)
+        season_entry = await asyncio.to_thread(build_season_entry,
+                                               season_name,
+                                               season_url,
+                                               anime_links,
+                                               thread_info_enabled,
+                                               to_mongodb)
+        await asyncio.to_thread(store_season_entry,
+                                season_entry,
+                                season_name,
+                                thread_info_enabled,
+                                to_mongodb,
+                                season_data_path=season_dir)
+
+    # start on the anime of the season (anime another season already started on are skipped)
+    for anime in season_entry['seasonal_anime'] :
+        if not claim_anime_id(anime['_id'], 'fetch') :
+            continue
+        await spawn_bounded_task(tasks, anime_slots, crawl_anime(session,
+                                                                 semaphore,
+                                                                 anime['_id'],
+                                                                 to_mongodb,
+                                                                 thread_info_enabled))
+    return season_entry
+
+async def crawl_anime(session : 'aiohttp.ClientSession',
+                      semaphore : asyncio.Semaphore,
+                      anime_id : int,
+                      to_mongodb : bool,
+                      thread_info_enabled : bool) -> dict | None :
+    """
+    crawl_anime -- This function is the event loop version of get_anime_entry.
+    The main page and the /characters page are requested at the same time.
+
+    Arguments:
+        session -- The aiohttp session shared by the whole crawl
+        semaphore -- Semaphore bounding the number of requests in flight
+        anime_id -- Unique identifier used within the season entry
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        The dictionary object of the anime series or NoneType Object if it was
+        put into the retry queue or could not be stored.
+    """
+    # grab document from disk or mongodb
+    anime_entry = await asyncio.to_thread(load_anime_entry,
+                                          anime_id,
+                                          to_mongodb,
+                                          thread_info_enabled,
+                                          anime_data_path=anime_dir)
+
+    # make sure that the entry wasn't already filled (or was filled too long ago)
+    if not is_stale(anime_entry) :
+        return anime_entry
+    anime_entry = reset_anime_entry(anime_entry)
+
+    # grab both pages at once
+    content, character_content = await asyncio.gather(
+        fetch_page(session, semaphore, anime_entry['url'], thread_info_enabled),
+        fetch_page(session, semaphore, anime_entry['url'] + '/characters', thread_info_enabled))
+    if content is None or character_content is None :
+        schedule_retry(anime_entry['url'],
+                       crawl_anime,
+                       get_retry_time(),
+                       thread_info_enabled,
+                       args = [
+                           session,
+                           semaphore,
+                           anime_id,
+                           to_mongodb,
+                           thread_info_enabled
+                       ])
+        return None
+
+    # parse the pages in the parse stage then fill and store the entry off of the event loop
+    anime_fields, character_staff = await run_parse(parse_anime_pages,
+                                                    anime_entry['url'],
+                                                    content,
+                                                    character_content)
+    stored = await asyncio.to_thread(fill_anime_entry,
+                                     anime_entry,
+                                     anime_fields,
+                                     character_staff,
+                                     to_mongodb,
+                                     thread_info_enabled,
+                                     anime_data_path=anime_dir)
+    return anime_entry if stored else None
+
+async def run_parse(parse_func, *args) -> Any :
+    """
+    run_parse -- This function runs a parse function off of the event loop. It
+    runs in the process pool of the parse stage when it is started so parsing
+    isn't held back by the GIL, otherwise in a thread.
+
+    Arguments:
+        parse_func -- Function turning a raw page into data
+        args -- The parse function's arguments
+
+    Returns:
+        Whatever the parse function gives back.
+    """
+    parse_executor = get_parse_executor()
+    if parse_executor is None :
+        result, seconds = await asyncio.to_thread(call_timed, parse_func, *args)
+    else :
+        result, seconds = await asyncio.get_running_loop().run_in_executor(parse_executor, call_timed, parse_func, *args)
+    observe('stage_seconds', seconds, stage='parse')
+    return result
+
+def spawn_task(tasks : set, coroutine) -> asyncio.Task :
+    """
+    spawn_task -- This function starts a coroutine as a task and keeps a
+    reference to it inside of the set of running tasks.
+
+    Arguments:
+        tasks -- Set of running tasks
+        coroutine -- The coroutine to start
+
+    Returns:
+        The task that was started.
+    """
+    task = asyncio.create_task(coroutine)
+    tasks.add(task)
+    return task
+
+async def spawn_bounded_task(tasks : set, slots : asyncio.Semaphore, coroutine) -> asyncio.Task :
+    """
+    spawn_bounded_task -- This function waits on a free slot before starting a
+    coroutine as a task and frees the slot once the task is finished. The whole
+    task holds the slot (loading, fetching, parsing and storing) so the threads
+    loading and storing entries don't pile up behind a burst of anime.
+
+    Arguments:
+        tasks -- Set of running tasks
+        slots -- Semaphore bounding the number of tasks running at once
+        coroutine -- The coroutine to start
+
+    Returns:
+        The task that was started.
+    """
+    await slots.acquire()
+    task = spawn_task(tasks, coroutine)
+    task.add_done_callback(lambda task : slots.release())
+    return task
+
+async def wait_on_tasks(tasks : set) -> int :
+    """
+    wait_on_tasks -- This function waits until every task is finished including
+    the ones started while waiting. Exceptions are printed instead of stopping
+    the crawl.
+
+    Arguments:
+        tasks -- Set of running tasks
+
+    Returns:
+        Number of tasks that raised an exception.
+    """
+    failed = 0
+    while len(tasks) > 0 :
+        done, _ = await asyncio.wait(set(tasks))
+        for task in done :
+            tasks.discard(task)
+            if task.exception() is not None :
+                logger.warning(f'Exception in async engine : {task.exception()}')
+                failed += 1
+    return failed
+
+async def run_async_engine(seasons : Iterable[tuple[str, str]],
+                           thread_info_enabled : bool,
+                           to_mongodb : bool,
+                           concurrency : int = async_concurrency) -> int :
+    """
+    run_async_engine -- This function crawls every season and every anime found
+    on them through one event loop. The number of requests in flight is bound
+    by the concurrency semaphore (and so is the number of anime in flight) and
+    retries are taken from the retry queue once everything else is done.
+
+    Arguments:
+        seasons -- Iterable of tuples holding the season name and url
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Keyword Arguments:
+        concurrency -- Max number of requests and of anime in flight
+        ( default : async_concurrency )
+
+    Returns:
+        Number of tasks that raised an exception.
+    """
+    if aiohttp is None :
+        raise ImportError('the async engine needs aiohttp installed (pip install aiohttp)')
+
+    tasks : set = set()
+    semaphore = asyncio.Semaphore(concurrency)
+    anime_slots = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session :
+        # start on every season
+        for season_name, season_url in seasons :
+            spawn_task(tasks, crawl_season(session,
+                                           semaphore,
+                                           anime_slots,
+                                           tasks,
+                                           season_name,
+                                           season_url,
+                                           thread_info_enabled,
+                                           to_mongodb))
+
+        # hand every retry back to the event loop once it is due
+        failed = 0
+        while True :
+            retry = pop_retry()
+
+            # nothing queued so wait on the tasks that could still queue more
+            if retry is None :
+                if len(tasks) < 1 :
+                    break
+                failed += await wait_on_tasks(tasks)
+                continue
+
+            # hold off until the retry is due then start it
+            due, retry_func, args, kwargs = retry
+            delay = due - monotonic()
+            if delay > 0 :
+                await asyncio.sleep(delay)
+            if retry_func is crawl_anime :
+                await spawn_bounded_task(tasks, anime_slots, retry_func(*args, **kwargs))
+            else :
+                spawn_task(tasks, retry_func(*args, **kwargs))
+    return failed
@@ -1,10 +1,21 @@
 # imports
 
-from datetime import datetime
+from datetime import datetime, timedelta
+
+# global var
+
+stale_before = None                                                  # entries filled before this moment get fetched again
 
 # static var
 
 datetime_format = "%m/%d/%Y %H:%M:%S"                                # format for the datetime variable
+max_age_units = {                                                    # suffixes accepted by parse_max_age
+    's' : 'seconds',                                                 #
+    'm' : 'minutes',                                                 #
+    'h' : 'hours',                                                   #
+    'd' : 'days',                                                    #
+    'w' : 'weeks',                                                   #
+}                                                                    #
 
 # functions
 
@@ -16,4 +27,77 @@ def get_datetime_now() -> str :
     Returns:
         the string representing the moment in time down to seconds
     """
-    return datetime.now().strftime(datetime_format)
\ No newline at end of file
+    return datetime.now().strftime(datetime_format)
+
+def parse_datetime(value : str | datetime | None) -> datetime | None :
+    """
+    parse_datetime -- This function turns a datetime string made by
+    get_datetime_now back into a datetime object. Values that already are
+    datetime objects (like the ones read back from mongodb) are returned as is.
+
+    Arguments:
+        value -- The string, datetime or NoneType Object to convert
+
+    Returns:
+        The datetime object or NoneType Object if the value was None.
+    """
+    if value is None or isinstance(value, datetime) :
+        return value
+    return datetime.strptime(value, datetime_format)
+
+def parse_max_age(max_age : str) -> timedelta :
+    """
+    parse_max_age -- This function turns an age like 7d, 12h or 2w into a
+    timedelta. A number without a suffix is read as days.
+
+    Arguments:
+        max_age -- The age as a number followed by s, m, h, d or w
+
+    Raises:
+        ValueError: The age isn't a number with one of the accepted suffixes
+
+    Returns:
+        The timedelta matching the age.
+    """
+    max_age = max_age.strip().lower()
+    if max_age[-1:] in max_age_units :
+        return timedelta(**{max_age_units[max_age[-1]] : float(max_age[:-1])})
+    return timedelta(days=float(max_age))
+
+def set_stale_before(cutoff : datetime | None) -> None :
+    """
+    set_stale_before -- This function sets the moment entries need to have been
+    filled after to be left alone. NoneType Object only fetches entries that
+    were never filled.
+
+    Arguments:
+        cutoff -- The datetime entries filled before get fetched again
+    """
+    global stale_before
+    stale_before = cutoff
+
+def get_stale_before() -> datetime | None :
+    """
+    get_stale_before -- This function grabs the moment entries need to have
+    been filled after to be left alone.
+
+    Returns:
+        The datetime set by set_stale_before or NoneType Object if unset.
+    """
+    return stale_before
+
+def is_stale(entry : dict) -> bool :
+    """
+    is_stale -- This function tells if an entry needs to be fetched, which is
+    when it was never filled or was filled before the stale cutoff.
+
+    Arguments:
+        entry -- The season or anime entry
+
+    Returns:
+        True if the entry needs to be fetched.
+    """
+    filled = parse_datetime(entry.get('datetime_filled', None))
+    if filled is None :
+        return True
+    return stale_before is not None and filled < stale_before
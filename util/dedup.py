@@ -0,0 +1,69 @@
+# imports
+
+from threading import Lock
+
+# global var
+
+claimed_ids = {}                                                     # ids claimed this run for each purpose
+
+# static var
+
+claim_lock = Lock()                                                  # lock used for the claimed ids
+claim_purposes = ['stub', 'fetch']                                   # things done once per anime each run
+
+# functions
+
+def claim_anime_id(anime_id : int, purpose : str) -> bool :
+    """
+    claim_anime_id -- This function lets only the first caller of a run go
+    ahead for each anime and purpose. The same title is listed by several
+    seasons (continuing and multi-cour shows) so without it every listing would
+    make its own stub and fetch its own pages.
+
+    Arguments:
+        anime_id -- MAL id of the anime
+        purpose -- What is about to be done with the anime (found in
+        claim_purposes)
+
+    Raises:
+        ValueError: The purpose is unknown
+
+    Returns:
+        True if the id wasn't claimed for the purpose yet (and now is).
+    """
+    if purpose not in claim_purposes :
+        raise ValueError(f'unknown claim purpose {purpose} (pick one of {claim_purposes})')
+    with claim_lock :
+        ids = claimed_ids.setdefault(purpose, set())
+        if anime_id in ids :
+            return False
+        ids.add(anime_id)
+        return True
+
+def anime_id_claimed(anime_id : int, purpose : str) -> bool :
+    """
+    anime_id_claimed -- This function tells if an anime was already claimed for
+    a purpose without claiming it.
+
+    Arguments:
+        anime_id -- MAL id of the anime
+        purpose -- One of claim_purposes
+
+    Returns:
+        True if the id was claimed for the purpose this run.
+    """
+    with claim_lock :
+        return anime_id in claimed_ids.get(purpose, ())
+
+def count_claims(purpose : str) -> int :
+    """
+    count_claims -- This function counts the anime claimed for a purpose.
+
+    Arguments:
+        purpose -- One of claim_purposes
+
+    Returns:
+        Number of ids claimed for the purpose this run.
+    """
+    with claim_lock :
+        return len(claimed_ids.get(purpose, ()))
@@ -0,0 +1,184 @@
+# imports
+
+from json import dumps, load
+from os import listdir, makedirs, path, remove, replace
+from re import compile
+from threading import Lock, get_ident
+from typing import Iterator
+from util.jsonformat import json_indent_len
+from util.metrics import track_stage
+
+# global var
+
+json_compact = False                                                 # write documents without indents or spaces
+
+# static var
+
+disk_lock_stripes = [Lock() for _ in range(64)]                      # locks shared by the keys hashing to them
+disk_shard_count = 100                                               # number of subdirectories the anime are spread over
+file_key_regex = compile(r'(\d+)\.json$')                          # pulls the id out of a document file name
+
+# functions
+
+def set_compact_json(compact : bool) -> None :
+    """
+    set_compact_json -- This function picks if documents are written compact
+    (smaller and faster) or with indents (readable).
+
+    Arguments:
+        compact -- When enabled documents are written without indents
+    """
+    global json_compact
+    json_compact = compact
+
+def format_json(document : dict) -> str :
+    """
+    format_json -- This function turns a document into the json written to disk.
+
+    Arguments:
+        document -- The document to write
+
+    Returns:
+        The json as a string.
+    """
+    if json_compact :
+        return dumps(document, separators=(',', ':'))
+    return dumps(document, indent=json_indent_len)
+
+def get_key_lock(key : int) -> Lock :
+    """
+    get_key_lock -- This function grabs the lock guarding the writes of a key.
+    Keys are spread over a fixed number of locks so threads writing different
+    documents rarely wait on each other.
+
+    Arguments:
+        key -- The id of the document
+
+    Returns:
+        The lock of the key.
+    """
+    return disk_lock_stripes[hash(key) % len(disk_lock_stripes)]
+
+def shard_dir(data_path : str, key : int) -> str :
+    """
+    shard_dir -- This function makes the subdirectory a document is kept in so
+    no directory ends up holding every anime.
+
+    Arguments:
+        data_path -- The data directory
+        key -- The id of the document
+
+    Returns:
+        Path of the subdirectory ending with a slash.
+    """
+    return f'{data_path}{key % disk_shard_count:02}/'
+
+def read_json(file_path : str) -> dict | None :
+    """
+    read_json -- This function reads a document without taking any lock. The
+    writes replace the file in one step so a read always sees a whole document.
+
+    Arguments:
+        file_path -- Path of the document
+
+    Returns:
+        The document or NoneType Object if the file doesn't exist.
+    """
+    with track_stage('disk_read') :
+        try :
+            with open(file_path, 'r') as file :
+                return load(file)
+        except FileNotFoundError :
+            return None
+
+def write_json(file_path : str, document : dict, key : int, only_if_missing : bool = False) -> bool :
+    """
+    write_json -- This function writes a document next to its final path then
+    renames it into place so readers never see half of a file.
+
+    Arguments:
+        file_path -- Path of the document
+        document -- The document to write
+        key -- The id of the document
+
+    Keyword Arguments:
+        only_if_missing -- Leave the file alone if it already exists
+        ( default : False )
+
+    Returns:
+        True if the document was written.
+    """
+    with track_stage('disk_write') :
+        content = format_json(document)
+        with get_key_lock(key) :
+            if only_if_missing and path.exists(file_path) :
+                return False
+            makedirs(path.dirname(file_path), exist_ok=True)
+            temp_path = f'{file_path}.{get_ident()}.tmp'
+            with open(temp_path, 'w') as file :
+                file.write(content)
+            replace(temp_path, file_path)
+        return True
+
+def list_json_files(data_path : str) -> Iterator[str] :
+    """
+    list_json_files -- This function walks through every document of a data
+    directory including the ones inside of shard subdirectories.
+
+    Arguments:
+        data_path -- The data directory
+
+    Yields:
+        Path of every json file.
+    """
+    for name in listdir(data_path) :
+        if path.isdir(data_path + name) :
+            for file_name in listdir(data_path + name) :
+                if file_name.endswith('.json') :
+                    yield f'{data_path}{name}/{file_name}'
+        elif name.endswith('.json') :
+            yield data_path + name
+
+def shard_flat_files(data_path : str) -> int :
+    """
+    shard_flat_files -- This function moves documents written straight into the
+    data directory (before it was sharded) into their shard subdirectory.
+
+    Arguments:
+        data_path -- The data directory
+
+    Returns:
+        Number of files moved.
+    """
+    moved = 0
+    for name in listdir(data_path) :
+        match = file_key_regex.search(name)
+        if match is None or path.isdir(data_path + name) :
+            continue
+        destination = shard_dir(data_path, int(match.group(1)))
+        makedirs(destination, exist_ok=True)
+        replace(data_path + name, destination + name)
+        moved += 1
+    return moved
+
+def clear_data_dir(data_path : str) -> int :
+    """
+    clear_data_dir -- This function removes every file of a data directory
+    including the ones inside of shard subdirectories.
+
+    Arguments:
+        data_path -- The data directory
+
+    Returns:
+        Number of files removed.
+    """
+    removed = 0
+    for name in listdir(data_path) :
+        if path.isdir(data_path + name) :
+            for file_name in listdir(data_path + name) :
+                remove(f'{data_path}{name}/{file_name}')
+                removed += 1
+        else :
+            remove(data_path + name)
+            removed += 1
+    return removed
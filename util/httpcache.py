@@ -0,0 +1,204 @@
+# imports
+
+import sqlite3
+from hashlib import sha256
+from os import makedirs, path, replace
+from threading import Lock, get_ident
+from time import time
+from typing import Any
+from util.metrics import inc_counter
+
+# global var
+
+http_cache_connection = None                                         # sqlite connection to the index (NoneType Object when disabled)
+http_cache_dir = None                                                # directory holding the index and bodies
+http_cache_stats = {'fresh' : 0, 'revalidated' : 0, 'stored' : 0}    # number of pages served or saved by the cache
+http_cache_ttl = 0.0                                                 # seconds a cached page is served without asking MAL
+
+# static var
+
+http_cache_body_dir = 'bodies/'                                      # directory holding the bodies keyed on their sha256
+http_cache_index_file = 'index.sqlite3'                              # sqlite file mapping urls to their validators
+http_cache_lock = Lock()                                             # lock used for the index connection and stats
+
+# functions
+
+def set_http_cache(cache_dir : str, ttl : float) -> None :
+    """
+    set_http_cache -- This function turns on the http cache. Every page fetched
+    is saved under the cache directory and sent again with If-None-Match and
+    If-Modified-Since so MAL can answer with a 304 instead of the whole page.
+
+    Arguments:
+        cache_dir -- Directory holding the index and bodies
+        ttl -- Seconds a cached page is served without asking MAL at all; 0
+        always revalidates and float('inf') never touches the network for
+        cached pages
+    """
+    global http_cache_connection, http_cache_dir, http_cache_ttl
+    cache_dir = path.join(cache_dir, '')
+    makedirs(cache_dir + http_cache_body_dir, exist_ok=True)
+
+    # open the index (one connection shared by every thread behind the lock)
+    connection = sqlite3.connect(cache_dir + http_cache_index_file, check_same_thread=False)
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.execute('CREATE TABLE IF NOT EXISTS responses ('
+                       'url TEXT PRIMARY KEY, '
+                       'etag TEXT, '
+                       'last_modified TEXT, '
+                       'fetched REAL NOT NULL, '
+                       'digest TEXT NOT NULL)')
+    connection.commit()
+
+    with http_cache_lock :
+        http_cache_connection = connection
+        http_cache_dir = cache_dir
+        http_cache_ttl = ttl
+
+def close_http_cache() -> None :
+    """
+    close_http_cache -- This function closes the index of the http cache. This
+    should be called once all of the scrubbing is finished.
+    """
+    global http_cache_connection
+    with http_cache_lock :
+        if http_cache_connection is not None :
+            http_cache_connection.close()
+            http_cache_connection = None
+
+def body_path(digest : str) -> str :
+    """
+    body_path -- This function makes the path a body is saved at. Bodies are
+    spread over subdirectories named after the first two characters of the
+    digest.
+
+    Arguments:
+        digest -- The sha256 hex digest of the body
+
+    Returns:
+        Path of the body file.
+    """
+    return http_cache_dir + http_cache_body_dir + digest[:2] + '/' + digest
+
+def get_cached_entry(url : str) -> dict | None :
+    """
+    get_cached_entry -- This function grabs what the index knows about a url.
+
+    Arguments:
+        url -- String referencing the url that was visited
+
+    Returns:
+        Dictionary holding the url, etag, last_modified, fetched and digest of
+        the page or NoneType Object if the cache is off, the url was never cached
+        or its body went missing.
+    """
+    if http_cache_connection is None :
+        return None
+    with http_cache_lock :
+        row = http_cache_connection.execute('SELECT etag, last_modified, fetched, digest FROM responses WHERE url = ?',
+                                            (url,)).fetchone()
+    if row is None or not path.exists(body_path(row[3])) :
+        return None
+    return dict(zip(['url', 'etag', 'last_modified', 'fetched', 'digest'], (url,) + row))
+
+def is_fresh(cached_entry : dict | None) -> bool :
+    """
+    is_fresh -- This function tells if a cached page is young enough to be
+    served without asking MAL.
+
+    Arguments:
+        cached_entry -- The dictionary given by get_cached_entry
+
+    Returns:
+        True if the page was fetched within the ttl.
+    """
+    return cached_entry is not None and time() - cached_entry['fetched'] < http_cache_ttl
+
+def get_conditional_headers(cached_entry : dict | None) -> dict :
+    """
+    get_conditional_headers -- This function makes the headers asking MAL to
+    only send the page if it changed since it was cached.
+
+    Arguments:
+        cached_entry -- The dictionary given by get_cached_entry
+
+    Returns:
+        Dictionary of request headers; empty if nothing was cached.
+    """
+    headers = {}
+    if cached_entry is not None :
+        if cached_entry['etag'] is not None :
+            headers['If-None-Match'] = cached_entry['etag']
+        if cached_entry['last_modified'] is not None :
+            headers['If-Modified-Since'] = cached_entry['last_modified']
+    return headers
+
+def read_cached_body(cached_entry : dict, revalidated : bool = False) -> bytes :
+    """
+    read_cached_body -- This function reads the body of a cached page. A page
+    MAL answered with a 304 has its fetch time pushed forward.
+
+    Arguments:
+        cached_entry -- The dictionary given by get_cached_entry
+
+    Keyword Arguments:
+        revalidated -- MAL just confirmed the page didn't change ( default : False )
+
+    Returns:
+        The content of the cached page.
+    """
+    with open(body_path(cached_entry['digest']), 'rb') as file :
+        content = file.read()
+
+    with http_cache_lock :
+        if revalidated :
+            http_cache_stats['revalidated'] += 1
+            inc_counter('http_cache_hits_total', kind='revalidated')
+            http_cache_connection.execute('UPDATE responses SET fetched = ? WHERE url = ?',
+                                          (time(), cached_entry['url']))
+            http_cache_connection.commit()
+        else :
+            http_cache_stats['fresh'] += 1
+            inc_counter('http_cache_hits_total', kind='fresh')
+    return content
+
+def store_response(url : str, content : bytes, headers : Any) -> None :
+    """
+    store_response -- This function saves a page that was fetched. The body is
+    written under its sha256 so pages that didn't change share one file.
+
+    Arguments:
+        url -- String referencing the url that was visited
+        content -- The content of the response
+        headers -- The headers of the response (anything with a get method)
+    """
+    if http_cache_connection is None :
+        return
+
+    # write the body once (written next to its final path then renamed in)
+    digest = sha256(content).hexdigest()
+    file_path = body_path(digest)
+    if not path.exists(file_path) :
+        makedirs(path.dirname(file_path), exist_ok=True)
+        temp_path = f'{file_path}.{get_ident()}.tmp'
+        with open(temp_path, 'wb') as file :
+            file.write(content)
+        replace(temp_path, file_path)
+
+    # point the url at the body
+    with http_cache_lock :
+        http_cache_stats['stored'] += 1
+        http_cache_connection.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                                      (url, headers.get('ETag', None), headers.get('Last-Modified', None), time(), digest))
+        http_cache_connection.commit()
+
+def get_http_cache_stats() -> dict :
+    """
+    get_http_cache_stats -- This function grabs the number of pages the cache
+    served without a download (fresh or answered with a 304) and saved.
+
+    Returns:
+        Copy of the stats dictionary.
+    """
+    with http_cache_lock :
+        return dict(http_cache_stats)
@@ -1,30 +1,41 @@
 # imports
 
-from os import path, remove, mkdir, listdir
+from os import path, mkdir
 from util.anime import anime_dir
+from util.diskstore import clear_data_dir, shard_flat_files
 from util.season import season_dir
-from util.mongodb import drop_docs_in_collection, mongodb_season_collection, mongodb_anime_collection, mongodb_anime_ids_serialized
+from util.mongodb import drop_docs_in_collection, mongodb_season_collection, mongodb_anime_collection
 
-# static var
+# functions
 
-util_dir = 'util/'
+def init_storage() -> None :
+    """
+    init_storage -- This function makes the data directories if they are
+    missing. Documents are keyed on their MAL ids so anything stored by an
+    earlier run is kept and only new or unfilled entries get fetched.
+    """
+    for data_dir in [season_dir, anime_dir] :
+        if not path.exists(data_dir) :
+            mkdir(data_dir)
 
-# remove the season data if it exists
-if path.exists(season_dir) :
-    for file in listdir(season_dir) :
-        remove(season_dir + file)
-else :
-    mkdir(season_dir)
-drop_docs_in_collection(mongodb_season_collection)
+    # move anime written before the anime directory was sharded into their shard
+    shard_flat_files(anime_dir)
 
-# remove the anime data if it exists
-if path.exists(anime_dir) :
-    for file in listdir(anime_dir) :
-        remove(anime_dir + file)
-else :
-    mkdir(anime_dir)
-drop_docs_in_collection(mongodb_anime_collection)
+def reset_storage(to_mongodb : bool) -> None :
+    """
+    reset_storage -- This function wipes every season and anime stored on disk
+    or in mongodb so the next run starts from nothing.
 
-# check if pkl file is there and if it is remove it
-if path.exists(util_dir + mongodb_anime_ids_serialized) :
-    remove(util_dir + mongodb_anime_ids_serialized)
\ No newline at end of file
+    Arguments:
+        to_mongodb -- When enabled the mongodb collections are cleaned instead
+        of the data directories
+    """
+    if to_mongodb :
+        drop_docs_in_collection(mongodb_season_collection)
+        drop_docs_in_collection(mongodb_anime_collection)
+        return
+
+    # remove the season and anime data if it exists
+    init_storage()
+    for data_dir in [season_dir, anime_dir] :
+        clear_data_dir(data_dir)
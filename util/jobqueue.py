@@ -0,0 +1,471 @@
+# imports
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from os import getpid
+from pymongo import ASCENDING, ReturnDocument, UpdateOne
+from pymongo.collection import Collection
+from pymongo.errors import BulkWriteError
+from socket import gethostname
+from threading import Event, Lock, Thread
+from time import sleep
+from typing import Iterable
+from util.anime import get_anime_entry
+from util.datenow import is_stale
+from util.logqueue import logger
+from util.metrics import inc_counter, set_gauge
+from util.mongodb import bulk_write_max_ops, flush_bulk_writes, get_mongo_client, get_season_id, mongodb_anime_collection, mongodb_database_name, mongodb_job_collection
+from util.mount import get_retry_time
+from util.pipeline import wait_for_pipeline
+from util.retryqueue import pop_retry
+from util.season import get_season_entry
+
+# static var
+
+job_batch = 16                                                       # default number of jobs claimed at once
+job_lease_time = 5 * 60                                              # default seconds a claim holds a job before it can be reclaimed
+job_max_attempts = 5                                                 # claims a job gets before it is marked failed
+job_open_statuses = ['queued', 'leased']                             # statuses of jobs that still need a worker
+job_poll_interval = 5.0                                              # seconds an idle worker waits before claiming again
+job_priorities = {'anime' : 0, 'season' : 1}                         # lower is claimed first (anime before new seasons)
+job_statuses = ['queued', 'leased', 'done', 'failed']                # every status a job can be under
+
+# functions
+
+def get_job_collection() -> Collection :
+    """
+    get_job_collection -- This function grabs the job queue collection from the
+    shared client.
+
+    Returns:
+        The Collection object holding the jobs.
+    """
+    return get_mongo_client()[mongodb_database_name][mongodb_job_collection]
+
+def get_worker_id() -> str :
+    """
+    get_worker_id -- This function makes the name a worker holds its leases
+    under. It is unique across processes and machines sharing the queue.
+
+    Returns:
+        The host name followed by the process id.
+    """
+    return f'{gethostname()}-{getpid()}'
+
+def get_now() -> datetime :
+    """
+    get_now -- This function grabs the current time in UTC which is what every
+    lease is compared against (workers may sit in different time zones).
+
+    Returns:
+        The current datetime in UTC.
+    """
+    return datetime.now(timezone.utc)
+
+def ensure_job_indexes(thread_info_enabled : bool) -> None :
+    """
+    ensure_job_indexes -- This function makes the indexes the claims and the
+    reclaims query on. Indexes that already exist are left alone.
+
+    Arguments:
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running ensure_job_indexes')
+
+    jobs = get_job_collection()
+    jobs.create_index([('status', ASCENDING), ('priority', ASCENDING), ('available_at', ASCENDING)])
+    jobs.create_index([('status', ASCENDING), ('lease_expires', ASCENDING)])
+
+def start_job_round(thread_info_enabled : bool) -> int :
+    """
+    start_job_round -- This function drops the jobs that finished (done or
+    failed) in the last round so they can be queued again. Jobs still queued
+    or leased are kept.
+
+    Arguments:
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        Number of jobs dropped.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running start_job_round')
+
+    return get_job_collection().delete_many({'status' : {'$nin' : job_open_statuses}}).deleted_count
+
+def make_season_job(season_name : str, season_url : str) -> tuple[str, str, dict] :
+    """
+    make_season_job -- This function makes the job fetching a season.
+
+    Arguments:
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+
+    Returns:
+        A tuple containing the id of the job, its kind and the arguments of
+        the call.
+    """
+    return (f'season:{get_season_id(season_url)}', 'season', {'season_name' : season_name, 'season_url' : season_url})
+
+def make_anime_job(anime_id : int) -> tuple[str, str, dict] :
+    """
+    make_anime_job -- This function makes the job fetching an anime.
+
+    Arguments:
+        anime_id -- Unique identifier used within the season entry
+
+    Returns:
+        A tuple containing the id of the job, its kind and the arguments of
+        the call.
+    """
+    return (f'anime:{anime_id}', 'anime', {'anime_id' : anime_id})
+
+def enqueue_jobs(jobs : Iterable[tuple[str, str, dict]]) -> int :
+    """
+    enqueue_jobs -- This function puts jobs into the queue. A job already in the
+    queue (under any status) is left alone so an anime listed by several
+    seasons is only fetched once a round.
+
+    Arguments:
+        jobs -- Iterable of jobs made by make_season_job or make_anime_job
+
+    Returns:
+        Number of jobs that were new.
+    """
+    now = get_now()
+    operations = []
+    queued = 0
+    for job_id, kind, args in jobs :
+        operations.append(UpdateOne({'_id' : job_id}, {'$setOnInsert' : {
+            'kind' : kind,
+            'args' : args,
+            'priority' : job_priorities[kind],
+            'status' : 'queued',
+            'attempts' : 0,
+            'available_at' : now,
+            'lease_owner' : None,
+            'lease_expires' : None,
+            'datetime_entered' : now,
+            'datetime_finished' : None,
+            'error' : None,
+        }}, upsert=True))
+
+        # write in chunks so huge archives don't build one huge request
+        if len(operations) >= bulk_write_max_ops :
+            queued += write_jobs(operations)
+            operations = []
+    if len(operations) > 0 :
+        queued += write_jobs(operations)
+    inc_counter('jobs_enqueued_total', queued)
+    return queued
+
+def write_jobs(operations : list[UpdateOne]) -> int :
+    """
+    write_jobs -- This function writes a chunk of job upserts. Two workers
+    queueing the same anime at once can have both upserts try to insert it,
+    and the loser gets a duplicate key error even though the job is in the
+    queue, so those errors are left alone.
+
+    Arguments:
+        operations -- The upserts made by enqueue_jobs
+
+    Raises:
+        BulkWriteError: Any write error other than a duplicate key
+
+    Returns:
+        Number of jobs that were new.
+    """
+    try :
+        return get_job_collection().bulk_write(operations, ordered=False).upserted_count
+    except BulkWriteError as e :
+        if any(error['code'] != 11000 for error in e.details['writeErrors']) :
+            raise
+        return e.details['nUpserted']
+
+def claim_jobs(worker_id : str, batch : int = job_batch, lease_time : float = job_lease_time) -> list[dict] :
+    """
+    claim_jobs -- This function leases jobs to a worker. Each job is claimed
+    with a single find_one_and_update so two workers never get the same one.
+    Queued jobs that are due and leased jobs whose lease ran out (their worker
+    crashed or hung) can be claimed; every claim counts as an attempt.
+
+    Arguments:
+        worker_id -- The name the worker holds its leases under
+
+    Keyword Arguments:
+        batch -- Max number of jobs claimed ( default : job_batch )
+        lease_time -- Seconds the jobs are held before they can be reclaimed
+        unless the lease is renewed ( default : job_lease_time )
+
+    Returns:
+        List of the claimed jobs (empty when nothing can be claimed).
+    """
+    claimed = []
+    for _ in range(batch) :
+        now = get_now()
+        job = get_job_collection().find_one_and_update(
+            {'attempts' : {'$lt' : job_max_attempts},
+             '$or' : [{'status' : 'queued', 'available_at' : {'$lte' : now}},
+                      {'status' : 'leased', 'lease_expires' : {'$lt' : now}}]},
+            {'$set' : {'status' : 'leased', 'lease_owner' : worker_id, 'lease_expires' : now + timedelta(seconds=lease_time)},
+             '$inc' : {'attempts' : 1}},
+            sort=[('priority', ASCENDING), ('available_at', ASCENDING)],
+            return_document=ReturnDocument.AFTER)
+        if job is None :
+            break
+        claimed.append(job)
+    inc_counter('jobs_claimed_total', len(claimed))
+    return claimed
+
+def renew_leases(worker_id : str, job_ids : list[str], lease_time : float = job_lease_time) -> int :
+    """
+    renew_leases -- This function pushes back the expiry of the leases a worker
+    still holds (the heartbeat) so long jobs aren't reclaimed while running.
+
+    Arguments:
+        worker_id -- The name the worker holds its leases under
+        job_ids -- The ids of the jobs being worked on
+
+    Keyword Arguments:
+        lease_time -- Seconds added from now ( default : job_lease_time )
+
+    Returns:
+        Number of leases renewed; fewer than given means some were reclaimed
+        by another worker.
+    """
+    if len(job_ids) < 1 :
+        return 0
+    return get_job_collection().update_many(
+        {'_id' : {'$in' : job_ids}, 'status' : 'leased', 'lease_owner' : worker_id},
+        {'$set' : {'lease_expires' : get_now() + timedelta(seconds=lease_time)}}).modified_count
+
+def complete_job(worker_id : str, job : dict) -> bool :
+    """
+    complete_job -- This function marks a job as done.
+
+    Arguments:
+        worker_id -- The name the worker holds its leases under
+        job -- The claimed job
+
+    Returns:
+        True if the worker still held the lease.
+    """
+    result = get_job_collection().update_one(
+        {'_id' : job['_id'], 'status' : 'leased', 'lease_owner' : worker_id},
+        {'$set' : {'status' : 'done', 'lease_owner' : None, 'lease_expires' : None, 'datetime_finished' : get_now()}})
+    inc_counter('jobs_finished_total', status='done')
+    return result.modified_count > 0
+
+def release_job(worker_id : str, job : dict, error : str, delay : float) -> str :
+    """
+    release_job -- This function gives a job that failed back to the queue to
+    be claimed again once the delay has passed, or marks it failed once every
+    attempt has been used.
+
+    Arguments:
+        worker_id -- The name the worker holds its leases under
+        job -- The claimed job
+        error -- What went wrong
+        delay -- Seconds before the job can be claimed again
+
+    Returns:
+        The new status of the job ('queued' or 'failed').
+    """
+    now = get_now()
+    status = 'failed' if job['attempts'] >= job_max_attempts else 'queued'
+    get_job_collection().update_one(
+        {'_id' : job['_id'], 'status' : 'leased', 'lease_owner' : worker_id},
+        {'$set' : {'status' : status,
+                   'lease_owner' : None,
+                   'lease_expires' : None,
+                   'available_at' : now + timedelta(seconds=delay),
+                   'datetime_finished' : now if status == 'failed' else None,
+                   'error' : error}})
+    inc_counter('jobs_finished_total', status=status)
+    return status
+
+def reclaim_expired_leases() -> int :
+    """
+    reclaim_expired_leases -- This function puts jobs whose lease ran out back
+    into the queue (claim_jobs takes them directly as well) and marks the ones
+    that used every attempt as failed so they don't keep the round open.
+
+    Returns:
+        Number of leases reclaimed.
+    """
+    now = get_now()
+    jobs = get_job_collection()
+    expired = {'status' : 'leased', 'lease_expires' : {'$lt' : now}}
+    jobs.update_many(dict(expired, attempts={'$gte' : job_max_attempts}),
+                     {'$set' : {'status' : 'failed', 'lease_owner' : None, 'lease_expires' : None,
+                                'datetime_finished' : now, 'error' : 'lease expired'}})
+    return jobs.update_many(expired,
+                            {'$set' : {'status' : 'queued', 'lease_owner' : None, 'lease_expires' : None}}).modified_count
+
+def count_jobs() -> dict[str, int] :
+    """
+    count_jobs -- This function counts the jobs under each status.
+
+    Returns:
+        Dictionary of status -> number of jobs.
+    """
+    counts = {status : 0 for status in job_statuses}
+    for row in get_job_collection().aggregate([{'$group' : {'_id' : '$status', 'count' : {'$sum' : 1}}}]) :
+        counts[row['_id']] = row['count']
+    for status, count in counts.items() :
+        set_gauge('jobs', count, status=status)
+    return counts
+
+def find_stored_anime_ids(anime_ids : list[int]) -> set[int] :
+    """
+    find_stored_anime_ids -- This function checks which anime were really
+    stored, meaning their document in mongodb is filled and not stale. Stores
+    can fail after a job handed its pages off (in the pipeline writer or the
+    bulk write) so this is read back before a job is marked done.
+
+    Arguments:
+        anime_ids -- Unique identifiers of the anime to check
+
+    Returns:
+        Set of the anime ids that are stored.
+    """
+    if len(anime_ids) < 1 :
+        return set()
+    cursor = get_mongo_client()[mongodb_database_name][mongodb_anime_collection].find({'_id' : {'$in' : anime_ids}},
+                                                                                       {'datetime_filled' : 1})
+    return {anime['_id'] for anime in cursor if not is_stale(anime)}
+
+def run_job(job : dict, to_mongodb : bool, thread_info_enabled : bool) -> bool :
+    """
+    run_job -- This function runs the call behind a job. The anime listed by a
+    season are queued as jobs of their own.
+
+    Arguments:
+        job -- The claimed job
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        True if the entry was fetched and handed off to be stored (or didn't
+        need to be); anime jobs are checked with find_stored_anime_ids before
+        they are marked done.
+    """
+    args = job['args']
+    if job['kind'] == 'season' :
+        season_entry = get_season_entry(args['season_name'], args['season_url'], thread_info_enabled, to_mongodb)
+        if season_entry is None :
+            return False
+        enqueue_jobs(make_anime_job(anime['_id']) for anime in season_entry.get('seasonal_anime', []))
+        return True
+    return get_anime_entry(args['anime_id'], to_mongodb, thread_info_enabled) is not None
+
+def run_job_worker(to_mongodb : bool,
+                   thread_info_enabled : bool,
+                   worker_id : str | None = None,
+                   workers : int | None = None,
+                   batch : int = job_batch,
+                   lease_time : float = job_lease_time) -> tuple[int, int] :
+    """
+    run_job_worker -- This function claims batches of jobs and runs them with a
+    pool of threads until the queue has nothing left that is queued or leased.
+    A heartbeat thread renews the leases of the batch while it runs. Jobs are
+    only marked done once the parse stage stored what they fetched, and jobs
+    that failed (or whose anime can't be read back as stored) are released to
+    be retried by any worker after the retry delay, so a worker that crashes or is killed never loses work (its leases
+    run out and get reclaimed).
+
+    Arguments:
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        worker_id -- The name the leases are held under ( default : None,
+        made by get_worker_id )
+        workers -- Threads running jobs ( default : None, picked by python )
+        batch -- Jobs claimed at once ( default : job_batch )
+        lease_time -- Seconds a lease lasts without a heartbeat
+        ( default : job_lease_time )
+
+    Returns:
+        A tuple containing the number of jobs done and the number released
+        (to be retried or failed).
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running run_job_worker')
+
+    worker_id = worker_id or get_worker_id()
+    held : list[str] = []
+    held_lock = Lock()
+    stop = Event()
+
+    # renew the leases of the running batch a few times per lease
+    def run_heartbeat() -> None :
+        while not stop.wait(lease_time / 3) :
+            with held_lock :
+                job_ids = list(held)
+            renewed = renew_leases(worker_id, job_ids, lease_time)
+            if renewed < len(job_ids) :
+                logger.warning(f'{len(job_ids) - renewed} leases of {worker_id} were reclaimed by another worker')
+
+    heartbeat = Thread(target=run_heartbeat, daemon=True)
+    heartbeat.start()
+    done = 0
+    released = 0
+    try :
+        with ThreadPoolExecutor(workers) as executor :
+            while True :
+                jobs = claim_jobs(worker_id, batch, lease_time)
+                if len(jobs) < 1 :
+                    # wait on jobs leased by other workers (they can still queue anime or crash)
+                    reclaim_expired_leases()
+                    if sum(count_jobs()[status] for status in job_open_statuses) < 1 :
+                        break
+                    sleep(job_poll_interval)
+                    continue
+                with held_lock :
+                    held[:] = [job['_id'] for job in jobs]
+
+                # run the batch and let the parse stage store everything it fetched
+                futures = [executor.submit(run_job, job, to_mongodb, thread_info_enabled) for job in jobs]
+                results = []
+                for future in futures :
+                    try :
+                        results.append((future.result(), None))
+                    except Exception as e :
+                        logger.warning(f'Exception in job : {e}')
+                        results.append((False, repr(e)))
+                wait_for_pipeline(thread_info_enabled)
+                flush_bulk_writes(thread_info_enabled)
+
+                # the queue retries failed jobs so drop what they put into the local retry queue
+                while pop_retry() is not None :
+                    pass
+
+                # only anime that can be read back as filled count as done
+                stored = find_stored_anime_ids([job['args']['anime_id'] for job, (succeeded, _) in zip(jobs, results)
+                                                if succeeded and job['kind'] == 'anime'])
+                for job, (succeeded, error) in zip(jobs, results) :
+                    if succeeded and job['kind'] == 'anime' and job['args']['anime_id'] not in stored :
+                        succeeded, error = False, 'store failed'
+                    if succeeded :
+                        complete_job(worker_id, job)
+                        done += 1
+                    else :
+                        release_job(worker_id, job, error or 'fetch failed', get_retry_time())
+                        released += 1
+                with held_lock :
+                    held.clear()
+    finally :
+        stop.set()
+        heartbeat.join()
+    return (done, released)
@@ -0,0 +1,71 @@
+# imports
+
+import logging
+from logging.handlers import QueueHandler, QueueListener
+from os import register_at_fork
+from queue import SimpleQueue
+
+# global var
+
+log_listener = None                                                  # thread writing the queued records (NoneType Object when off)
+
+# static var
+
+log_format = 'thread %(thread)d %(message)s'                         # format of every record (the full thread ident like the old thread info prints)
+log_queue = SimpleQueue()                                            # records waiting on the listener
+logger = logging.getLogger('scrubber')                               # logger used by every module
+
+# functions
+
+def start_log_queue(debug : bool) -> None :
+    """
+    start_log_queue -- This function routes every record of the scrubber logger
+    through a queue so threads only pay for a put and a single listener thread
+    does the writing, instead of every thread contending for stdout.
+
+    Arguments:
+        debug -- When enabled the debug records (the thread info) are written
+    """
+    global log_listener
+    log_listener = QueueListener(log_queue, make_stream_handler())
+    log_listener.start()
+
+    logger.addHandler(QueueHandler(log_queue))
+    logger.setLevel(logging.DEBUG if debug else logging.INFO)
+    logger.propagate = False
+
+def make_stream_handler() -> logging.Handler :
+    """
+    make_stream_handler -- This function makes the handler that writes records
+    to the console.
+
+    Returns:
+        The StreamHandler object.
+    """
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter(log_format))
+    return stream_handler
+
+def write_log_directly() -> None :
+    """
+    write_log_directly -- This function swaps the queue for a plain handler in
+    forked processes (like the parser processes) since the listener thread
+    only runs in the parent.
+    """
+    if log_listener is not None :
+        logger.handlers.clear()
+        logger.addHandler(make_stream_handler())
+
+def stop_log_queue() -> None :
+    """
+    stop_log_queue -- This function writes out every queued record and stops
+    the listener thread. This should be called once all of the scrubbing is
+    finished.
+    """
+    global log_listener
+    if log_listener is not None :
+        log_listener.stop()
+        log_listener = None
+
+# forked processes have no listener of their own
+register_at_fork(after_in_child=write_log_directly)
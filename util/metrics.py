@@ -0,0 +1,334 @@
+# imports
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from json import dumps
+from os import replace
+from threading import Event, Lock, Thread
+from time import perf_counter, time
+from typing import Any, Callable, Iterator
+from util.jsonformat import json_indent_len
+
+# global var
+
+metric_counters = {}                                                 # (name, labels) -> running total
+metric_gauges = {}                                                   # (name, labels) -> current value
+metric_histograms = {}                                               # (name, labels) -> [bucket counts, sum, count]
+metrics_server = None                                                # http server exposing /metrics (NoneType Object when off)
+snapshot_stop = None                                                 # event stopping the snapshot thread
+snapshot_thread = None                                               # thread writing the json snapshots
+
+# static var
+
+metric_help = {                                                      # help line of every metric
+    'http_requests_total' : 'Responses received by status',          #
+    'http_bytes_total' : 'Bytes of page content downloaded',         #
+    'http_cache_hits_total' : 'Pages served by the http cache',      #
+    'http_retries_total' : 'Requests sent again by the retry policy', #
+    'retries_scheduled_total' : 'Calls put into the retry queue',    #
+    'dead_letters_total' : 'Urls that ran out of retries',           #
+    'stage_seconds' : 'Seconds spent in each stage',                 #
+    'stage_in_flight' : 'Calls currently inside of each stage',      #
+    'scheduler_in_flight' : 'Calls in flight in the thread engine',  #
+    'pipeline_pending' : 'Pages waiting on a parser or the writer',  #
+    'jobs_enqueued_total' : 'Jobs put into the job queue',           #
+    'jobs_claimed_total' : 'Jobs leased by this worker',             #
+    'jobs_finished_total' : 'Jobs this worker marked done, released or failed', #
+    'jobs' : 'Jobs in the job queue by status',                      #
+}                                                                    #
+metric_stages = ['http_fetch', 'parse', 'mongo_read', 'mongo_write', 'disk_read', 'disk_write'] # stages timed by track_stage
+metrics_lock = Lock()                                                # lock used for every metric
+stage_buckets = [0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0] # upper bounds of the latency buckets
+
+# functions
+
+def metric_key(name : str, labels : dict) -> tuple :
+    """
+    metric_key -- This function makes the key a metric is kept under.
+
+    Arguments:
+        name -- Name of the metric
+        labels -- Labels of the metric
+
+    Returns:
+        Tuple of the name and the sorted labels.
+    """
+    return (name, tuple(sorted(labels.items())))
+
+def inc_counter(name : str, value : float = 1, **labels : Any) -> None :
+    """
+    inc_counter -- This function adds to a counter.
+
+    Arguments:
+        name -- Name of the counter
+
+    Keyword Arguments:
+        value -- Amount added ( default : 1 )
+        labels -- Labels of the counter (like status=429)
+    """
+    key = metric_key(name, labels)
+    with metrics_lock :
+        metric_counters[key] = metric_counters.get(key, 0) + value
+
+def add_gauge(name : str, value : float, **labels : Any) -> None :
+    """
+    add_gauge -- This function moves a gauge up (or down with a negative value).
+
+    Arguments:
+        name -- Name of the gauge
+        value -- Amount added
+
+    Keyword Arguments:
+        labels -- Labels of the gauge
+    """
+    key = metric_key(name, labels)
+    with metrics_lock :
+        metric_gauges[key] = metric_gauges.get(key, 0) + value
+
+def set_gauge(name : str, value : float, **labels : Any) -> None :
+    """
+    set_gauge -- This function sets a gauge.
+
+    Arguments:
+        name -- Name of the gauge
+        value -- The new value
+
+    Keyword Arguments:
+        labels -- Labels of the gauge
+    """
+    key = metric_key(name, labels)
+    with metrics_lock :
+        metric_gauges[key] = value
+
+def observe(name : str, value : float, **labels : Any) -> None :
+    """
+    observe -- This function adds a value (like a latency) to a histogram.
+
+    Arguments:
+        name -- Name of the histogram
+        value -- The value observed
+
+    Keyword Arguments:
+        labels -- Labels of the histogram
+    """
+    key = metric_key(name, labels)
+    with metrics_lock :
+        histogram = metric_histograms.get(key, None)
+        if histogram is None :
+            histogram = metric_histograms[key] = [[0] * (len(stage_buckets) + 1), 0.0, 0]
+        histogram[0][bisect_left(stage_buckets, value)] += 1
+        histogram[1] += value
+        histogram[2] += 1
+
+@contextmanager
+def track_stage(stage : str) -> Iterator[None] :
+    """
+    track_stage -- This function times the body of a with statement as one call
+    of a stage and counts it as in flight while it runs.
+
+    Arguments:
+        stage -- Name of the stage found in metric_stages
+    """
+    add_gauge('stage_in_flight', 1, stage=stage)
+    start = perf_counter()
+    try :
+        yield
+    finally :
+        observe('stage_seconds', perf_counter() - start, stage=stage)
+        add_gauge('stage_in_flight', -1, stage=stage)
+
+def call_timed(func : Callable, *args : Any) -> tuple[Any, float] :
+    """
+    call_timed -- This function calls a function and times it. It is handed to
+    the parser processes (which have metrics of their own) so the time can be
+    observed back in the main process.
+
+    Arguments:
+        func -- The function to call (must be picklable)
+        args -- The function's arguments
+
+    Returns:
+        A tuple containing whatever the function gave back and the seconds it
+        took.
+    """
+    start = perf_counter()
+    result = func(*args)
+    return (result, perf_counter() - start)
+
+def format_labels(labels : tuple, extra : str = '') -> str :
+    """
+    format_labels -- This function writes labels the way Prometheus reads them.
+
+    Arguments:
+        labels -- Sorted tuple of label pairs
+
+    Keyword Arguments:
+        extra -- Label written after the others (like le="0.5") ( default : '' )
+
+    Returns:
+        The labels in braces or an empty string when there are none.
+    """
+    pairs = [f'{name}="{value}"' for name, value in labels] + ([extra] if extra != '' else [])
+    return '{' + ','.join(pairs) + '}' if len(pairs) > 0 else ''
+
+def render_prometheus() -> str :
+    """
+    render_prometheus -- This function writes every metric in the Prometheus
+    text format.
+
+    Returns:
+        The metrics as a string.
+    """
+    lines = []
+    written = set()
+
+    def header(name : str, kind : str) -> None :
+        if name not in written :
+            written.add(name)
+            lines.append(f'# HELP {name} {metric_help.get(name, name)}')
+            lines.append(f'# TYPE {name} {kind}')
+
+    with metrics_lock :
+        for (name, labels), value in sorted(metric_counters.items()) :
+            header(name, 'counter')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), value in sorted(metric_gauges.items()) :
+            header(name, 'gauge')
+            lines.append(f'{name}{format_labels(labels)} {value}')
+        for (name, labels), (buckets, total, count) in sorted(metric_histograms.items()) :
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, bucket in zip(stage_buckets + ['+Inf'], buckets) :
+                cumulative += bucket
+                bound_label = f'le="{bound}"'
+                lines.append(f'{name}_bucket{format_labels(labels, bound_label)} {cumulative}')
+            lines.append(f'{name}_sum{format_labels(labels)} {total}')
+            lines.append(f'{name}_count{format_labels(labels)} {count}')
+    return '\n'.join(lines) + '\n'
+
+def get_metrics_snapshot() -> dict :
+    """
+    get_metrics_snapshot -- This function grabs every metric as plain
+    dictionaries so they can be written out as json.
+
+    Returns:
+        Dictionary holding the time of the snapshot along with the counters,
+        gauges and histograms keyed on their name and labels.
+    """
+    def key_name(name : str, labels : tuple) -> str :
+        return name + format_labels(labels)
+
+    with metrics_lock :
+        return {
+            'time' : time(),
+            'counters' : {key_name(*key) : value for key, value in metric_counters.items()},
+            'gauges' : {key_name(*key) : value for key, value in metric_gauges.items()},
+            'histograms' : {
+                key_name(*key) : {
+                    'buckets' : dict(zip([str(bound) for bound in stage_buckets] + ['+Inf'], buckets)),
+                    'sum' : round(total, 6),
+                    'count' : count,
+                }
+                for key, (buckets, total, count) in metric_histograms.items()
+            },
+        }
+
+def write_metrics_snapshot(snapshot_path : str) -> None :
+    """
+    write_metrics_snapshot -- This function writes a json snapshot of every
+    metric next to its path then renames it into place so readers never see
+    half of a file.
+
+    Arguments:
+        snapshot_path -- The file the snapshot is written to
+    """
+    with open(snapshot_path + '.tmp', 'w') as file :
+        file.write(dumps(get_metrics_snapshot(), indent=json_indent_len))
+    replace(snapshot_path + '.tmp', snapshot_path)
+
+def start_metrics_server(port : int, host : str = '127.0.0.1') -> None :
+    """
+    start_metrics_server -- This function serves every metric in the
+    Prometheus text format at /metrics from a daemon thread.
+
+    Arguments:
+        port -- Port to listen on
+
+    Keyword Arguments:
+        host -- Address to listen on ( default : '127.0.0.1' )
+    """
+    class MetricsHandler(BaseHTTPRequestHandler) :
+        def do_GET(self) -> None :
+            if self.path.split('?')[0] != '/metrics' :
+                self.send_error(404)
+                return
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/plain; version=0.0.4')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args) -> None :
+            pass
+
+    global metrics_server
+    metrics_server = ThreadingHTTPServer((host, port), MetricsHandler)
+    metrics_server.daemon_threads = True
+    Thread(target=metrics_server.serve_forever, daemon=True).start()
+
+def start_metrics_snapshots(snapshot_path : str, interval : float) -> None :
+    """
+    start_metrics_snapshots -- This function writes a json snapshot of every
+    metric on an interval from a daemon thread.
+
+    Arguments:
+        snapshot_path -- The file the snapshots are written to
+        interval -- Seconds between snapshots
+    """
+    global snapshot_stop, snapshot_thread
+    snapshot_stop = Event()
+
+    def run_snapshots() -> None :
+        while not snapshot_stop.wait(interval) :
+            write_metrics_snapshot(snapshot_path)
+        write_metrics_snapshot(snapshot_path)
+
+    snapshot_thread = Thread(target=run_snapshots, daemon=True)
+    snapshot_thread.start()
+
+def stop_metrics() -> None :
+    """
+    stop_metrics -- This function writes the last snapshot and stops the
+    metrics server. This should be called once all of the scrubbing is
+    finished.
+    """
+    global metrics_server, snapshot_stop, snapshot_thread
+    if snapshot_thread is not None :
+        snapshot_stop.set()
+        snapshot_thread.join()
+        snapshot_stop = None
+        snapshot_thread = None
+    if metrics_server is not None :
+        metrics_server.shutdown()
+        metrics_server.server_close()
+        metrics_server = None
+
+def get_stage_summary() -> list[tuple[str, int, float]] :
+    """
+    get_stage_summary -- This function adds up the time spent in every stage
+    so a slow run can be told apart as network, parse or database bound.
+
+    Returns:
+        List of tuples holding the stage, number of calls and total seconds
+        sorted from the most time spent.
+    """
+    totals = {}
+    with metrics_lock :
+        for (name, labels), (_, total, count) in metric_histograms.items() :
+            if name == 'stage_seconds' :
+                stage = dict(labels)['stage']
+                calls, seconds = totals.get(stage, (0, 0.0))
+                totals[stage] = (calls + count, seconds + total)
+    return sorted([(stage, calls, seconds) for stage, (calls, seconds) in totals.items()], key=lambda row : -row[2])
@@ -1,32 +1,172 @@
 # imports
 
-from pymongo import MongoClient
+from pymongo import MongoClient, ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from pymongo.synchronous.cursor import Cursor
-from threading import Lock, get_ident
+from os import register_at_fork
+from re import compile
+from threading import Event, Lock, Thread
+from time import monotonic
 from typing import Any
+from util.datenow import parse_datetime
+from util.logqueue import logger
+from util.metrics import track_stage
 
 # global var
 
-anime_counter = 0
-season_counter = 0
+bulk_write_buffer = {}                                               # operations waiting to be written per (database, collection)
+bulk_write_count = 0                                                 # number of operations waiting in the buffer
+bulk_flush_stop = None                                               # event stopping the flusher thread
+bulk_flush_thread = None                                             # thread writing out the buffer once it is old enough
+bulk_write_flushed = monotonic()                                     # last time the buffer was written out
+mongodb_client = None                                                # client shared by every thread (made on first use)
+mongodb_host = 'mongodb://localhost:27017/'                          # hostname of mongodb instance
+mongodb_max_pool_size = 100                                          # max connections kept by the shared client
 
 # static var
 
-anime_counter_lock = Lock()                                          # lock used for the global anime counter
+bulk_flush_lock = Lock()                                             # lock held while the buffer is being written out
+bulk_write_lock = Lock()                                             # lock used for the bulk write buffer globals
+bulk_write_max_age = 5.0                                             # seconds an operation can wait before a flush
+bulk_write_max_ops = 500                                             # operations buffered before a flush
+mal_anime_id_regex = compile(r'/anime/(\d+)')                        # pulls the MAL id out of an anime url
+mal_season_id_regex = compile(r'/season/(\d{4})/(\w+)')              # pulls the year and season out of a season url
+mal_season_names = ['winter', 'spring', 'summer', 'fall']            # seasons in the order they air within a year
 mongodb_anime_collection = 'animes'                                  # the anime collection within mongodb database
+mongodb_client_lock = Lock()                                         # lock used when making the shared client
+mongodb_datetime_fields = ['datetime_entered', 'datetime_filled']    # fields stored as real datetimes in mongodb
 mongodb_database_name = "MAL-Scrubber"                               # the database associated with this project
-mongodb_host = 'mongodb://localhost:27017/'                          # hostname of mongodb instance
+mongodb_job_collection = 'jobs'                                      # the job queue collection within mongodb database
 mongodb_season_collection = 'seasons'                                # the season collection within mongodb database
-season_counter_lock = Lock()                                         # lock used for the global season counter
 
 # functions
 
+def set_mongo_host(host : str) -> None :
+    """
+    set_mongo_host -- This function sets the mongodb instance the shared client
+    connects to. It should be called before the client is made.
+
+    Arguments:
+        host -- Connection string of the instance
+    """
+    global mongodb_host
+    mongodb_host = host
+
+def set_mongo_pool_size(max_pool_size : int) -> None :
+    """
+    set_mongo_pool_size -- This function sets the max number of connections the
+    shared client keeps in its pool. It only applies if the client hasn't been
+    made yet so it should be done before talking to mongodb.
+
+    Arguments:
+        max_pool_size -- Max number of connections kept by the client
+    """
+    global mongodb_max_pool_size
+    mongodb_max_pool_size = max_pool_size
+
+def get_mongo_client() -> MongoClient :
+    """
+    get_mongo_client -- This function grabs the client shared by every thread
+    and makes it on the first call. pymongo pools connections inside of the
+    client and is thread safe so a single client is kept for the whole run.
+    The connection is only pinged once when the client is made.
+
+    Raises:
+        Exception: Connection/Issue pertaining to MongoDB
+
+    Returns:
+        The shared MongoClient object.
+    """
+    global mongodb_client
+    if mongodb_client is None :
+        with mongodb_client_lock :
+            if mongodb_client is None :
+                client = MongoClient(mongodb_host, maxPoolSize=mongodb_max_pool_size)
+                client.admin.command("ping")
+                mongodb_client = client
+    return mongodb_client
+
+def close_mongo_client() -> None :
+    """
+    close_mongo_client -- This function stops the flusher thread, writes out
+    anything left in the bulk write buffer and closes the shared client if it
+    was made. This should be called once all of the scrubbing is finished.
+    """
+    stop_bulk_flusher()
+    flush_bulk_writes(False)
+
+    global mongodb_client
+    with mongodb_client_lock :
+        if mongodb_client is not None :
+            mongodb_client.close()
+            mongodb_client = None
+
+def ensure_mongo_indexes(thread_info_enabled : bool) -> None :
+    """
+    ensure_mongo_indexes -- This function makes the indexes the incremental
+    mode queries on. Indexes that already exist are left alone.
+
+    Arguments:
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Raises:
+        Exception: Connection/Issue pertaining to MongoDB
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running ensure_mongo_indexes')
+
+    for collection in [mongodb_anime_collection, mongodb_season_collection] :
+        get_mongo_client()[mongodb_database_name][collection].create_index('datetime_filled')
+
+def with_mongo_datetimes(document : dict) -> dict :
+    """
+    with_mongo_datetimes -- This function makes a copy of a document with its
+    datetime strings turned into datetime objects so mongodb can index and
+    compare them.
+
+    Arguments:
+        document -- The document about to be written
+
+    Returns:
+        The copy of the document holding datetime objects.
+    """
+    document = dict(document)
+    for field in mongodb_datetime_fields :
+        if field in document :
+            document[field] = parse_datetime(document[field])
+    return document
+
+def get_stale_query(cutoff : Any | None) -> dict :
+    """
+    get_stale_query -- This function makes the query matching documents that
+    were never filled, were filled before the cutoff or still hold a datetime
+    string from before datetimes were stored as real datetimes.
+
+    Arguments:
+        cutoff -- The datetime documents filled before are stale; NoneType
+        Object only matches documents that were never filled
+
+    Returns:
+        The query as a dictionary.
+    """
+    if cutoff is None :
+        return {'datetime_filled' : None}
+    return {'$or' : [
+        {'datetime_filled' : None},
+        {'datetime_filled' : {'$type' : 'string'}},
+        {'datetime_filled' : {'$lt' : cutoff}},
+    ]}
+
 def insert_doc_into_mongo(document : Any,
                           database : str,
                           collection : str,
                           thread_info_enabled : bool) -> bool :
     """
-    insert_doc_into_mongo -- Insert a document object into mongodb.
+    insert_doc_into_mongo -- Insert a document object into mongodb unless a
+    document with the same _id is already there (upsert that only sets the
+    fields on insert) so reruns never clobber filled documents.
 
     Arguments:
         document -- An acceptable form of data to be submitted to mongodb
@@ -43,26 +183,191 @@ def insert_doc_into_mongo(document : Any,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled is True :
-        print(f'thread {get_ident():5} is running insert_doc_into_mongo')
+        logger.debug('is running insert_doc_into_mongo')
 
-    # make a connection to mongodb
+    # go to collection in the shared client
     try:
-        client = MongoClient(mongodb_host)
-        client.admin.command("ping")
-
-        # go to collection
-        col = client[database][collection]
+        col = get_mongo_client()[database][collection]
 
-        # insert the object into the collection
-        res = col.insert_one(document)
-
-        # close the connection to mongodb
-        client.close()
+        # insert the object into the collection if it is missing
+        with track_stage('mongo_write') :
+            res = col.update_one({'_id' : document['_id']}, {'$setOnInsert' : with_mongo_datetimes(document)}, upsert=True)
 
         return res.acknowledged
     except Exception as e:
         raise e
 
+def queue_insert_into_mongo(document : Any,
+                            database : str,
+                            collection : str,
+                            thread_info_enabled : bool) -> None :
+    """
+    queue_insert_into_mongo -- Buffer a document to be inserted into mongodb
+    with the next bulk write. Like insert_doc_into_mongo the document is only
+    written when no document with the same _id is there yet.
+
+    Arguments:
+        document -- An acceptable form of data to be submitted to mongodb
+        database -- The name of the database within mongodb
+        collection -- The collection inside of the database
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running queue_insert_into_mongo')
+
+    queue_bulk_write(UpdateOne({'_id' : document['_id']}, {'$setOnInsert' : with_mongo_datetimes(document)}, upsert=True),
+                     database,
+                     collection,
+                     thread_info_enabled)
+
+def queue_replace_in_mongo(query_criteria : dict,
+                           new_document : dict,
+                           database : str,
+                           collection : str,
+                           thread_info_enabled : bool) -> None :
+    """
+    queue_replace_in_mongo -- Buffer a document to replace the one matching the
+    criteria with the next bulk write. It is inserted if nothing matches.
+
+    Arguments:
+        query_criteria -- The criteria for the query to search on
+        new_document -- The new document with changes
+        database -- The name of the database within mongodb
+        collection -- The collection inside of the database
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running queue_replace_in_mongo')
+
+    queue_bulk_write(ReplaceOne(query_criteria, with_mongo_datetimes(new_document), upsert=True),
+                     database,
+                     collection,
+                     thread_info_enabled)
+
+def queue_bulk_write(operation : Any,
+                     database : str,
+                     collection : str,
+                     thread_info_enabled : bool) -> None :
+    """
+    queue_bulk_write -- Add a write operation to the buffer and flush the buffer
+    once it holds bulk_write_max_ops operations or the oldest has waited longer
+    than bulk_write_max_age seconds.
+
+    Arguments:
+        operation -- The pymongo write operation (UpdateOne, ReplaceOne, ...)
+        database -- The name of the database within mongodb
+        collection -- The collection inside of the database
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+    """
+    global bulk_write_count
+    with bulk_write_lock :
+        bulk_write_buffer.setdefault((database, collection), []).append(operation)
+        bulk_write_count += 1
+        flush_needed = bulk_write_count >= bulk_write_max_ops or monotonic() - bulk_write_flushed >= bulk_write_max_age
+    start_bulk_flusher()
+
+    if flush_needed :
+        flush_bulk_writes(thread_info_enabled)
+
+def start_bulk_flusher() -> None :
+    """
+    start_bulk_flusher -- This function starts the daemon thread writing out the
+    buffer once its oldest operation waited bulk_write_max_age seconds, so
+    documents aren't left in memory while the crawl waits on retries or the
+    rate limiter and no new writes come in. Nothing happens if it is already
+    running.
+    """
+    global bulk_flush_stop, bulk_flush_thread
+    with bulk_write_lock :
+        if bulk_flush_thread is not None :
+            return
+        bulk_flush_stop = Event()
+        stop = bulk_flush_stop
+
+        def run_flusher() -> None :
+            while not stop.wait(bulk_write_max_age) :
+                with bulk_write_lock :
+                    flush_needed = bulk_write_count > 0 and monotonic() - bulk_write_flushed >= bulk_write_max_age
+                if flush_needed :
+                    try :
+                        flush_bulk_writes(False)
+                    except Exception as e :
+                        logger.warning(f'Exception in bulk write flusher : {e}')
+
+        bulk_flush_thread = Thread(target=run_flusher, daemon=True)
+        bulk_flush_thread.start()
+
+def stop_bulk_flusher() -> None :
+    """
+    stop_bulk_flusher -- This function stops the flusher thread if it is
+    running (the buffer is left for the caller to write out).
+    """
+    global bulk_flush_stop, bulk_flush_thread
+    with bulk_write_lock :
+        thread = bulk_flush_thread
+        if thread is None :
+            return
+        bulk_flush_stop.set()
+        bulk_flush_stop = None
+        bulk_flush_thread = None
+    thread.join()
+
+def forget_bulk_flusher() -> None :
+    """
+    forget_bulk_flusher -- This function drops the flusher of the parent in
+    forked processes (like the parser processes) since its thread only runs in
+    the parent; one is started again on the next queued write.
+    """
+    global bulk_flush_stop, bulk_flush_thread
+    bulk_flush_stop = None
+    bulk_flush_thread = None
+
+def flush_bulk_writes(thread_info_enabled : bool) -> int :
+    """
+    flush_bulk_writes -- Write every buffered operation to mongodb with one
+    unordered bulk write per collection. When this returns every operation
+    buffered before the call has been written, even if another thread was
+    already in the middle of a flush.
+
+    Arguments:
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Raises:
+        Exception: Connection/Issue pertaining to MongoDB
+
+    Returns:
+        Number of operations written.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running flush_bulk_writes')
+
+    global bulk_write_buffer, bulk_write_count, bulk_write_flushed
+    with bulk_flush_lock :
+        # take the buffer so other threads can keep queueing while it is written
+        with bulk_write_lock :
+            buffer = bulk_write_buffer
+            bulk_write_buffer = {}
+            bulk_write_count = 0
+            bulk_write_flushed = monotonic()
+
+        # write each collection in one round trip (unordered so one bad document doesn't stop the rest)
+        written = 0
+        for (database, collection), operations in buffer.items() :
+            try :
+                with track_stage('mongo_write') :
+                    get_mongo_client()[database][collection].bulk_write(operations, ordered=False)
+            except BulkWriteError as e :
+                logger.warning(f'{len(e.details["writeErrors"])} of {len(operations)} writes failed in {collection} collection during bulk write')
+            written += len(operations)
+        return written
+
 def grab_doc_from_mongo(query_criteria : dict,
                         database : str,
                         collection : str,
@@ -86,21 +391,15 @@ def grab_doc_from_mongo(query_criteria : dict,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running grab_doc_from_mongo')
+        logger.debug('is running grab_doc_from_mongo')
 
-    # make a connection to mongodb
+    # go to collection in the shared client
     try:
-        client = MongoClient(mongodb_host)
-        client.admin.command("ping")
-
-        # go to collection
-        col = client[database][collection]
+        col = get_mongo_client()[database][collection]
 
         # grab the document from mongodb
-        document = col.find_one(query_criteria)
-
-        # close the connection to mongodb
-        client.close()
+        with track_stage('mongo_read') :
+            document = col.find_one(query_criteria)
 
         return document
     except Exception as e:
@@ -112,7 +411,8 @@ def update_doc_in_mongo(query_criteria : dict,
                         collection : str,
                         thread_info_enabled : bool) -> bool :
     """
-    update_doc_in_mongo -- update a document from mongodb.
+    update_doc_in_mongo -- update a document from mongodb or insert it if no
+    document matches the criteria.
 
     Arguments:
         query_criteria -- The criteria for the query to search on
@@ -130,21 +430,15 @@ def update_doc_in_mongo(query_criteria : dict,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running update_doc_in_mongo')
+        logger.debug('is running update_doc_in_mongo')
 
-    # make a connection to mongodb
+    # go to collection in the shared client
     try:
-        client = MongoClient(mongodb_host)
-        client.admin.command("ping")
+        col = get_mongo_client()[database][collection]
 
-        # go to collection
-        col = client[database][collection]
-
-        # replace old document
-        res = col.replace_one(query_criteria, new_document)
-
-        # close the connection to mongodb
-        client.close()
+        # replace old document (or insert it when it is missing)
+        with track_stage('mongo_write') :
+            res = col.replace_one(query_criteria, with_mongo_datetimes(new_document), upsert=True)
 
         return res.acknowledged
     except Exception as e:
@@ -153,13 +447,15 @@ def update_doc_in_mongo(query_criteria : dict,
 def generate_cursor(database : str,
                            collection : str,
                            thread_info_enabled : bool,
-                           query : dict = {}) -> Cursor :
+                           query : dict = {},
+                           projection : dict | None = None) -> Cursor :
     """
     generate_cursor : This functin will generate a cursor object for traversing
     a collection within the database. The query by default is set to empty to
     inclusively go through each document. This can be changed. There is no need
     to close the cursor explicitely since pymongo by default will close the
-    cursor once there is no longer any more entries in the queue.
+    cursor once there is no longer any more entries in the queue and the
+    shared client is closed at the end of the run.
 
     Arguments:
         database -- The name of the database within mongodb
@@ -170,6 +466,8 @@ def generate_cursor(database : str,
     Keyword Arguments:
         query -- ruleset for the find operation used for making the cursor
         (default: {})
+        projection -- fields handed back for each document (default: None,
+        every field)
 
     Raises:
         Exception: Connection/Issue pertaining to MongoDB
@@ -179,18 +477,14 @@ def generate_cursor(database : str,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled is True :
-        print(f'thread {get_ident():5} is running generate_cursor')
+        logger.debug('is running generate_cursor')
 
-    # make a connection to mongodb
+    # go to collection in the shared client
     try:
-        client = MongoClient(mongodb_host)
-        client.admin.command("ping")
-
-        # go to collection
-        col = client[database][collection]
+        col = get_mongo_client()[database][collection]
 
         # generate cursor
-        cursor : Cursor = col.find(query)
+        cursor : Cursor = col.find(query, projection)
 
         return cursor
     except Exception as e:
@@ -208,43 +502,53 @@ def drop_docs_in_collection(collection : str) -> None :
     Raises:
         Exception: Connection/Issue pertaining to MongoDB
     """
-    # make a connection to mongodb
+    # go to each collection in the shared client and clean the documents in the database
     try :
-        client = MongoClient(mongodb_host)
-        client.admin.command("ping")
-
-        # go to each collection and clean the documents in the database
-        count_deleted = client[mongodb_database_name][collection].delete_many({})
-        print(f'docs deleted in {collection} collection : {count_deleted}')
-
-        # close the connection
-        client.close()
+        count_deleted = get_mongo_client()[mongodb_database_name][collection].delete_many({})
+        logger.info(f'docs deleted in {collection} collection : {count_deleted}')
     except Exception as e:
-        print("Critical Error : connection couldn't clean database")
+        logger.error("Critical Error : connection couldn't clean database")
         exit(-5)
 
-def get_anime_id() -> int :
+def get_anime_id(anime_url : str) -> int :
     """
-    get_anime_id -- This function will grab an anime id number used for
-    mongodb.
+    get_anime_id -- This function will grab the MAL id of an anime from its url
+    which is used as the key of its document. The id never changes between
+    runs so the same anime always lands on the same document.
+
+    Arguments:
+        anime_url -- URL linking to the anime in MyAnimeList.net
+
+    Raises:
+        ValueError: The url doesn't hold an anime id
 
     Returns:
         anime id as an integer
     """
-    with anime_counter_lock :
-        global anime_counter
-        anime_counter += 1
-        return anime_counter
-    
-def get_season_id() -> int :
+    match = mal_anime_id_regex.search(anime_url)
+    if match is None :
+        raise ValueError(f'no MAL anime id found in {anime_url}')
+    return int(match.group(1))
+
+def get_season_id(season_url : str) -> int :
     """
-    get_season_id -- This function will grab a season id number used for
-    mongodb.
+    get_season_id -- This function will grab a season id number from the url of
+    a season which is used as the key of its document. The id is the year
+    followed by the season number (winter 1 to fall 4) so fall 2023 is 20234.
+
+    Arguments:
+        season_url -- URL linking to the season in MyAnimeList.net
+
+    Raises:
+        ValueError: The url doesn't hold a year and season
 
     Returns:
         season id as an integer
     """
-    with season_counter_lock :
-        global season_counter
-        season_counter += 1
-        return season_counter
+    match = mal_season_id_regex.search(season_url)
+    if match is None or match.group(2).lower() not in mal_season_names :
+        raise ValueError(f'no MAL season found in {season_url}')
+    return int(match.group(1)) * 10 + mal_season_names.index(match.group(2).lower()) + 1
+
+# forked processes have no flusher of their own
+register_at_fork(after_in_child=forget_bulk_flusher)
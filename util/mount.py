@@ -1,17 +1,51 @@
 # imports
 
-from requests import Session, Response
+from requests import Session
 from requests.adapters import HTTPAdapter
 from requests.exceptions import RetryError
-from time import sleep
-from threading import get_ident
+from threading import Lock, local
+from time import monotonic
 from typing import Any, Callable
 from urllib3.util import Retry
+from util.httpcache import get_cached_entry, is_fresh, get_conditional_headers, read_cached_body, store_response
+from util.logqueue import logger
+from util.metrics import inc_counter, track_stage
+from util.pagearchive import archive_page
+from util.ratelimit import acquire_token, report_backoff, report_status
+from util.retryqueue import schedule_retry
+
+# global var
+
+pool_connections = 10                                                # number of host pools cached by each adapter
+pool_maxsize = 10                                                    # max keep-alive connections saved per host pool
+session_local = local()                                              # per thread storage holding each thread's session
+session_registry = []                                                # every session opened so they can be closed on exit
+session_registry_lock = Lock()                                       # lock used for the session registry
+
+# classes
+
+class LimitedRetry(Retry) :
+    """
+    LimitedRetry -- Retry policy that reports every throttled response to the
+    shared rate limiter and waits on the token bucket before each retry so
+    retried requests count against the same budget as new ones.
+    """
+    def increment(self, method=None, url=None, response=None, error=None, _pool=None, _stacktrace=None) -> Retry :
+        if response is not None :
+            report_status(response.status)
+        return super().increment(method, url, response, error, _pool, _stacktrace)
+
+    def sleep(self, response=None) -> None :
+        inc_counter('http_retries_total')
+        start = monotonic()
+        super().sleep(response)
+        report_backoff(monotonic() - start)
+        acquire_token()
 
 # static var
 
-retry_time = 3 * 60                                                  # retry time in case of time out
-retry_strategy = Retry(                                              # retry policy for each session
+retry_time = 3 * 60                                                  # delay before a failed call is retried
+retry_strategy = LimitedRetry(                                       # retry policy for each session
     total=8,                                                         #
     backoff_factor=15,                                               # DO NOT MODIFY
     backoff_max=60*4,                                                #
@@ -21,19 +55,111 @@ retry_strategy = Retry(                                              # retry pol
 
 # functions
 
+def set_session_pool_size(connections : int, maxsize : int) -> None :
+    """
+    set_session_pool_size -- This function sets the size of the connection pool
+    held by the adapter of each session. It only applies to sessions made after
+    the call so it should be done before any requests are sent.
+
+    Arguments:
+        connections -- Number of host pools cached by each adapter
+        maxsize -- Max number of keep-alive connections saved per host pool
+    """
+    global pool_connections, pool_maxsize
+    pool_connections = connections
+    pool_maxsize = maxsize
+
+def set_retry_policy(delay : float, backoff_factor : float | None = None) -> None :
+    """
+    set_retry_policy -- This function changes the delay before a failed call is
+    ran again from the retry queue and the backoff of the retry policy. The
+    defaults are tuned for MAL so this is meant for runs against a local
+    stand-in server. It only applies to sessions made after the call.
+
+    Arguments:
+        delay -- Seconds a failed call waits in the retry queue
+
+    Keyword Arguments:
+        backoff_factor -- Backoff factor of the retry policy ( default : None,
+        left as it is )
+    """
+    global retry_time, retry_strategy
+    retry_time = delay
+    if backoff_factor is not None :
+        retry_strategy = retry_strategy.new(backoff_factor=backoff_factor)
+
+def get_retry_time() -> float :
+    """
+    get_retry_time -- This function grabs the delay before a failed call is ran
+    again from the retry queue.
+
+    Returns:
+        Number of seconds.
+    """
+    return retry_time
+
+def get_retry_strategy() -> Retry :
+    """
+    get_retry_strategy -- This function grabs the retry policy given to every
+    new session.
+
+    Returns:
+        The LimitedRetry object in use.
+    """
+    return retry_strategy
+
+def get_session() -> Session :
+    """
+    get_session -- This function grabs the session that belongs to the calling
+    thread or makes one if the thread has none yet. Sessions are kept for the
+    lifetime of the thread so connections to MAL stay alive between requests.
+
+    Returns:
+        The requests Session object tied to the calling thread.
+    """
+    session = getattr(session_local, 'session', None)
+    if session is None :
+        # create an adaptor holding the retry policy and pool size
+        adapter = HTTPAdapter(max_retries=retry_strategy,
+                              pool_connections=pool_connections,
+                              pool_maxsize=pool_maxsize)
+
+        # generate a session with the adapter
+        session = Session()
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        # store it for the thread and keep track of it for closing
+        session_local.session = session
+        with session_registry_lock :
+            session_registry.append(session)
+    return session
+
+def close_sessions() -> None :
+    """
+    close_sessions -- This function closes every session opened by any thread.
+    This should be called once all of the scrubbing is finished.
+    """
+    with session_registry_lock :
+        for session in session_registry :
+            session.close()
+        session_registry.clear()
+
 def init_session(url : str,
-                 retry_func : Callable,
+                 retry_func : Callable | None,
                  thread_info_enabled : bool,
                  args : list = [],
                  kwargs : dict = {}) -> tuple[Any, bool, Any] :
     """
-    init_session -- This function begins an http session with a url that will
-    be used to parse the contents of a GET request. This function will retry 
-    functions and needs to pass the function arguments within a list.
+    init_session -- This function sends a GET request to a url using the session
+    kept by the calling thread and returns the contents to be parsed. When the
+    retry policy gives up the parent function is put into the retry queue to
+    be ran again later and needs to pass the function arguments within a list.
 
     Arguments:
         url -- String referencing the url to visit
-        retry_func -- The parent function calling this function
+        retry_func -- The parent function calling this function; NoneType
+        Object leaves rescheduling to the caller
         thread_info_enabled -- When threads are implimented this will allow a
         print statement for debugging
     
@@ -44,44 +170,54 @@ def init_session(url : str,
     Returns:
         A tuple containing the content property of the Response class
         corrisponding to the HTTP request, a boolean that dictates if the
-        function had to be retried, and the resultant of the retried call
-        to the function.
+        function had to be retried, and NoneType Object kept for the
+        resultant of the retried call which now runs from the retry queue.
     """
     try :
         # give a heads up in the console that this has been called
         if thread_info_enabled :
-            print(f'thread {get_ident():5} is running init_session')
+            logger.debug('is running init_session')
 
-        # create an adaptor holding the retry policy
-        adapter = HTTPAdapter(max_retries=retry_strategy)
+        # serve the page from the http cache if it is still fresh
+        cached_entry = get_cached_entry(url)
+        if is_fresh(cached_entry) :
+            content = read_cached_body(cached_entry)
+        else :
+            # grab the session kept by this thread
+            session = get_session()
 
-        # generate a session with the adapter
-        session = Session()
-        session.mount('http://', adapter)
-        session.mount('https://', adapter)
+            # wait for the shared rate limiter before hitting MAL
+            acquire_token()
 
-        # sent a GET request and raise for status changes other than success (200)
-        response = session.get(url)
-        response.raise_for_status()
+            # sent a conditional GET request and raise for status changes other than success (200) or not modified (304)
+            with track_stage('http_fetch') :
+                response = session.get(url, headers=get_conditional_headers(cached_entry))
+            report_status(response.status_code)
+            if response.status_code == 304 and cached_entry is not None :
+                content = read_cached_body(cached_entry, revalidated=True)
+            else :
+                response.raise_for_status()
 
-        # grab the content from the response
-        content = response.content
+                # grab the content from the response (frees the connection for reuse) and cache it
+                content = response.content
+                inc_counter('http_bytes_total', len(content))
+                store_response(url, content, response.headers)
 
-        # close session
-        session.close()
+        # keep the raw page so it can be parsed again with --replay
+        archive_page(url, content)
 
-        # return tuple after close
+        # return tuple
         return (content, False, None)
     except RetryError as exception:
-        # give a heads up in the console that this has been called
-        if thread_info_enabled :
-            print(f'thread {get_ident():5} ran into a RetryError ({exception})')
-        else :
-            print(f'ran into a RetryError ({exception})')
-        
-        # close session
-        session.close()
-
-        # restart the entire season if a response error occurs
-        sleep(retry_time)
-        return (None, True, retry_func(*args, **kwargs))
+        # give a heads up in the console that the retry policy gave up
+        logger.warning(f'ran into a RetryError ({exception})')
+
+        # queue the parent function to be ran again instead of holding the thread
+        if retry_func is not None :
+            schedule_retry(url,
+                           retry_func,
+                           get_retry_time(),
+                           thread_info_enabled,
+                           args=args,
+                           kwargs=kwargs)
+        return (None, True, None)
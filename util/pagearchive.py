@@ -0,0 +1,209 @@
+# imports
+
+import gzip
+import tarfile
+from datetime import datetime
+from hashlib import sha1
+from io import BytesIO
+from os import getpid, listdir, makedirs, path
+from threading import Lock
+from time import time
+from typing import Iterator
+from util.logqueue import logger
+from util.mongodb import mal_anime_id_regex, mal_season_id_regex, mal_season_names
+
+try :
+    import zstandard
+except ImportError :
+    zstandard = None
+
+# global var
+
+page_archive_dir = None                                              # directory the shards are written to (NoneType Object when disabled)
+page_archive_shard = None                                            # tar file of the shard being written
+page_archive_shard_count = 0                                         # number of pages written to the shard being written
+page_archive_shard_index = 0                                         # number of shards written by this run
+page_archive_shard_size = 5000                                       # pages written to a shard before starting the next one
+
+# static var
+
+page_archive_lock = Lock()                                           # lock used for the shard being written
+page_archive_zstd_level = 10                                         # zstd level each page is compressed with
+page_kind_header = 'MAL.kind'                                        # pax header holding the kind of page (anime, characters or season)
+page_url_header = 'MAL.url'                                          # pax header holding the url of the page
+
+# functions
+
+def set_page_archive(archive_dir : str, shard_size : int = page_archive_shard_size) -> None :
+    """
+    set_page_archive -- This function turns on the raw page archive. Every
+    season, anime and /characters page fetched is written to tar shards inside
+    of the archive directory so it can be parsed again later with --replay.
+
+    Arguments:
+        archive_dir -- Directory the shards are written to
+
+    Keyword Arguments:
+        shard_size -- Pages written to a shard before starting the next one
+        ( default : page_archive_shard_size )
+    """
+    global page_archive_dir, page_archive_shard_size
+    archive_dir = path.join(archive_dir, '')
+    makedirs(archive_dir, exist_ok=True)
+    with page_archive_lock :
+        page_archive_dir = archive_dir
+        page_archive_shard_size = shard_size
+
+def close_page_archive() -> None :
+    """
+    close_page_archive -- This function closes the shard being written. This
+    should be called once all of the scrubbing is finished.
+    """
+    global page_archive_shard
+    with page_archive_lock :
+        if page_archive_shard is not None :
+            page_archive_shard.close()
+            page_archive_shard = None
+
+def get_page_kind(url : str) -> str | None :
+    """
+    get_page_kind -- This function tells what kind of MAL page a url points to.
+
+    Arguments:
+        url -- String referencing the url of the page
+
+    Returns:
+        'characters', 'season' or 'anime' or NoneType Object for any other page
+        (like the season archive) which isn't archived.
+    """
+    if url.endswith('/characters') :
+        return 'characters'
+    match = mal_season_id_regex.search(url)
+    if match is not None and match.group(2).lower() in mal_season_names :
+        return 'season'
+    if mal_anime_id_regex.search(url) is not None :
+        return 'anime'
+    return None
+
+def compress_page(content : bytes) -> tuple[bytes, str] :
+    """
+    compress_page -- This function compresses a page with zstd or with gzip
+    when zstandard isn't installed.
+
+    Arguments:
+        content -- The content of the page
+
+    Returns:
+        A tuple containing the compressed page and the file extension naming
+        the compression used.
+    """
+    if zstandard is not None :
+        return (zstandard.ZstdCompressor(level=page_archive_zstd_level).compress(content), '.zst')
+    return (gzip.compress(content), '.gz')
+
+def decompress_page(data : bytes, member_name : str) -> bytes :
+    """
+    decompress_page -- This function undoes compress_page using the extension
+    of the tar member.
+
+    Arguments:
+        data -- The compressed page
+        member_name -- Name of the tar member holding the page
+
+    Raises:
+        ImportError: The page was compressed with zstd and zstandard isn't installed
+
+    Returns:
+        The content of the page.
+    """
+    if member_name.endswith('.zst') :
+        if zstandard is None :
+            raise ImportError('the archive holds zstd pages which need zstandard installed (pip install zstandard)')
+        return zstandard.ZstdDecompressor().decompress(data)
+    if member_name.endswith('.gz') :
+        return gzip.decompress(data)
+    return data
+
+def archive_page(url : str, content : bytes) -> None :
+    """
+    archive_page -- This function writes a fetched page into the shard being
+    written. Pages that aren't season, anime or /characters pages are skipped.
+
+    Arguments:
+        url -- String referencing the url of the page
+        content -- The content of the page
+    """
+    global page_archive_shard, page_archive_shard_count, page_archive_shard_index
+    if page_archive_dir is None :
+        return
+    kind = get_page_kind(url)
+    if kind is None :
+        return
+
+    # compress the page before holding the lock
+    data, extension = compress_page(content)
+    member = tarfile.TarInfo(f'{kind}/{sha1(url.encode()).hexdigest()}.html{extension}')
+    member.size = len(data)
+    member.mtime = int(time())
+    member.pax_headers = {page_url_header : url, page_kind_header : kind}
+
+    with page_archive_lock :
+        # start a new shard if there is none open
+        if page_archive_shard is None :
+            shard_name = f'pages-{datetime.now().strftime("%Y%m%d%H%M%S")}-{getpid()}-{page_archive_shard_index:05}.tar'
+            page_archive_shard = tarfile.open(page_archive_dir + shard_name, 'w', format=tarfile.PAX_FORMAT)
+            page_archive_shard_index += 1
+            page_archive_shard_count = 0
+
+        # add the page and close the shard once it is full
+        page_archive_shard.addfile(member, BytesIO(data))
+        page_archive_shard_count += 1
+        if page_archive_shard_count >= page_archive_shard_size :
+            page_archive_shard.close()
+            page_archive_shard = None
+
+def list_shards(archive_dir : str) -> list[str] :
+    """
+    list_shards -- This function lists every shard of an archive oldest first
+    so pages archived again by later runs come after the older copies.
+
+    Arguments:
+        archive_dir -- Directory the shards were written to
+
+    Returns:
+        Sorted list of the paths of every shard.
+    """
+    archive_dir = path.join(archive_dir, '')
+    return [archive_dir + file for file in sorted(listdir(archive_dir)) if file.endswith('.tar')]
+
+def read_archive(archive_dir : str, thread_info_enabled : bool) -> Iterator[tuple[str, str, str, bytes]] :
+    """
+    read_archive -- This function walks through every page of an archive
+    without decompressing them. A shard cut short by a crash is read up to
+    the point it was cut.
+
+    Arguments:
+        archive_dir -- Directory the shards were written to
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Yields:
+        A tuple containing the kind, url and member name of a page along with
+        its compressed content.
+    """
+    for shard_path in list_shards(archive_dir) :
+        # give a heads up in the console that a shard is being read
+        if thread_info_enabled :
+            logger.debug(f'is reading {shard_path}')
+
+        try :
+            with tarfile.open(shard_path, 'r') as shard :
+                for member in shard :
+                    if not member.isfile() or page_url_header not in member.pax_headers :
+                        continue
+                    yield (member.pax_headers[page_kind_header],
+                           member.pax_headers[page_url_header],
+                           member.name,
+                           shard.extractfile(member).read())
+        except (tarfile.TarError, EOFError) as e :
+            logger.warning(f'stopped reading {shard_path} early ({e})')
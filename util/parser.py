@@ -0,0 +1,92 @@
+# imports
+
+from bs4 import BeautifulSoup, SoupStrainer
+from typing import Any
+
+try :
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError :
+    LexborHTMLParser = None
+
+try :
+    import lxml
+except ImportError :
+    lxml = None
+
+# global var
+
+parser_backend = 'html.parser'                                       # backend used to parse every page
+
+# static var
+
+parser_backends = ['html.parser', 'lxml', 'selectolax']              # every backend that can be selected
+parser_css_backend = 'selectolax'                                    # backend that uses the css selector extractors
+parser_ignored_tags = ['script', 'style', 'template']                # tags BeautifulSoup leaves out of the page text
+
+# functions
+
+def set_parser_backend(backend : str) -> None :
+    """
+    set_parser_backend -- This function picks the backend used to parse every
+    page. The html.parser and lxml backends build a BeautifulSoup tree while
+    selectolax builds a lexbor tree that is read with css selectors.
+
+    Arguments:
+        backend -- Name of the backend found in parser_backends
+
+    Raises:
+        ValueError: The backend is unknown
+        ImportError: The package behind the backend isn't installed
+    """
+    if backend not in parser_backends :
+        raise ValueError(f'unknown parser backend {backend} (pick one of {parser_backends})')
+    if backend == 'lxml' and lxml is None :
+        raise ImportError('the lxml backend needs lxml installed (pip install lxml)')
+    if backend == 'selectolax' and LexborHTMLParser is None :
+        raise ImportError('the selectolax backend needs selectolax installed (pip install selectolax)')
+
+    global parser_backend
+    parser_backend = backend
+
+def get_parser_backend() -> str :
+    """
+    get_parser_backend -- This function grabs the name of the backend in use.
+
+    Returns:
+        Name of the backend found in parser_backends.
+    """
+    return parser_backend
+
+def uses_css_backend() -> bool :
+    """
+    uses_css_backend -- This function tells if pages are parsed into a lexbor
+    tree that needs the css selector extractors.
+
+    Returns:
+        True if the selectolax backend is in use.
+    """
+    return parser_backend == parser_css_backend
+
+def make_soup(content : bytes, parse_only : SoupStrainer | None = None) -> Any :
+    """
+    make_soup -- This function parses the content of a page with the backend in
+    use. Tags that BeautifulSoup leaves out of the page text are dropped from
+    lexbor trees so both kinds of trees give the same text.
+
+    Arguments:
+        content -- The content of the page
+
+    Keyword Arguments:
+        parse_only -- Strainer limiting the BeautifulSoup tree to the parts of
+        the page that are read; lexbor trees are always built whole
+        ( default : None )
+
+    Returns:
+        A BeautifulSoup object or a LexborHTMLParser object depending on the
+        backend.
+    """
+    if uses_css_backend() :
+        tree = LexborHTMLParser(content)
+        tree.strip_tags(parser_ignored_tags)
+        return tree
+    return BeautifulSoup(content, parser_backend, parse_only=parse_only)
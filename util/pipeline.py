@@ -0,0 +1,161 @@
+# imports
+
+from concurrent.futures import Future, ProcessPoolExecutor
+from queue import Queue
+from threading import BoundedSemaphore, Condition, Thread
+from typing import Any, Callable
+from util.logqueue import logger
+from util.metrics import call_timed, observe, set_gauge
+from util.parser import get_parser_backend, set_parser_backend
+
+# global var
+
+parse_executor = None                                                # process pool parsing pages (NoneType Object when disabled)
+parse_slots = None                                                   # semaphore bounding the pages waiting on a parser or the writer
+pipeline_failures = 0                                                # number of pages that failed to parse or store
+pipeline_pending = 0                                                 # number of pages handed to the pipeline and not stored yet
+writer_queue = None                                                  # queue of parsed pages waiting on the writer
+writer_thread = None                                                 # thread storing every parsed page
+
+# static var
+
+pipeline_condition = Condition()                                     # condition used for the pending count
+pipeline_max_pending = 64                                            # default number of pages in the pipeline at once
+
+# functions
+
+def start_pipeline(processes : int, max_pending : int = pipeline_max_pending) -> None :
+    """
+    start_pipeline -- This function starts the parse stage. Pages fetched by
+    the I/O workers are parsed by a pool of processes (so parsing isn't held
+    back by the GIL) and a single writer thread stores the results.
+
+    Arguments:
+        processes -- Number of parser processes
+
+    Keyword Arguments:
+        max_pending -- Max number of pages waiting on a parser or the writer;
+        I/O workers block once it is reached ( default : pipeline_max_pending )
+    """
+    global parse_executor, parse_slots, writer_queue, writer_thread
+    parse_executor = ProcessPoolExecutor(processes,
+                                         initializer=set_parser_backend,
+                                         initargs=(get_parser_backend(),))
+    parse_slots = BoundedSemaphore(max_pending)
+    writer_queue = Queue()
+    writer_thread = Thread(target=run_writer, daemon=True)
+    writer_thread.start()
+
+def pipeline_enabled() -> bool :
+    """
+    pipeline_enabled -- This function tells if pages are handed to the parse
+    stage instead of being parsed by the I/O workers.
+
+    Returns:
+        True if start_pipeline was called.
+    """
+    return parse_executor is not None
+
+def get_parse_executor() -> ProcessPoolExecutor | None :
+    """
+    get_parse_executor -- This function grabs the process pool of the parse
+    stage so the async engine can await it directly.
+
+    Returns:
+        The process pool or NoneType Object if the parse stage isn't started.
+    """
+    return parse_executor
+
+def submit_parse(parse_func : Callable, parse_args : list, store_func : Callable[[Any], Any]) -> Future :
+    """
+    submit_parse -- This function hands a fetched page to the parse stage. The
+    parse function runs in a parser process and whatever it gives back is
+    passed to the store function on the writer thread. The caller blocks
+    while the pipeline is full.
+
+    Arguments:
+        parse_func -- Function turning the raw page into data (must be picklable)
+        parse_args -- The parse function's arguments
+        store_func -- Function storing the data given by the parse function
+
+    Returns:
+        Future holding whatever the store function gives back once the page
+        is stored; callers that don't need it can drop it.
+    """
+    global pipeline_pending
+    parse_slots.acquire()
+    with pipeline_condition :
+        pipeline_pending += 1
+        set_gauge('pipeline_pending', pipeline_pending)
+    stored = Future()
+    future = parse_executor.submit(call_timed, parse_func, *parse_args)
+    future.add_done_callback(lambda future : writer_queue.put((future, store_func, stored)))
+    return stored
+
+def run_writer() -> None :
+    """
+    run_writer -- This function is the body of the writer thread. It stores
+    every parsed page in the order they finish parsing.
+    """
+    global pipeline_failures, pipeline_pending
+    while True :
+        item = writer_queue.get()
+        if item is None :
+            return
+        future, store_func, stored = item
+
+        # store the page (the parser process timed the parse) and keep going if it failed
+        failed = False
+        try :
+            result, seconds = future.result()
+            observe('stage_seconds', seconds, stage='parse')
+            stored.set_result(store_func(result))
+        except Exception as e :
+            logger.warning(f'Exception in pipeline writer : {e}')
+            stored.set_exception(e)
+            failed = True
+
+        # free the slot the page held
+        parse_slots.release()
+        with pipeline_condition :
+            pipeline_pending -= 1
+            pipeline_failures += failed
+            set_gauge('pipeline_pending', pipeline_pending)
+            pipeline_condition.notify_all()
+
+def wait_for_pipeline(thread_info_enabled : bool) -> int :
+    """
+    wait_for_pipeline -- This function waits until every page handed to the
+    pipeline is parsed and stored. Nothing happens if the parse stage isn't
+    started.
+
+    Arguments:
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        Number of pages that failed to parse or store so far.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running wait_for_pipeline')
+
+    with pipeline_condition :
+        pipeline_condition.wait_for(lambda : pipeline_pending < 1)
+        return pipeline_failures
+
+def stop_pipeline() -> None :
+    """
+    stop_pipeline -- This function waits on the pipeline then stops the writer
+    thread and the parser processes. This should be called once all of the
+    scrubbing is finished.
+    """
+    global parse_executor, writer_thread
+    if parse_executor is None :
+        return
+    wait_for_pipeline(False)
+    writer_queue.put(None)
+    writer_thread.join()
+    parse_executor.shutdown()
+    parse_executor = None
+    writer_thread = None
@@ -0,0 +1,323 @@
+# imports
+
+import sys
+import tracemalloc
+from os import path
+from threading import Event, Thread, get_ident
+from time import clock_gettime, perf_counter
+from types import FrameType
+from util.metrics import get_stage_summary
+
+try :
+    from time import pthread_getcpuclockid
+except ImportError :
+    pthread_getcpuclockid = None
+
+# global var
+
+profile_cpu = {}                                                     # stage -> cpu seconds sampled inside of it
+profile_last_cpu = {}                                                # thread id -> cpu time at the last sample
+profile_line_ranges = {}                                             # util file -> [(first line, last line, function)]
+profile_peak_bytes = 0                                               # traced bytes when the peak snapshot was taken
+profile_peak_snapshot = None                                         # tracemalloc snapshot taken at the peak
+profile_stacks = {}                                                  # folded stack -> cpu seconds sampled on it
+profile_stop = None                                                  # event stopping the sampler thread
+profile_thread = None                                                # thread sampling every other thread
+
+# static var
+
+profile_frames = 25                                                  # frames kept by tracemalloc for each allocation
+profile_interval = 0.005                                             # seconds between samples
+profile_snapshot_interval = 1.0                                      # seconds between checks for a new memory peak
+profile_targets = {                                                  # (util file, function) -> stage named in the report
+    ('mount.py', 'init_session') : 'init_session',                   #
+    ('asyncengine.py', 'fetch_page') : 'fetch_page',                 #
+    ('parser.py', 'make_soup') : 'make_soup',                        # building the tree of a page
+    ('anime.py', 'get_anime_information_section') : 'get_anime_information_section',
+    ('anime.py', 'get_anime_information_section_css') : 'get_anime_information_section_css',
+    ('anime.py', 'get_anime_synopsis_section') : 'get_anime_synopsis_section',
+    ('anime.py', 'get_anime_synopsis_section_css') : 'get_anime_synopsis_section_css',
+    ('anime.py', 'parse_anime_character_staff_section') : 'parse_anime_character_staff_section',
+    ('anime.py', 'parse_anime_character_staff_section_css') : 'parse_anime_character_staff_section_css',
+    ('season.py', 'get_season_anime_links') : 'get_season_anime_links',
+    ('season.py', 'get_season_anime_links_css') : 'get_season_anime_links_css',
+    ('diskstore.py', 'format_json') : 'disk dumps (format_json)',    #
+    ('diskstore.py', 'read_json') : 'disk load (read_json)',         #
+    ('segmentstore.py', 'append') : 'disk dumps (SegmentStore.append)', #
+    ('segmentstore.py', 'read') : 'disk load (SegmentStore.read)',   #
+}                                                                    # (every function of mongodb.py is a stage of its own)
+profile_top = 10                                                     # allocation sites listed for each stage
+util_dir = path.dirname(path.abspath(__file__)) + '/'                # directory holding the util modules
+
+# functions
+
+def get_stage(file_name : str, function_name : str) -> str | None :
+    """
+    get_stage -- This function names the stage a frame belongs to.
+
+    Arguments:
+        file_name -- File of the frame's code
+        function_name -- Function the frame is running
+
+    Returns:
+        The stage or NoneType Object if the frame isn't the start of one.
+    """
+    if not file_name.startswith(util_dir) :
+        return None
+    module_name = path.basename(file_name)
+    if module_name == 'mongodb.py' :
+        return f'mongodb.{function_name}'
+    return profile_targets.get((module_name, function_name), None)
+
+def get_frame_stage(frame : FrameType | None) -> str :
+    """
+    get_frame_stage -- This function walks a stack from the innermost frame out
+    and names the stage of the first frame that starts one.
+
+    Arguments:
+        frame -- The innermost frame of the stack
+
+    Returns:
+        The stage or 'other' when no frame starts one.
+    """
+    while frame is not None :
+        stage = get_stage(frame.f_code.co_filename, frame.f_code.co_name)
+        if stage is not None :
+            return stage
+        frame = frame.f_back
+    return 'other'
+
+def fold_stack(frame : FrameType | None) -> str :
+    """
+    fold_stack -- This function writes a stack as a single line the way
+    flamegraph.pl and speedscope read them (outermost frame first).
+
+    Arguments:
+        frame -- The innermost frame of the stack
+
+    Returns:
+        The frames joined by semicolons.
+    """
+    names = []
+    while frame is not None :
+        names.append(f'{path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+def get_thread_cpu(thread_id : int) -> float | None :
+    """
+    get_thread_cpu -- This function grabs the cpu time used by a thread so far.
+
+    Arguments:
+        thread_id -- The id of the thread (as given by get_ident)
+
+    Returns:
+        Seconds of cpu time or NoneType Object when it can't be read (the
+        thread ended or the platform has no per thread clocks).
+    """
+    if pthread_getcpuclockid is None :
+        return None
+    try :
+        return clock_gettime(pthread_getcpuclockid(thread_id))
+    except OSError :
+        return None
+
+def take_sample(sampler_id : int) -> None :
+    """
+    take_sample -- This function charges the cpu time every thread used since
+    the last sample to the stack it is on now. Threads waiting on the network
+    or a lock use no cpu so they add nothing. Without per thread clocks every
+    sample is charged the interval instead (wall time).
+
+    Arguments:
+        sampler_id -- The id of the sampler thread (left out)
+    """
+    for thread_id, frame in sys._current_frames().items() :
+        if thread_id == sampler_id :
+            continue
+        cpu = get_thread_cpu(thread_id)
+        if cpu is None :
+            used = profile_interval
+        else :
+            used = cpu - profile_last_cpu.get(thread_id, cpu)
+            profile_last_cpu[thread_id] = cpu
+        if used <= 0 :
+            continue
+        stack = fold_stack(frame)
+        stage = get_frame_stage(frame)
+        profile_stacks[stack] = profile_stacks.get(stack, 0.0) + used
+        profile_cpu[stage] = profile_cpu.get(stage, 0.0) + used
+
+def check_memory_peak() -> None :
+    """
+    check_memory_peak -- This function takes a tracemalloc snapshot whenever the
+    traced memory is higher than at the last snapshot so the allocation table
+    shows what was alive at the peak of the run.
+    """
+    global profile_peak_bytes, profile_peak_snapshot
+    if not tracemalloc.is_tracing() :
+        return
+    current, _ = tracemalloc.get_traced_memory()
+    if current > profile_peak_bytes :
+        profile_peak_bytes = current
+        profile_peak_snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+
+def run_sampler() -> None :
+    """
+    run_sampler -- This function is the body of the sampler thread.
+    """
+    sampler_id = get_ident()
+    next_check = perf_counter() + profile_snapshot_interval
+    while not profile_stop.wait(profile_interval) :
+        take_sample(sampler_id)
+        if perf_counter() >= next_check :
+            check_memory_peak()
+            next_check = perf_counter() + profile_snapshot_interval
+    check_memory_peak()
+
+def start_profiler(frames : int = profile_frames) -> None :
+    """
+    start_profiler -- This function starts tracemalloc and a thread sampling
+    the stack of every other thread. Pages parsed by other processes aren't
+    seen so the parse stage should run in the I/O workers while profiling.
+
+    Keyword Arguments:
+        frames -- Frames kept by tracemalloc for each allocation; deeper
+        tracebacks name more allocations but slow down code that allocates a
+        lot (like building trees) which skews the cpu times, 0 leaves
+        tracemalloc off ( default : profile_frames )
+    """
+    global profile_stop, profile_thread
+    if frames > 0 :
+        tracemalloc.start(frames)
+    profile_stop = Event()
+    profile_thread = Thread(target=run_sampler, daemon=True)
+    profile_thread.start()
+
+def stop_profiler() -> None :
+    """
+    stop_profiler -- This function stops the sampler thread (taking a last
+    look at the memory) and tracemalloc.
+    """
+    global profile_stop, profile_thread
+    if profile_thread is None :
+        return
+    profile_stop.set()
+    profile_thread.join()
+    profile_stop = None
+    profile_thread = None
+    if tracemalloc.is_tracing() :
+        tracemalloc.stop()
+
+def load_line_ranges() -> None :
+    """
+    load_line_ranges -- This function finds the lines of every function and
+    method of the util modules so tracemalloc frames (which only hold a file
+    and a line) can be named.
+    """
+    profile_line_ranges.clear()
+    for module in list(sys.modules.values()) :
+        file_name = getattr(module, '__file__', None) or ''
+        if not file_name.startswith(util_dir) :
+            continue
+        functions = []
+        for value in vars(module).values() :
+            functions += [value] if callable(value) and hasattr(value, '__code__') else []
+            functions += [member for member in vars(value).values() if hasattr(member, '__code__')] if isinstance(value, type) else []
+        for function in functions :
+            code = function.__code__
+            if code.co_filename == file_name :
+                lines = [line for _, _, line in code.co_lines() if line is not None]
+                profile_line_ranges.setdefault(file_name, []).append((code.co_firstlineno, max(lines, default=code.co_firstlineno), code.co_name))
+
+def get_traceback_stage(traceback : tracemalloc.Traceback) -> str :
+    """
+    get_traceback_stage -- This function names the stage an allocation was
+    made in from the innermost frame out.
+
+    Arguments:
+        traceback -- The traceback of the allocation (oldest frame first)
+
+    Returns:
+        The stage or 'other' when no frame starts one.
+    """
+    for frame in reversed(traceback) :
+        for first, last, function_name in profile_line_ranges.get(frame.filename, []) :
+            if first <= frame.lineno <= last :
+                stage = get_stage(frame.filename, function_name)
+                if stage is not None :
+                    return stage
+    return 'other'
+
+def get_allocation_table() -> dict[str, list[tuple[str, int, int]]] :
+    """
+    get_allocation_table -- This function groups the memory alive at the peak
+    by stage and by the line that allocated it.
+
+    Returns:
+        Dictionary of stage -> list of tuples holding the allocating line, the
+        bytes and the number of blocks sorted from the most bytes.
+    """
+    if profile_peak_snapshot is None :
+        return {}
+    load_line_ranges()
+    sites = {}
+    for statistic in profile_peak_snapshot.statistics('traceback') :
+        stage = get_traceback_stage(statistic.traceback)
+        frame = statistic.traceback[-1]
+        site = f'{frame.filename}:{frame.lineno}'
+        size, count = sites.get((stage, site), (0, 0))
+        sites[(stage, site)] = (size + statistic.size, count + statistic.count)
+
+    table = {}
+    for (stage, site), (size, count) in sites.items() :
+        table.setdefault(stage, []).append((site, size, count))
+    return {stage : sorted(rows, key=lambda row : -row[1]) for stage, rows in table.items()}
+
+def write_profile(profile_path : str, top : int = profile_top) -> str :
+    """
+    write_profile -- This function writes the sampled stacks as a folded stack
+    file (profile_path + '.folded', weighted in microseconds of cpu) and a
+    report of the cpu time, peak allocations and wall time of every stage
+    (profile_path + '.txt').
+
+    Arguments:
+        profile_path -- Path the files are written to without an extension
+
+    Keyword Arguments:
+        top -- Allocation sites listed for each stage ( default : profile_top )
+
+    Returns:
+        The report.
+    """
+    with open(profile_path + '.folded', 'w') as file :
+        for stack, seconds in sorted(profile_stacks.items()) :
+            if round(seconds * 1e6) > 0 :
+                file.write(f'{stack} {round(seconds * 1e6)}\n')
+
+    lines = []
+    clock = 'cpu' if pthread_getcpuclockid is not None else 'wall (no per thread cpu clocks)'
+    total = max(sum(profile_cpu.values()), 1e-9)
+    lines.append(f'{clock} time sampled per stage')
+    for stage, seconds in sorted(profile_cpu.items(), key=lambda row : -row[1]) :
+        lines.append(f'    {stage:42} {seconds:10.3f} s {100 * seconds / total:6.1f} %')
+
+    if profile_peak_snapshot is not None :
+        lines.append(f'memory alive at the peak ({profile_peak_bytes / 1024:.0f} KiB traced) per stage')
+        for stage, rows in sorted(get_allocation_table().items(), key=lambda row : -sum(size for _, size, _ in row[1])) :
+            lines.append(f'    {stage} ({sum(size for _, size, _ in rows) / 1024:.1f} KiB)')
+            for site, size, count in rows[:top] :
+                lines.append(f'        {size / 1024:10.1f} KiB {count:8} blocks  {site}')
+
+    lines.append('wall time per stage')
+    for stage, calls, seconds in get_stage_summary() :
+        lines.append(f'    {stage:42} {seconds:10.3f} s {calls:8} calls')
+
+    report = '\n'.join(lines) + '\n'
+    with open(profile_path + '.txt', 'w') as file :
+        file.write(report)
+    return report
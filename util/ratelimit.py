@@ -0,0 +1,151 @@
+# imports
+
+from threading import Lock
+from time import monotonic, sleep
+from util.metrics import inc_counter
+
+# global var
+
+rate_limit_backoff_waited = 0.0                                      # seconds spent backing off after failed responses
+rate_limit_burst = 4.0                                               # max tokens the bucket can hold at once
+rate_limit_current = 2.0                                             # requests per second currently allowed
+rate_limit_max = 2.0                                                 # requests per second configured by the user
+rate_limit_requests = 0                                              # tokens handed out (one per request sent)
+rate_limit_slowed = float('-inf')                                    # last time the rate was cut
+rate_limit_successes = 0                                             # successful responses in a row since the last throttle or raise
+rate_limit_throttled = 0                                             # throttling responses received
+rate_limit_tokens = 4.0                                              # tokens currently sitting in the bucket
+rate_limit_updated = monotonic()                                     # last time the bucket was refilled
+rate_limit_waited = 0.0                                              # seconds callers were told to wait on the bucket
+
+# static var
+
+rate_limit_cooldown = 5.0                                            # min seconds between two cuts of the rate
+rate_limit_floor = 0.1                                               # slowest rate the limiter will back off to
+rate_limit_lock = Lock()                                             # lock used for every rate limit global
+rate_limit_slowdown = 0.75                                           # factor applied to the rate after a 429/503
+rate_limit_speedup = 0.1                                             # fraction of max rate recovered after a streak
+rate_limit_streak = 10                                               # successful responses in a row needed before speeding up
+success_status_codes = range(200, 300)                               # statuses counted towards a streak (along with 304)
+throttle_status_codes = [429, 503]                                   # statuses telling us MAL wants us to slow down
+
+# functions
+
+def set_rate_limit(rate : float, burst : float) -> None :
+    """
+    set_rate_limit -- This function configures the token bucket shared by all
+    threads. It should be called before any requests are sent.
+
+    Arguments:
+        rate -- Max number of requests per second sent to MAL
+        burst -- Max number of requests that can be sent back to back
+    """
+    global rate_limit_burst, rate_limit_current, rate_limit_max, rate_limit_slowed, rate_limit_successes, rate_limit_tokens, rate_limit_updated
+    with rate_limit_lock :
+        rate_limit_max = rate
+        rate_limit_current = rate
+        rate_limit_burst = max(burst, 1.0)
+        rate_limit_tokens = rate_limit_burst
+        rate_limit_updated = monotonic()
+        rate_limit_slowed = float('-inf')
+        rate_limit_successes = 0
+
+def reserve_token() -> float :
+    """
+    reserve_token -- This function takes a token out of the bucket. When the
+    bucket is empty the token is borrowed against the future and the time the
+    caller has to wait for it is returned instead.
+
+    Returns:
+        Number of seconds the caller needs to wait before sending its request.
+    """
+    global rate_limit_requests, rate_limit_tokens, rate_limit_updated, rate_limit_waited
+    with rate_limit_lock :
+        # refill the bucket based on the time passed
+        now = monotonic()
+        rate_limit_tokens = min(rate_limit_burst,
+                                rate_limit_tokens + (now - rate_limit_updated) * rate_limit_current)
+        rate_limit_updated = now
+
+        # take the token and work out how long until it is paid back
+        rate_limit_requests += 1
+        rate_limit_tokens -= 1.0
+        if rate_limit_tokens >= 0 :
+            return 0.0
+        rate_limit_waited += -rate_limit_tokens / rate_limit_current
+        return -rate_limit_tokens / rate_limit_current
+
+def acquire_token() -> float :
+    """
+    acquire_token -- This function blocks the calling thread until it is allowed
+    to send a request to MAL.
+
+    Returns:
+        Number of seconds spent waiting on the bucket.
+    """
+    wait = reserve_token()
+    if wait > 0 :
+        sleep(wait)
+    return wait
+
+def report_status(status_code : int) -> None :
+    """
+    report_status -- This function adjusts the rate of the bucket from the status
+    of a response. A throttling status ends the streak of successes and cuts
+    the rate but only once per window (the longer of rate_limit_cooldown and
+    the gap between two requests) since the requests already in flight were
+    sent at the old rate and would cut it again for nothing. Every
+    rate_limit_streak successful responses (2xx or 304) in a row bring the
+    rate back up towards the configured max. Server errors end the streak and
+    other statuses leave it alone.
+
+    Arguments:
+        status_code -- The HTTP status returned by MAL
+    """
+    global rate_limit_current, rate_limit_slowed, rate_limit_successes, rate_limit_throttled
+    inc_counter('http_requests_total', status=status_code)
+    with rate_limit_lock :
+        if status_code in throttle_status_codes :
+            rate_limit_throttled += 1
+            rate_limit_successes = 0
+            now = monotonic()
+            if now - rate_limit_slowed >= max(rate_limit_cooldown, 1.0 / rate_limit_current) :
+                rate_limit_current = max(rate_limit_floor, rate_limit_current * rate_limit_slowdown)
+                rate_limit_slowed = now
+        elif status_code in success_status_codes or status_code == 304 :
+            rate_limit_successes += 1
+            if rate_limit_successes >= rate_limit_streak :
+                rate_limit_current = min(rate_limit_max, rate_limit_current + rate_limit_max * rate_limit_speedup)
+                rate_limit_successes = 0
+        elif status_code >= 500 :
+            rate_limit_successes = 0
+
+def report_backoff(seconds : float) -> None :
+    """
+    report_backoff -- This function keeps track of the time spent backing off
+    before a failed request is sent again.
+
+    Arguments:
+        seconds -- Number of seconds the caller slept
+    """
+    global rate_limit_backoff_waited
+    with rate_limit_lock :
+        rate_limit_backoff_waited += seconds
+
+def get_rate_limit_stats() -> dict :
+    """
+    get_rate_limit_stats -- This function grabs what the rate limiter saw over
+    the run.
+
+    Returns:
+        Dictionary holding the number of requests sent and throttling responses
+        received along with the seconds spent waiting on the bucket and backing
+        off.
+    """
+    with rate_limit_lock :
+        return {
+            'requests' : rate_limit_requests,
+            'throttled' : rate_limit_throttled,
+            'rate_limit_wait_seconds' : round(rate_limit_waited, 3),
+            'backoff_seconds' : round(rate_limit_backoff_waited, 3),
+        }
@@ -0,0 +1,146 @@
+# imports
+
+from contextlib import nullcontext
+from multiprocessing import Pool
+from typing import Any, Iterable, Iterator
+from util.anime import fill_anime_entry, load_anime_entry, reset_anime_entry, parse_anime_page, parse_anime_character_staff_section
+from util.logqueue import logger
+from util.mongodb import flush_bulk_writes, get_anime_id
+from util.pagearchive import decompress_page, read_archive
+from util.parser import get_parser_backend, set_parser_backend
+from util.season import build_season_entry, parse_season_anime_links, season_url_to_name, store_season_entry
+
+# static var
+
+replay_chunksize = 8                                                 # pages handed to a worker process at a time
+
+# functions
+
+def parse_archived_page(page : tuple[str, str, str, bytes]) -> tuple[str, str, Any] :
+    """
+    parse_archived_page -- This function decompresses and parses one archived
+    page without touching the network or any storage so it can run inside of
+    a worker process.
+
+    Arguments:
+        page -- A tuple given by read_archive holding the kind, url and member
+        name of the page along with its compressed content
+
+    Returns:
+        A tuple containing the kind and url of the page along with the anime
+        links of a season page, the fields of an anime page or the character
+        and staff dictionaries of a /characters page.
+    """
+    kind, url, member_name, data = page
+    content = decompress_page(data, member_name)
+    if kind == 'season' :
+        return (kind, url, parse_season_anime_links(content))
+    if kind == 'characters' :
+        return (kind, url, parse_anime_character_staff_section(url.removesuffix('/characters'), content))
+    anime_fields = {'url' : url}
+    parse_anime_page(anime_fields, content)
+    anime_fields.pop('url')
+    return (kind, url, anime_fields)
+
+def parse_archived_pages(pool : Any, pages : Iterable[tuple[str, str, str, bytes]]) -> Iterator[tuple[str, str, Any]] :
+    """
+    parse_archived_pages -- This function parses archived pages with the worker
+    processes or in this process when there is no pool.
+
+    Arguments:
+        pool -- The pool of worker processes or NoneType Object
+        pages -- Iterable of the pages read out of the archive
+
+    Returns:
+        Iterator of whatever parse_archived_page gives back for each page.
+    """
+    if pool is None :
+        return map(parse_archived_page, pages)
+    return pool.imap_unordered(parse_archived_page, pages, replay_chunksize)
+
+def fill_replayed_anime(anime_url : str,
+                        anime_fields : dict,
+                        character_staff : tuple[dict, dict] | None,
+                        to_mongodb : bool,
+                        thread_info_enabled : bool) -> bool :
+    """
+    fill_replayed_anime -- This function fills the stored entry of an anime
+    with the fields parsed out of its archived pages the same way
+    get_anime_entry fills it with freshly fetched pages.
+
+    Arguments:
+        anime_url -- The url that is connected to the anime entry
+        anime_fields -- The fields parsed out of the anime page
+        character_staff -- The character and staff dictionaries parsed out of
+        the /characters page or NoneType Object if it wasn't archived
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        Status as a boolean;
+    """
+    # start from the stub made by the season page (or from nothing if no season listed it)
+    anime_id = get_anime_id(anime_url)
+    anime_entry = reset_anime_entry(load_anime_entry(anime_id, to_mongodb, thread_info_enabled))
+    if anime_entry == {} :
+        anime_entry = {'_id' : anime_id, 'url' : anime_url}
+    return fill_anime_entry(anime_entry, anime_fields, character_staff, to_mongodb, thread_info_enabled)
+
+def run_replay(archive_dir : str,
+               to_mongodb : bool,
+               thread_info_enabled : bool,
+               processes : int | None = None) -> int :
+    """
+    run_replay -- This function parses every page of a raw page archive again
+    without touching the network. Pages are parsed by a pool of worker
+    processes while the parent stores what they give back. Seasons are
+    replayed first so every anime has its stub before it is filled.
+
+    Arguments:
+        archive_dir -- Directory the shards were written to
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        processes -- Number of worker processes; 0 parses in this process
+        (like when profiling) ( default : None, one per cpu )
+
+    Returns:
+        Number of season and anime entries stored.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running run_replay')
+
+    stored = 0
+    with Pool(processes, initializer=set_parser_backend, initargs=(get_parser_backend(),)) if processes != 0 else nullcontext() as pool :
+        # replay the season pages
+        season_pages = (page for page in read_archive(archive_dir, thread_info_enabled) if page[0] == 'season')
+        for _, season_url, anime_links in parse_archived_pages(pool, season_pages) :
+            season_name = season_url_to_name(season_url)
+            season_entry = build_season_entry(season_name, season_url, anime_links, thread_info_enabled, to_mongodb)
+            store_season_entry(season_entry, season_name, thread_info_enabled, to_mongodb)
+            stored += 1
+
+        # replay the anime pages once both the main and /characters page are parsed
+        pending : dict = {}
+        anime_pages = (page for page in read_archive(archive_dir, thread_info_enabled) if page[0] != 'season')
+        for kind, url, parsed in parse_archived_pages(pool, anime_pages) :
+            anime_url = url.removesuffix('/characters')
+            parts = pending.setdefault(anime_url, {})
+            parts[kind] = parsed
+            if 'anime' in parts and 'characters' in parts :
+                pending.pop(anime_url)
+                stored += fill_replayed_anime(anime_url, parts['anime'], parts['characters'], to_mongodb, thread_info_enabled)
+
+        # anime whose /characters page never got archived are filled without it
+        for anime_url, parts in pending.items() :
+            if 'anime' in parts :
+                stored += fill_replayed_anime(anime_url, parts['anime'], None, to_mongodb, thread_info_enabled)
+
+    flush_bulk_writes(thread_info_enabled)
+    return stored
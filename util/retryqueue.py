@@ -0,0 +1,142 @@
+# imports
+
+from heapq import heappop, heappush
+from json import dumps
+from threading import Lock
+from time import monotonic
+from typing import Callable
+from util.datenow import get_datetime_now
+from util.jsonformat import json_indent_len
+from util.logqueue import logger
+from util.metrics import inc_counter
+
+# global var
+
+dead_letters = []                                                    # urls that ran out of attempts this run
+retry_attempts = {}                                                  # number of retries scheduled for each url
+retry_heap = []                                                      # retries ordered by the time they are due
+retry_sequence = 0                                                   # tie breaker keeping the heap first in first out
+
+# static var
+
+dead_letter_file = 'dead_letters.json'                               # file holding the dead letters of the last run that had any
+retry_lock = Lock()                                                  # lock used for every retry queue global
+retry_max_attempts = 3                                               # retries allowed per url before it is dropped
+
+# functions
+
+def schedule_retry(url : str,
+                   retry_func : Callable,
+                   delay : float,
+                   thread_info_enabled : bool,
+                   args : list = [],
+                   kwargs : dict = {}) -> bool :
+    """
+    schedule_retry -- This function puts a failed call back into the retry queue
+    to be ran again once the delay has passed. Urls that have already been
+    retried too many times are moved to the dead letters instead.
+
+    Arguments:
+        url -- The url that could not be fetched
+        retry_func -- The function to call again
+        delay -- Seconds to wait before the call is ran again
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        args -- The function's arguments ( default : [] )
+        kwargs -- The function's keyword arguments ( default : {} )
+
+    Returns:
+        True if the call was queued, False if it was moved to the dead letters.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug('is running schedule_retry')
+
+    global retry_sequence
+    with retry_lock :
+        attempts = retry_attempts.get(url, 0) + 1
+        retry_attempts[url] = attempts
+
+        # give up on the url once it used every attempt
+        if attempts > retry_max_attempts :
+            inc_counter('dead_letters_total')
+            dead_letters.append({
+                'url' : url,
+                'function' : retry_func.__name__,
+                'attempts' : attempts - 1,
+                'datetime_failed' : get_datetime_now(),
+            })
+            return False
+
+        # queue the call for later
+        inc_counter('retries_scheduled_total')
+        retry_sequence += 1
+        heappush(retry_heap, (monotonic() + delay, retry_sequence, retry_func, args, kwargs))
+        return True
+
+def pop_retry(due_only : bool = False) -> tuple[float, Callable, list, dict] | None :
+    """
+    pop_retry -- This function takes the retry that is due first off the queue.
+
+    Keyword Arguments:
+        due_only -- Leave the retry on the queue if it isn't due yet
+        ( default : False )
+
+    Returns:
+        A tuple containing the monotonic time the retry is due, the function,
+        its arguments and its keyword arguments or NoneType Object when the
+        queue is empty (or nothing is due yet with due_only).
+    """
+    with retry_lock :
+        if len(retry_heap) < 1 :
+            return None
+        if due_only and retry_heap[0][0] > monotonic() :
+            return None
+        due, _, retry_func, args, kwargs = heappop(retry_heap)
+        return (due, retry_func, args, kwargs)
+
+def next_retry_due() -> float | None :
+    """
+    next_retry_due -- This function grabs the time the first retry is due
+    without taking it off the queue.
+
+    Returns:
+        The monotonic time the first retry is due or NoneType Object when the
+        queue is empty.
+    """
+    with retry_lock :
+        if len(retry_heap) < 1 :
+            return None
+        return retry_heap[0][0]
+
+def count_retries() -> int :
+    """
+    count_retries -- This function counts every retry scheduled this run
+    including the ones that ended up in the dead letters.
+
+    Returns:
+        Number of retries scheduled.
+    """
+    with retry_lock :
+        return sum(retry_attempts.values())
+
+def dump_dead_letters(data_path : str) -> int :
+    """
+    dump_dead_letters -- This function writes every url that ran out of retries
+    to disk so it can be looked at once the run is over. Nothing is written
+    when there are none so the dead letters of an earlier run are kept.
+
+    Arguments:
+        data_path -- The data directory the dead_letter_file is written to
+
+    Returns:
+        Number of dead letters written.
+    """
+    with retry_lock :
+        if len(dead_letters) < 1 :
+            return 0
+        with open(data_path + dead_letter_file, 'w') as file :
+            file.write(dumps(dead_letters, indent=json_indent_len))
+        return len(dead_letters)
@@ -0,0 +1,131 @@
+# imports
+
+from collections import deque
+from concurrent.futures import Executor, Future, FIRST_COMPLETED, wait
+from time import monotonic, sleep
+from typing import Any, Callable, Iterable
+from util.logqueue import logger
+from util.metrics import set_gauge
+from util.retryqueue import next_retry_due, pop_retry
+
+# static var
+
+scheduler_window = 64                                                # default number of calls in flight at once
+
+# functions
+
+def collect_done(done : set[Future], thread_info_enabled : bool) -> int :
+    """
+    collect_done -- This function goes through finished calls and prints the
+    exception of every call that raised one.
+
+    Arguments:
+        done -- Set of finished futures
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Returns:
+        Number of calls that raised an exception.
+    """
+    failed = 0
+    for future in done :
+        if future.exception() is not None :
+            logger.warning(f'Exception in scheduled call : {future.exception()}')
+            failed += 1
+    return failed
+
+def run_bounded(executor : Executor,
+                func : Callable,
+                work : Iterable[tuple],
+                thread_info_enabled : bool,
+                window : int = scheduler_window,
+                follow_func : Callable | None = None,
+                follow_up : Callable[[Any], Iterable[tuple]] | None = None) -> tuple[int, int] :
+    """
+    run_bounded -- This function streams calls into an executor while never
+    holding more than the window in flight. Work is only pulled from the
+    iterable once a slot frees up so memory stays flat however long it is.
+    Retries are submitted as soon as they are due and take a slot ahead of new
+    work. It returns once the work is exhausted and the retry queue is empty.
+
+    When a follow up is given, whatever a call of func gives back is turned
+    into calls of follow_func the moment it finishes (like the anime of a
+    season). Those calls take a slot ahead of new work so they never pile up
+    and the pool is never idle waiting on the slowest call of func.
+
+    Arguments:
+        executor -- The executor the calls are submitted to
+        func -- The function to call
+        work -- Iterable of tuples holding the arguments of each call
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+
+    Keyword Arguments:
+        window -- Max number of calls in flight ( default : scheduler_window )
+        follow_func -- The function called for each follow up ( default : None )
+        follow_up -- Function turning what func gave back into an iterable of
+        tuples holding the arguments of each follow_func call; NoneType Object
+        results are skipped ( default : None )
+
+    Returns:
+        A tuple containing the number of calls submitted (retries and follow
+        ups included) and the number of calls that raised an exception.
+    """
+    # give a heads up in the console that this has been called
+    if thread_info_enabled :
+        logger.debug(f'is running run_bounded ({func.__name__})')
+
+    work = iter(work)
+    exhausted = False
+    follow_ups : deque = deque()
+    in_flight : set[Future] = set()
+    leads : set[Future] = set()
+    submitted = 0
+    failed = 0
+    while True :
+        # fill the window with due retries first, then follow ups, then new work
+        while len(in_flight) < window :
+            retry = pop_retry(due_only=True)
+            if retry is not None :
+                _, retry_func, args, kwargs = retry
+                future = executor.submit(retry_func, *args, **kwargs)
+                if retry_func is func :
+                    leads.add(future)
+            elif len(follow_ups) > 0 :
+                args = next(follow_ups[0], None)
+                if args is None :
+                    follow_ups.popleft()
+                    continue
+                future = executor.submit(follow_func, *args)
+            elif not exhausted :
+                args = next(work, None)
+                if args is None :
+                    exhausted = True
+                    continue
+                future = executor.submit(func, *args)
+                leads.add(future)
+            else :
+                break
+            in_flight.add(future)
+            submitted += 1
+
+        # wake up when a call finishes or the next retry is due
+        set_gauge('scheduler_in_flight', len(in_flight))
+        due = next_retry_due()
+        if len(in_flight) < 1 and due is None :
+            break
+        timeout = None if due is None else max(0.0, due - monotonic())
+        if len(in_flight) < 1 :
+            sleep(timeout)
+            continue
+        done, in_flight = wait(in_flight, timeout=timeout, return_when=FIRST_COMPLETED)
+        set_gauge('scheduler_in_flight', len(in_flight))
+        failed += collect_done(done, thread_info_enabled)
+
+        # queue the follow ups of every call of func that finished
+        for future in done & leads :
+            leads.discard(future)
+            if follow_up is not None and future.exception() is None and future.result() is not None :
+                follow_ups.append(iter(follow_up(future.result())))
+
+    return (submitted, failed)
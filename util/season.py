@@ -1,24 +1,49 @@
 # imports
 
-from bs4 import BeautifulSoup
-from json import dumps, load
+from bs4 import BeautifulSoup, SoupStrainer
+from datetime import datetime
 from os import path
-from threading import Lock, get_ident
+from typing import Any, Iterator
 from util.anime import init_anime_entry
-from util.datenow import get_datetime_now
-from util.jsonformat import json_indent_len
-from util.mongodb import get_anime_id, get_season_id, mongodb_season_collection, mongodb_database_name, insert_doc_into_mongo, grab_doc_from_mongo
+from util.datenow import get_datetime_now, is_stale
+from util.dedup import anime_id_claimed, claim_anime_id
+from util.diskstore import read_json, write_json
+from util.logqueue import logger
+from util.metrics import track_stage
+from util.mongodb import get_anime_id, get_season_id, mal_season_names, mongodb_season_collection, mongodb_database_name, queue_replace_in_mongo, flush_bulk_writes, grab_doc_from_mongo
 from util.mount import *
+from util.parser import make_soup, uses_css_backend
+from util.pipeline import pipeline_enabled, submit_parse
+from util.segmentstore import get_segment_store, uses_segment_store
+
+# global var
+
+archive_url = "https://myanimelist.net/anime/season/archive"         # MAL link for the seasonal anime archive page
 
 # static var
 
 archive_file = 'archeive_list.csv'                                   # file to hold all season titles
-archive_url = "https://myanimelist.net/anime/season/archive"         # MAL link for the seasonal anime archive page
+archive_path = '/anime/season/archive'                               # path of the archive page on the site
 season_dir = "season_data/"                                          # seasonal data directory path relative to util folder
-season_dir_lock = Lock()                                             # lock preventing two files from RW action to a season file at the same time
+season_page_strainer = SoupStrainer(['div', 'a'], class_=[           # parts of a season page that get_season_anime_links reads
+    'seasonal-anime-list js-seasonal-anime-list js-seasonal-anime-list-key-1',
+    'link-title',
+])                                                                   #
 
 # functions
 
+def set_base_url(base_url : str) -> None :
+    """
+    set_base_url -- This function points the crawl at another host serving the
+    same pages as MAL (like a local stand-in server). Only the archive page is
+    fetched from it directly, every other url is read out of the pages.
+
+    Arguments:
+        base_url -- Scheme and host of the site (like https://myanimelist.net)
+    """
+    global archive_url
+    archive_url = base_url.rstrip('/') + archive_path
+
 def make_archive_list_to_csv(skip_if_exists : bool,
                              thread_info_enabled : bool,
                              archive_list_path : str = season_dir) -> int :
@@ -46,7 +71,7 @@ def make_archive_list_to_csv(skip_if_exists : bool,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running make_archive_list_to_csv')
+        logger.debug('is running make_archive_list_to_csv')
 
     # checks to see if it is already made
     if skip_if_exists and path.exists(archive_list_path + archive_file):
@@ -86,6 +111,27 @@ def make_archive_list_to_csv(skip_if_exists : bool,
 
     return  seasons_grabbed
 
+def read_archive_list(season_ids : list[int] | None = None,
+                      archive_list_path : str = season_dir) -> Iterator[tuple[str, str]] :
+    """
+    read_archive_list : This function reads the CSV made by
+    make_archive_list_to_csv one line at a time.
+
+    Keyword Arguments:
+        season_ids -- Only hand out the seasons with these ids ( default : None,
+        every season )
+        archive_list_path -- This defines the destinnation the resultants are
+        stored at ( default: season_dir )
+
+    Yields:
+        A tuple containing the name and url of a season.
+    """
+    with open(archive_list_path + archive_file, 'r') as file :
+        for line in file :
+            season_name, season_url = line.strip().split(', ')[:2]
+            if season_ids is None or get_season_id(season_url) in season_ids :
+                yield (season_name, season_url)
+
 def season_name_to_file_name(season_name : str) -> str : 
     """
     season_name_to_file_name : This function that makes the file name more
@@ -99,6 +145,39 @@ def season_name_to_file_name(season_name : str) -> str :
     """
     return season_name.lower().replace(' ', '_') + ".json"
 
+def season_url_to_name(season_url : str) -> str :
+    """
+    season_url_to_name : This function makes the name of a season the way the
+    archive page lists it (like Fall 2023) out of its url.
+
+    Arguments:
+        season_url -- URL linking to the season in MyAnimeList.net
+
+    Returns:
+        Name of the season.
+    """
+    season_id = get_season_id(season_url)
+    return f'{mal_season_names[season_id % 10 - 1].capitalize()} {season_id // 10}'
+
+def get_recent_season_ids(now : datetime | None = None) -> list[int] :
+    """
+    get_recent_season_ids -- This function makes the ids of the season airing
+    now and the one before it. These are the only seasons whose lists still
+    change so an incremental run can skip the rest of the archive.
+
+    Keyword Arguments:
+        now -- The moment the seasons are picked for ( default : None, the
+        current time )
+
+    Returns:
+        List holding the id of the current season and the previous season.
+    """
+    if now is None :
+        now = datetime.now()
+    current = now.year * 10 + (now.month - 1) // 3 + 1
+    previous = current - 1 if current % 10 > 1 else (now.year - 1) * 10 + 4
+    return [current, previous]
+
 def get_season_entry(season_name : str,
                      season_url : str,
                      thread_info_enabled : bool,
@@ -126,26 +205,17 @@ def get_season_entry(season_name : str,
     """
     # give a heads up in the console that this has been called
     if thread_info_enabled :
-        print(f'thread {get_ident():5} is running get_season_entry')
+        logger.debug('is running get_season_entry')
 
     # grab document from disk or mongodb :
-    season_entry : dict = {}
-    if to_mongodb :
-        season_entry = grab_doc_from_mongo({'url' : season_url},
-                                            mongodb_database_name,
-                                            mongodb_season_collection,
-                                            thread_info_enabled)
-    else :
-        with season_dir_lock :
-            with open(season_data_path + season_name_to_file_name(season_name), 'r') as file :
-                season_entry = load(file)
-
-    # make sure the entry is not of NoneTime
-    if season_entry == None :
-        season_entry = {}
-
-    # grab data if it exists
-    if season_entry.get('datetime_filled', None) == None :
+    season_entry = load_season_entry(season_name,
+                                     season_url,
+                                     thread_info_enabled,
+                                     to_mongodb,
+                                     season_data_path=season_data_path)
+
+    # grab data if it doesn't exist (or was filled too long ago)
+    if is_stale(season_entry) :
         # establish connection with MAL
         content, retried, ret = init_session(season_url, 
                                               get_season_entry, 
@@ -164,77 +234,307 @@ def get_season_entry(season_name : str,
         if retried :
             return ret
 
-        # parse the content with BeautifulSoup
-        soup = BeautifulSoup(content, 'html.parser')
+        # hand the page to the parse stage which builds and stores the entry once parsed
+        # (waited on since the anime of the season are scheduled off of the returned entry)
+        if pipeline_enabled() :
+            return submit_parse(parse_season_anime_links,
+                                [content],
+                                lambda anime_links : store_parsed_season(anime_links,
+                                                                         season_name,
+                                                                         season_url,
+                                                                         thread_info_enabled,
+                                                                         to_mongodb,
+                                                                         season_data_path)).result()
+
+        # parse the page and initialize the anime found on it
+        season_entry = parse_season_page(season_name,
+                                         season_url,
+                                         content,
+                                         thread_info_enabled,
+                                         to_mongodb)
+
+        # write out the json as the season_name
+        store_season_entry(season_entry,
+                           season_name,
+                           thread_info_enabled,
+                           to_mongodb,
+                           season_data_path=season_data_path)
+
+    # return the season_entry
+    return season_entry
+
+def store_parsed_season(anime_links : list[tuple[str, str]],
+                        season_name : str,
+                        season_url : str,
+                        thread_info_enabled : bool,
+                        to_mongodb : bool,
+                        season_data_path : str = season_dir) -> dict :
+    """
+    store_parsed_season : This function builds the season entry out of the
+    anime links parsed by the parse stage and stores it.
 
-        # gets rid of tv continued page (potential redundent data)
-        for div in soup.find_all("div", class_='seasonal-anime-list js-seasonal-anime-list js-seasonal-anime-list-key-1') :
-            if "TV (Continuing)" in div.text :
-                div.decompose()
-        soup.prettify()
+    Arguments:
+        anime_links -- List of tuples holding the name and url of each anime
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
 
-        # find all sections
-        soup = soup.find_all('a', class_='link-title')
+    Keyword Arguments:
+        season_data_path -- This defines the destination the resultants are
+        stored at ( default: season_dir )
+
+    Returns:
+        The filled dictionary object of the season.
+    """
+    season_entry = build_season_entry(season_name,
+                                      season_url,
+                                      anime_links,
+                                      thread_info_enabled,
+                                      to_mongodb)
+    store_season_entry(season_entry,
+                       season_name,
+                       thread_info_enabled,
+                       to_mongodb,
+                       season_data_path=season_data_path)
+    return season_entry
+
+def load_season_entry(season_name : str,
+                      season_url : str,
+                      thread_info_enabled : bool,
+                      to_mongodb : bool,
+                      season_data_path : str = season_dir) -> dict :
+    """
+    load_season_entry : This function grabs the stored document of a season from
+    disk or mongodb.
+
+    Arguments:
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Keyword Arguments:
+        season_data_path -- This defines the destination the resultants are
+        stored at ( default: season_dir )
 
-        # initialize the season_entry
-        season_entry = {
-            '_id' : get_season_id(),
+    Returns:
+        The dictionary object of the season; empty if none was stored yet.
+    """
+    # grab document from disk or mongodb :
+    season_entry : dict = {}
+    if to_mongodb :
+        season_entry = grab_doc_from_mongo({'_id' : get_season_id(season_url)},
+                                            mongodb_database_name,
+                                            mongodb_season_collection,
+                                            thread_info_enabled)
+    elif uses_segment_store() :
+        season_entry = get_segment_store(season_data_path).read(get_season_id(season_url))
+    else :
+        season_entry = read_json(season_data_path + season_name_to_file_name(season_name))
+
+    # make sure the entry is not of NoneTime
+    if season_entry == None :
+        season_entry = {}
+    return season_entry
+
+def parse_season_page(season_name : str,
+                      season_url : str,
+                      content : bytes,
+                      thread_info_enabled : bool,
+                      to_mongodb : bool) -> dict :
+    """
+    parse_season_page : This function parses the content of a season page into
+    a season entry and initializes a document for every anime listed on it.
+
+    Arguments:
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+        content -- The content of the season page
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Returns:
+        The filled dictionary object of the season.
+    """
+    with track_stage('parse') :
+        anime_links = parse_season_anime_links(content)
+    return build_season_entry(season_name,
+                              season_url,
+                              anime_links,
+                              thread_info_enabled,
+                              to_mongodb)
+
+def build_season_entry(season_name : str,
+                       season_url : str,
+                       anime_links : list[tuple[str, str]],
+                       thread_info_enabled : bool,
+                       to_mongodb : bool) -> dict :
+    """
+    build_season_entry : This function makes a season entry out of the anime
+    links found on a season page and initializes a document for every anime.
+
+    Arguments:
+        season_name -- Name of the season
+        season_url -- URL linking to the season in MyAnimeList.net
+        anime_links -- List of tuples holding the name and url of each anime
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Returns:
+        The filled dictionary object of the season.
+    """
+    # initialize the season_entry
+    season_entry = {
+        '_id' : get_season_id(season_url),
+        'season' : season_name.split(' ')[0].lower(),
+        'year' : int(season_name.split(' ')[1]),
+        'url' : season_url,
+        'datetime_entered' : get_datetime_now(),
+        'datetime_filled' : None,
+        'total_anime_entries' : 0,
+        'seasonal_anime' : [],
+    }
+
+    # fill in basic anime entry information (not actually populating with data)
+    listed_ids = set()
+    for anime_name, anime_url in anime_links :
+        # skip anime listed twice on the same page
+        anime_id = get_anime_id(anime_url)
+        if anime_id in listed_ids :
+            continue
+        listed_ids.add(anime_id)
+
+        # place the information into a dictionary
+        anime_entry = {
+            '_id' : anime_id,
+            'name' : anime_name,
+            'url' : anime_url,
             'season' : season_name.split(' ')[0].lower(),
             'year' : int(season_name.split(' ')[1]),
-            'url' : season_url,
             'datetime_entered' : get_datetime_now(),
-            'datetime_filled' : None,
-            'total_anime_entries' : 0,
-            'seasonal_anime' : [],
+            'datetime_filled' : None
         }
 
-        # fill in basic anime entry information (not actually populating with data)
-        for a in soup:
-            # grab basic series information
-            anime_name = str(a.text).strip()
-            anime_url = str(a.get('href')).strip()
-
-            # place the information into a dictionary
-            anime_entry = {
-                '_id' : get_anime_id(),
-                'name' : anime_name,
-                'url' : anime_url,
-                'season' : season_name.split(' ')[0].lower(),
-                'year' : int(season_name.split(' ')[1]),
-                'datetime_entered' : get_datetime_now(),
-                'datetime_filled' : None
-            }
-
-            # initialize document
+        # initialize document (only once per run for anime listed by several seasons; the id is
+        # claimed after the write so no season skips a stub another season hasn't written yet)
+        if not anime_id_claimed(anime_id, 'stub') :
             init_anime_entry(anime_entry,
                              thread_info_enabled,
                              to_mongodb)
+            claim_anime_id(anime_id, 'stub')
 
-            # get rid of the redundant information for the season entry
-            anime_entry.pop('url')
-            anime_entry.pop('season')
-            anime_entry.pop('year')
-            anime_entry.pop('datetime_entered')
-            anime_entry.pop('datetime_filled')
+        # get rid of the redundant information for the season entry
+        anime_entry.pop('url')
+        anime_entry.pop('season')
+        anime_entry.pop('year')
+        anime_entry.pop('datetime_entered')
+        anime_entry.pop('datetime_filled')
 
-            # append it to the seasonal_anime tab
-            season_entry["seasonal_anime"].append(anime_entry)
+        # append it to the seasonal_anime tab
+        season_entry["seasonal_anime"].append(anime_entry)
 
-        # check to see if there are anime series present in series
-        season_entry['total_anime_entries'] = len(season_entry['seasonal_anime'])
-        season_entry['datetime_filled'] = get_datetime_now()
+    # check to see if there are anime series present in series
+    season_entry['total_anime_entries'] = len(season_entry['seasonal_anime'])
+    season_entry['datetime_filled'] = get_datetime_now()
+    return season_entry
 
-        # write out the json as the season_name
-        if to_mongodb :
-            insert_doc_into_mongo(season_entry,
-                                    mongodb_database_name,
-                                    mongodb_season_collection,
-                                    thread_info_enabled)
-        else :
-            # write to disk
-            with season_dir_lock :
-                with open(season_data_path + season_name_to_file_name(season_name), 'w') as file :
-                    file.write(dumps(season_entry, indent=json_indent_len))
+def parse_season_anime_links(content : bytes) -> list[tuple[str, str]] :
+    """
+    parse_season_anime_links : This function parses the content of a season page
+    with the parser backend in use and grabs the anime listed on it.
 
-    # return the season_entry
-    return season_entry
+    Arguments:
+        content -- The content of the season page
+
+    Returns:
+        List of tuples holding the name and url of each anime.
+    """
+    soup = make_soup(content, parse_only=season_page_strainer)
+    if uses_css_backend() :
+        return get_season_anime_links_css(soup)
+    return get_season_anime_links(soup)
+
+def get_season_anime_links(soup : BeautifulSoup) -> list[tuple[str, str]] :
+    """
+    get_season_anime_links : This function grabs the name and url of every anime
+    listed on a season page leaving out the TV (Continuing) section.
+
+    Arguments:
+        soup -- The BeautifulSoup tree of the season page
+
+    Returns:
+        List of tuples holding the name and url of each anime.
+    """
+    # gets rid of tv continued page (potential redundent data)
+    for div in soup.find_all("div", class_='seasonal-anime-list js-seasonal-anime-list js-seasonal-anime-list-key-1') :
+        if "TV (Continuing)" in div.text :
+            div.decompose()
+
+    # find all sections
+    return [(str(a.text).strip(), str(a.get('href')).strip()) for a in soup.find_all('a', class_='link-title')]
+
+def get_season_anime_links_css(tree : Any) -> list[tuple[str, str]] :
+    """
+    get_season_anime_links_css : This function is the css selector version of
+    get_season_anime_links used by the selectolax backend.
+
+    Arguments:
+        tree -- The lexbor tree of the season page
+
+    Returns:
+        List of tuples holding the name and url of each anime.
+    """
+    # gets rid of tv continued page (potential redundent data)
+    for div in tree.css('div[class="seasonal-anime-list js-seasonal-anime-list js-seasonal-anime-list-key-1"]') :
+        if "TV (Continuing)" in div.text() :
+            div.decompose()
+
+    # find all sections
+    return [(a.text().strip(), str(a.attributes.get('href')).strip()) for a in tree.css('a.link-title')]
+
+def store_season_entry(season_entry : dict,
+                       season_name : str,
+                       thread_info_enabled : bool,
+                       to_mongodb : bool,
+                       season_data_path : str = season_dir) -> None :
+    """
+    store_season_entry : This function writes a filled season entry to disk or
+    mongodb. In mongodb the season is written in the same bulk write as the
+    anime documents initialized while parsing it so they can be read as soon
+    as this returns.
+
+    Arguments:
+        season_entry -- The filled dictionary object of the season
+        season_name -- Name of the season
+        thread_info_enabled -- When threads are implimented this will allow a
+        print statement for debugging
+        to_mongodb -- When enabled it establishes connection to mongodb for
+        storage
+
+    Keyword Arguments:
+        season_data_path -- This defines the destination the resultants are
+        stored at ( default: season_dir )
+    """
+    # write out the json as the season_name (replacing the season if it was stored before)
+    if to_mongodb :
+        queue_replace_in_mongo({'_id' : season_entry['_id']},
+                               season_entry,
+                               mongodb_database_name,
+                               mongodb_season_collection,
+                               thread_info_enabled)
+        flush_bulk_writes(thread_info_enabled)
+    elif uses_segment_store() :
+        # append to the current segment
+        get_segment_store(season_data_path).append(season_entry['_id'], season_entry)
+    else :
+        # write to disk
+        write_json(season_data_path + season_name_to_file_name(season_name), season_entry, season_entry['_id'])
\ No newline at end of file
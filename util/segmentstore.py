@@ -0,0 +1,390 @@
+# imports
+
+import gzip
+from json import dumps, load, loads
+from os import O_RDONLY, close, listdir, open as open_fd, path, pread, replace, truncate
+from threading import Lock
+from typing import Iterator
+from util.metrics import track_stage
+
+try :
+    import zstandard
+except ImportError :
+    zstandard = None
+
+# global var
+
+segment_compression = 'none'                                         # compression applied to every record
+segment_store_enabled = False                                        # documents go to segments instead of one file each
+segment_stores = {}                                                  # open store of each data directory
+
+# static var
+
+segment_compressions = ['none', 'gzip', 'zstd']                      # every compression that can be selected
+segment_extensions = {                                               # file extension of each compression
+    'none' : '.jsonl',                                               #
+    'gzip' : '.jsonl.gz',                                            #
+    'zstd' : '.jsonl.zst',                                           #
+}                                                                    #
+segment_index_file = 'segments.index'                                # file holding the offset index of a store
+segment_max_bytes = 64 * 1024 * 1024                                 # size a segment is rotated at
+segment_scan_chunk = 64 * 1024                                       # bytes fed at a time while rebuilding an index
+segment_stores_lock = Lock()                                         # lock used for the open stores
+
+# classes
+
+class SegmentStore :
+    """
+    SegmentStore -- Append only store keeping the documents of one data
+    directory in rotating JSON Lines segments. Every write appends the whole
+    document (compressed on its own when compression is on so each record can
+    be read by offset) and an index of id -> (segment, offset, length) points
+    at the latest copy. Segments read from start to end are a plain JSONL
+    (or gzip / zstd) export of every version written.
+    """
+    def __init__(self, data_path : str) -> None :
+        """
+        __init__ -- This function opens the store of a data directory and
+        loads its index.
+
+        Arguments:
+            data_path -- The data directory holding the segments
+        """
+        self.data_path = data_path
+        self.lock = Lock()
+        self.index : dict[int, tuple[int, int, int]] = {}
+        self.read_fds : dict[int, int] = {}
+        self.segment = None
+        self.segment_end = 0
+        self.segment_number = 0
+        self.load_index()
+
+    def segment_path(self, segment_number : int) -> str :
+        """
+        segment_path -- This function makes the path of a segment.
+
+        Arguments:
+            segment_number -- The number of the segment
+
+        Returns:
+            The path of the segment with the extension of the compression in
+            use.
+        """
+        return f'{self.data_path}segment-{segment_number:05}{segment_extensions[segment_compression]}'
+
+    def list_segments(self) -> list[int] :
+        """
+        list_segments -- This function finds every segment of the data
+        directory written with the compression in use.
+
+        Returns:
+            Sorted list of the segment numbers.
+        """
+        numbers = []
+        for file_name in listdir(self.data_path) :
+            if file_name.startswith('segment-') and file_name.endswith(segment_extensions[segment_compression]) :
+                numbers.append(int(file_name[len('segment-'):].split('.')[0]))
+        return sorted(numbers)
+
+    def load_index(self) -> None :
+        """
+        load_index -- This function loads the saved index when the segments it
+        covers are untouched (the last one may only have grown since records
+        are appended) and only reads the segments that changed after it was
+        saved. The index is saved on every rotation so that is at most a
+        segment or two after a crash. Otherwise the index is rebuilt by reading
+        every segment. The end of the last whole record of the newest segment
+        is kept so a record left half written by a crash can be cut off before
+        anything is appended.
+        """
+        # use the saved index if the segments it covers are still the size they were saved at
+        segments = {number : path.getsize(self.segment_path(number)) for number in self.list_segments()}
+        scanned = list(segments)
+        if path.exists(self.data_path + segment_index_file) :
+            with open(self.data_path + segment_index_file, 'r') as file :
+                saved = load(file)
+            saved_segments = {int(number) : size for number, size in saved['segments'].items()}
+            last = max(saved_segments, default=-1)
+            if all(segments.get(number, -1) == size or (number == last and segments.get(number, -1) > size)
+                   for number, size in saved_segments.items()) :
+                self.index = {int(key) : tuple(entry) for key, entry in saved['index'].items()}
+                scanned = [number for number in segments if segments[number] != saved_segments.get(number, None)]
+
+        # read the rest of the segments (later copies win)
+        self.segment_number = max(segments, default=0)
+        self.segment_end = segments.get(self.segment_number, 0)
+        for number in scanned :
+            end = 0
+            for offset, length, record in self.read_segment(number) :
+                self.index[record['_id']] = (number, offset, length)
+                end = offset + length
+            if number == self.segment_number :
+                self.segment_end = end
+
+    def save_index(self) -> None :
+        """
+        save_index -- This function writes the index along with the size of
+        every segment it covers (to a temporary file swapped in so a crash
+        never leaves half of one). It should only be called while holding the
+        lock of the store.
+        """
+        segments = {number : path.getsize(self.segment_path(number)) for number in self.list_segments()}
+        with open(self.data_path + segment_index_file + '.tmp', 'w') as file :
+            file.write(dumps({'segments' : segments, 'index' : self.index}, separators=(',', ':')))
+        replace(self.data_path + segment_index_file + '.tmp', self.data_path + segment_index_file)
+
+    def read_segment(self, segment_number : int) -> Iterator[tuple[int, int, dict]] :
+        """
+        read_segment -- This function reads every record of a segment from
+        start to end. A record cut short by a crash ends the segment (a line
+        that isn't valid JSON is skipped since the next line starts a new
+        record).
+
+        Arguments:
+            segment_number -- The number of the segment
+
+        Yields:
+            Tuples containing the offset and length of a record along with the
+            document it holds.
+        """
+        with open(self.segment_path(segment_number), 'rb') as file :
+            data = file.read()
+        if segment_compression == 'none' :
+            offset = 0
+            for line in data.splitlines(keepends=True) :
+                if line.endswith(b'\n') :
+                    try :
+                        record = loads(line)
+                    except ValueError :
+                        record = None
+                    if record is not None :
+                        yield (offset, len(line), record)
+                offset += len(line)
+            return
+
+        # compressed records are read one member / frame at a time
+        offset = 0
+        while offset < len(data) :
+            length = compressed_record_length(data, offset)
+            if length is None :
+                break
+            yield (offset, length, loads(decompress_record(data[offset:offset + length])))
+            offset += length
+
+    def read(self, key : int) -> dict | None :
+        """
+        read -- This function reads the latest copy of a document by its
+        offset.
+
+        Arguments:
+            key -- The id of the document
+
+        Returns:
+            The document or NoneType Object if it was never written.
+        """
+        with track_stage('disk_read') :
+            with self.lock :
+                entry = self.index.get(key, None)
+                if entry is None :
+                    return None
+                segment_number, offset, length = entry
+                if segment_number not in self.read_fds :
+                    self.read_fds[segment_number] = open_fd(self.segment_path(segment_number), O_RDONLY)
+                fd = self.read_fds[segment_number]
+            return loads(decompress_record(pread(fd, length, offset)))
+
+    def append(self, key : int, document : dict, only_if_missing : bool = False) -> bool :
+        """
+        append -- This function appends a document to the current segment and
+        points the index at it. The segment is rotated once it is full.
+
+        Arguments:
+            key -- The id of the document
+            document -- The document to write
+
+        Keyword Arguments:
+            only_if_missing -- When enabled nothing is written if the id is
+            already in the index ( default : False )
+
+        Returns:
+            True if the document was written.
+        """
+        with track_stage('disk_write') :
+            record = compress_record((dumps(document, separators=(',', ':')) + '\n').encode())
+            with self.lock :
+                if only_if_missing and key in self.index :
+                    return False
+
+                # rotate once the segment is full (saving the index so a crash only rescans the new segment)
+                if self.segment is None or self.segment.tell() >= segment_max_bytes :
+                    if self.segment is not None :
+                        self.segment.close()
+                        self.save_index()
+                        self.segment_number += 1
+                    elif path.exists(self.segment_path(self.segment_number)) and path.getsize(self.segment_path(self.segment_number)) > self.segment_end :
+                        # cut off a record left half written by a crash so the next one isn't glued onto it
+                        truncate(self.segment_path(self.segment_number), self.segment_end)
+                    self.segment = open(self.segment_path(self.segment_number), 'ab')
+
+                # append the record and point the index at it (flushed so reads by offset see it)
+                offset = self.segment.tell()
+                self.segment.write(record)
+                self.segment.flush()
+                self.index[key] = (self.segment_number, offset, len(record))
+            return True
+
+    def iter_records(self) -> Iterator[dict] :
+        """
+        iter_records -- This function reads the latest copy of every document
+        in the store.
+
+        Yields:
+            Every document of the store.
+        """
+        with self.lock :
+            keys = list(self.index)
+        for key in keys :
+            record = self.read(key)
+            if record is not None :
+                yield record
+
+    def close(self) -> None :
+        """
+        close -- This function closes the current segment and every file read
+        from then saves the index so the next run doesn't have to rebuild it.
+        """
+        with self.lock :
+            if self.segment is not None :
+                self.segment.close()
+                self.segment = None
+            for fd in self.read_fds.values() :
+                close(fd)
+            self.read_fds.clear()
+            self.save_index()
+
+# functions
+
+def set_segment_store(enabled : bool, compression : str = 'none') -> None :
+    """
+    set_segment_store -- This function picks if disk mode keeps documents in
+    append only segments instead of one json file per document.
+
+    Arguments:
+        enabled -- When enabled documents go to segments
+
+    Keyword Arguments:
+        compression -- Compression applied to every record found in
+        segment_compressions ( default : 'none' )
+
+    Raises:
+        ValueError: The compression is unknown
+        ImportError: zstd was picked and zstandard isn't installed
+    """
+    if compression not in segment_compressions :
+        raise ValueError(f'unknown segment compression {compression} (pick one of {segment_compressions})')
+    if compression == 'zstd' and zstandard is None :
+        raise ImportError('zstd segments need zstandard installed (pip install zstandard)')
+
+    global segment_store_enabled, segment_compression
+    segment_store_enabled = enabled
+    segment_compression = compression
+
+def uses_segment_store() -> bool :
+    """
+    uses_segment_store -- This function tells if disk mode keeps documents in
+    segments.
+
+    Returns:
+        True if set_segment_store enabled the segments.
+    """
+    return segment_store_enabled
+
+def get_segment_store(data_path : str) -> SegmentStore :
+    """
+    get_segment_store -- This function grabs the store of a data directory and
+    opens it (loading or rebuilding its index) the first time.
+
+    Arguments:
+        data_path -- The data directory
+
+    Returns:
+        The store of the data directory.
+    """
+    with segment_stores_lock :
+        if data_path not in segment_stores :
+            segment_stores[data_path] = SegmentStore(data_path)
+        return segment_stores[data_path]
+
+def close_segment_stores() -> None :
+    """
+    close_segment_stores -- This function closes every open store and saves
+    their index so the next run doesn't have to rebuild it. This should be
+    called once all of the scrubbing is finished.
+    """
+    with segment_stores_lock :
+        for store in segment_stores.values() :
+            store.close()
+        segment_stores.clear()
+
+def compress_record(record : bytes) -> bytes :
+    """
+    compress_record -- This function compresses one record on its own so it can
+    be read back by offset.
+
+    Arguments:
+        record -- The JSON line of a document
+
+    Returns:
+        The record compressed with the compression in use.
+    """
+    if segment_compression == 'gzip' :
+        return gzip.compress(record)
+    if segment_compression == 'zstd' :
+        return zstandard.ZstdCompressor(write_content_size=True).compress(record)
+    return record
+
+def decompress_record(data : bytes) -> bytes :
+    """
+    decompress_record -- This function undoes compress_record.
+
+    Arguments:
+        data -- The record as it was written to the segment
+
+    Returns:
+        The JSON line of the document.
+    """
+    if segment_compression == 'gzip' :
+        return gzip.decompress(data)
+    if segment_compression == 'zstd' :
+        return zstandard.ZstdDecompressor().decompress(data)
+    return data
+
+def compressed_record_length(data : bytes, offset : int) -> int | None :
+    """
+    compressed_record_length -- This function finds the length of the
+    compressed record starting at an offset of a segment.
+
+    Arguments:
+        data -- The whole segment
+        offset -- Where the record starts
+
+    Returns:
+        Length of the record or NoneType Object if it was cut short.
+    """
+    # records are decompressed one member / frame at a time and the leftover data tells where the next starts
+    if segment_compression == 'zstd' :
+        decompressor = zstandard.ZstdDecompressor().decompressobj()
+        errors = (zstandard.ZstdError,)
+    else :
+        decompressor = gzip.zlib.decompressobj(16 + gzip.zlib.MAX_WBITS)
+        errors = (gzip.zlib.error,)
+    position = offset
+    try :
+        while not decompressor.eof and position < len(data) :
+            decompressor.decompress(data[position:position + segment_scan_chunk])
+            position += segment_scan_chunk
+    except errors :
+        return None
+    if not decompressor.eof :
+        return None
+    return min(position, len(data)) - offset - len(decompressor.unused_data)